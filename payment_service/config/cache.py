@@ -0,0 +1,226 @@
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import SyncToAsync
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.functional import cached_property
+
+from .metrics import CACHE_REQUESTS
+
+_MISSING = object()
+LOCAL_HITS = CACHE_REQUESTS.labels("local", "hit")
+LOCAL_MISSES = CACHE_REQUESTS.labels("local", "miss")
+SHARED_HITS = CACHE_REQUESTS.labels("shared", "hit")
+SHARED_MISSES = CACHE_REQUESTS.labels("shared", "miss")
+
+# Экземпляры кэша в Django свои у каждого потока (под gevent - у каждого
+# гринлета), а локальный уровень должен быть общим на процесс
+_local_stores = {}
+
+
+def _in_sync_to_async():
+    # Поток из sync_to_async: под ASGI в нем идут синхронные view
+    loop = getattr(SyncToAsync.threadlocal, "main_event_loop", None)
+    return loop is not None
+
+
+class SharedCacheHandler:
+    """
+    Бэкенды кэша, общие для всех потоков процесса. В caches у каждого
+    гринлета свой экземпляр RedisCache и с ним свой пул соединений
+    """
+
+    def __init__(self):
+        self._backends = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, alias):
+        backend = self._backends.get(alias)
+        if backend is None:
+            with self._lock:
+                backend = self._backends.get(alias)
+                if backend is None:
+                    backend = caches.create_connection(alias)
+                    self._backends[alias] = backend
+        return backend
+
+    def reset(self):
+        with self._lock:
+            self._backends.clear()
+
+
+shared_caches = SharedCacheHandler()
+
+
+@receiver(setting_changed)
+def reset_cache_stores(setting, **kwargs):
+    if setting == "CACHES":
+        shared_caches.reset()
+        _local_stores.clear()
+
+
+class TieredCache(BaseCache):
+    """
+    Двухуровневый кэш: LRU в памяти процесса перед общим для всех воркеров
+    кэшем (LOCATION - его алиас в CACHES). Локальная копия живет не дольше
+    LOCAL_TIMEOUT секунд: изменения из других процессов видны с этой
+    задержкой. Ключи и версии - как у общего кэша, значения в памяти
+    процесса не копируются, менять их нельзя
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.shared_alias = location
+        self.local_timeout = options.get("LOCAL_TIMEOUT", 5)
+        self.local_max_entries = options.get("LOCAL_MAX_ENTRIES", 5000)
+        # Пока значение считает один процесс, остальные ждут до LOCK_WAIT
+        self.lock_timeout = options.get("LOCK_TIMEOUT", 10)
+        self.lock_wait = options.get("LOCK_WAIT", 2)
+        self._local, self._lock = _local_stores.setdefault(
+            location, (OrderedDict(), threading.Lock())
+        )
+
+    @cached_property
+    def shared(self):
+        return shared_caches[self.shared_alias]
+
+    def _key(self, key, version):
+        return self.shared.make_and_validate_key(key, version=version)
+
+    def _local_get(self, local_key):
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return _MISSING
+            if entry[0] <= time.monotonic():
+                del self._local[local_key]
+                return _MISSING
+            self._local.move_to_end(local_key)
+            return entry[1]
+
+    def _local_set(self, local_key, value, timeout=DEFAULT_TIMEOUT):
+        ttl = self.local_timeout
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None:
+            ttl = min(ttl, timeout)
+        with self._lock:
+            if ttl <= 0:
+                self._local.pop(local_key, None)
+                return
+            self._local[local_key] = (time.monotonic() + ttl, value)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self.local_max_entries:
+                self._local.popitem(last=False)
+
+    def _local_delete(self, local_keys):
+        with self._lock:
+            for local_key in local_keys:
+                self._local.pop(local_key, None)
+
+    def get(self, key, default=None, version=None):
+        local_key = self._key(key, version)
+        value = self._local_get(local_key)
+        if value is not _MISSING:
+            LOCAL_HITS.inc()
+            return value
+        LOCAL_MISSES.inc()
+        value = self.shared.get(key, _MISSING, version)
+        if value is _MISSING:
+            SHARED_MISSES.inc()
+            return default
+        SHARED_HITS.inc()
+        self._local_set(local_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        found, remote = {}, []
+        for key in keys:
+            value = self._local_get(self._key(key, version))
+            if value is _MISSING:
+                remote.append(key)
+            else:
+                found[key] = value
+        LOCAL_HITS.inc(len(found))
+        LOCAL_MISSES.inc(len(remote))
+        if remote:
+            fetched = self.shared.get_many(remote, version)
+            SHARED_HITS.inc(len(fetched))
+            SHARED_MISSES.inc(len(remote) - len(fetched))
+            for key, value in fetched.items():
+                self._local_set(self._key(key, version), value)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version)
+        self._local_set(self._key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version)
+        for key, value in data.items():
+            self._local_set(self._key(key, version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version)
+        if added:
+            self._local_set(self._key(key, version), value, timeout)
+        return added
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Защита от лавины промахов: значение считает процесс, взявший
+        блокировку в общем кэше, остальные ждут его результат. В потоке
+        sync_to_async не ждут, а считают сами: sleep занял бы поток,
+        через который ASGI выполняет синхронный код
+        """
+        value = self.get(key, _MISSING, version)
+        if value is not _MISSING:
+            return value
+        lock_key = f"{key}:lock"
+        lock_wait = 0 if _in_sync_to_async() else self.lock_wait
+        deadline = time.monotonic() + lock_wait
+        locked = self.shared.add(lock_key, 1, self.lock_timeout, version)
+        while not locked and time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = self.shared.get(key, _MISSING, version)
+            if value is not _MISSING:
+                self._local_set(self._key(key, version), value)
+                return value
+            locked = self.shared.add(lock_key, 1, self.lock_timeout, version)
+        try:
+            value = default() if callable(default) else default
+            self.set(key, value, timeout, version)
+        finally:
+            if locked:
+                self.shared.delete(lock_key, version)
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self._local_delete([self._key(key, version)])
+        return self.shared.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        self._local_delete([self._key(key, version) for key in keys])
+        self.shared.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        if self._local_get(self._key(key, version)) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local_delete([self._key(key, version)])
+        return self.shared.incr(key, delta, version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
@@ -0,0 +1,134 @@
+import os
+import time
+from contextvars import ContextVar
+
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates, Template
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Процесс с PROMETHEUS_MULTIPROC_DIR без каталога падает на первой же
+# метрике: так было бы с migrate до старта gunicorn и воркерами очередей.
+# Мастер gunicorn дополнительно очищает каталог при старте (on_starting)
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+REQUEST_LATENCY = Histogram(
+    "payment_service_request_latency_seconds",
+    "Время обработки запроса",
+    ["view", "method", "status"],
+)
+REQUEST_DB_QUERIES = Histogram(
+    "payment_service_request_db_queries",
+    "SQL запросов на один запрос",
+    ["view"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+REQUEST_DB_TIME = Histogram(
+    "payment_service_request_db_seconds",
+    "Суммарное время SQL запросов на один запрос",
+    ["view"],
+)
+TEMPLATE_RENDER_TIME = Histogram(
+    "payment_service_template_render_seconds",
+    "Время рендера шаблона",
+    ["template"],
+)
+STRIPE_REQUEST_LATENCY = Histogram(
+    "payment_service_stripe_request_seconds",
+    "Время запроса в Stripe вместе с повторами",
+    ["outcome"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40),
+)
+CACHE_REQUESTS = Counter(
+    "payment_service_cache_requests_total",
+    "Обращения к уровням кэша",
+    ["tier", "result"],
+)
+RATE_LIMITED = Counter(
+    "payment_service_rate_limited_total",
+    "Запросы, отклоненные лимитом частоты",
+    ["scope"],
+)
+STRIPE_ERRORS = Counter(
+    "payment_service_stripe_errors_total",
+    "Ошибки запросов в Stripe",
+    ["kind"],
+)
+
+
+class RequestStats:
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+
+
+# Статистика текущего запроса, если он попал в выборку. ContextVar
+# переживает sync_to_async, поэтому работает и под ASGI
+request_stats = ContextVar("request_stats", default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    stats = request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def install_query_counter(sender, connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+connection_created.connect(install_query_counter)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        if request_stats.get() is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            TEMPLATE_RENDER_TIME.labels(
+                self.template.origin.template_name or "<string>"
+            ).observe(time.perf_counter() - started)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates, который замеряет рендер шаблонов верхнего уровня"""
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+
+def metrics_view(request):
+    # В multiprocess режиме каждый воркер gunicorn пишет метрики в файлы
+    # PROMETHEUS_MULTIPROC_DIR, здесь они собираются в общий ответ
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(
+        generate_latest(registry),
+        content_type=CONTENT_TYPE_LATEST,
+    )
@@ -0,0 +1,80 @@
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.sessions.middleware import (
+    SessionMiddleware as DjangoSessionMiddleware,
+)
+
+from .metrics import (
+    REQUEST_DB_QUERIES,
+    REQUEST_DB_TIME,
+    REQUEST_LATENCY,
+    RequestStats,
+    request_stats,
+)
+
+
+class MetricsMiddleware:
+    """
+    Метрики запроса: время ответа, число и время SQL запросов, рендер
+    шаблонов. В выборку попадает METRICS_SAMPLE_RATE доля запросов
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def _start(self):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return None, None
+        stats = RequestStats()
+        return stats, request_stats.set(stats)
+
+    def _finish(self, request, response, stats, token, started):
+        request_stats.reset(token)
+        match = request.resolver_match
+        view = match.view_name if match else "<unmatched>"
+        REQUEST_LATENCY.labels(
+            view, request.method, f"{response.status_code // 100}xx"
+        ).observe(time.perf_counter() - started)
+        REQUEST_DB_QUERIES.labels(view).observe(stats.db_queries)
+        REQUEST_DB_TIME.labels(view).observe(stats.db_time)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, token = self._start()
+        if stats is None:
+            return self.get_response(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._finish(request, response, stats, token, started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token = self._start()
+        if stats is None:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._finish(request, response, stats, token, started)
+        return response
+
+
+class SessionMiddleware(DjangoSessionMiddleware):
+    """
+    Сессия, которая не трогает ответы каталога (SESSIONLESS_PATH_PREFIXES):
+    они одинаковы для всех и не должны получать Set-Cookie и Vary: Cookie
+    """
+
+    def process_response(self, request, response):
+        if request.path_info.startswith(settings.SESSIONLESS_PATH_PREFIXES):
+            return response
+        return super().process_response(request, response)
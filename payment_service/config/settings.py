@@ -10,16 +10,16 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv("DJANGO_SECRET_KEY")
 
-DEBUG = os.getenv("DJANGO_DEBUG")
+DEBUG = os.getenv("DJANGO_DEBUG") == "True"
 
 ALLOWED_HOSTS = os.getenv("DJANGO_ALLOWED_HOSTS").split(",")
 
 CSRF_TRUSTED_ORIGINS = [
-    'https://kirillblog.ru',
-    'https://www.kirillblog.ru',
+    "https://kirillblog.ru",
+    "https://www.kirillblog.ru",
 ]
 
-SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
 SECURE_SSL_REDIRECT = True
 SESSION_COOKIE_SECURE = True
 CSRF_COOKIE_SECURE = True
@@ -37,8 +37,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "config.middleware.MetricsMiddleware",
+    "payments.ratelimit.RateLimitMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    "config.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
@@ -50,22 +52,36 @@ ROOT_URLCONF = "config.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": "config.metrics.InstrumentedDjangoTemplates",
         "DIRS": [
             BASE_DIR / "templates",
         ],
-        "APP_DIRS": True,
         "OPTIONS": {
             "context_processors": [
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
             ],
+            # Шаблоны компилируются один раз на процесс; runserver
+            # сбрасывает этот кэш при изменении шаблонов
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                ),
+            ],
         },
     },
 ]
 
 WSGI_APPLICATION = "config.wsgi.application"
+ASGI_APPLICATION = "config.asgi.application"
+
+# wsgi - gevent воркеры, asgi - uvicorn воркеры и асинхронные вьюхи
+SERVER_MODE = os.getenv("SERVER_MODE", "wsgi")
 
 DATABASES = {
     "default": {
@@ -75,33 +91,39 @@ DATABASES = {
         "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
         "HOST": os.getenv("POSTGRES_HOST"),
         "PORT": os.getenv("POSTGRES_PORT"),
+        # Проверяем соединение перед выдачей запросу (и из пула тоже)
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Пул соединений psycopg 3 на каждый воркер: под gevent каждая гринлет
+# иначе держит свое соединение и быстро выбирает max_connections Postgres.
+# Воркеров gunicorn * DB_POOL_MAX_SIZE должно быть меньше max_connections
+if os.getenv("DB_POOL", "True") == "True":
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+            # Сколько секунд запрос ждет свободное соединение
+            "timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+            "max_idle": float(os.getenv("DB_POOL_MAX_IDLE", 300)),
+            "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", 3600)),
+        },
+    }
+else:
+    # Без пула (например, за PgBouncer) держим постоянные соединения
+    DATABASES["default"]["CONN_MAX_AGE"] = int(
+        os.getenv("DB_CONN_MAX_AGE", 60),
+    )
+
 AUTH_PASSWORD_VALIDATORS = [
-    {
-        "NAME": (
-            "django.contrib.auth.password_validation"
-            ".UserAttributeSimilarityValidator"
-        ),
-    },
-    {
-        "NAME": (
-            "django.contrib.auth.password_validation." "MinimumLengthValidator"
-        ),
-    },
-    {
-        "NAME": (
-            "django.contrib.auth.password_validation."
-            "CommonPasswordValidator"
-        ),
-    },
-    {
-        "NAME": (
-            "django.contrib.auth.password_validation."
-            "NumericPasswordValidator"
-        ),
-    },
+    {"NAME": f"django.contrib.auth.password_validation.{name}"}
+    for name in (
+        "UserAttributeSimilarityValidator",
+        "MinimumLengthValidator",
+        "CommonPasswordValidator",
+        "NumericPasswordValidator",
+    )
 ]
 
 
@@ -116,7 +138,137 @@ USE_TZ = True
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+# Имена статики с хэшем содержимого (collectstatic): nginx отдает их
+# с Cache-Control immutable, новая версия файла - новый URL.
+# Рядом collectstatic кладет сжатые .gz/.br копии.
+# В DEBUG манифеста нет, статику отдает runserver из приложений
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": (
+            "django.contrib.staticfiles.storage.StaticFilesStorage"
+            if DEBUG
+            else "config.storage.CompressedManifestStaticFilesStorage"
+        ),
+    },
+}
+
 
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY")
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_API_VERSION = os.getenv("STRIPE_API_VERSION")
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE")  # для локальной заглушки Stripe
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+
+# Воркер очереди вебхуков: размер пачки и пауза, когда очередь пуста
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 500))
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", 1))
+
+# Воркер синхронизации товаров с продуктами Stripe: пачка, пауза и
+# задержка повтора после ошибки (удваивается до максимума)
+STRIPE_SYNC_BATCH_SIZE = int(os.getenv("STRIPE_SYNC_BATCH_SIZE", 50))
+STRIPE_SYNC_POLL_INTERVAL = float(os.getenv("STRIPE_SYNC_POLL_INTERVAL", 5))
+STRIPE_SYNC_RETRY_DELAY = int(os.getenv("STRIPE_SYNC_RETRY_DELAY", 30))
+STRIPE_SYNC_MAX_RETRY_DELAY = int(
+    os.getenv("STRIPE_SYNC_MAX_RETRY_DELAY", 3600),
+)
+
+# Исходящие запросы в Stripe: пул соединений на воркер, таймауты,
+# повторы (с джиттером, силами stripe-python) и предохранитель
+STRIPE_POOL_SIZE = int(os.getenv("STRIPE_POOL_SIZE", 10))
+STRIPE_KEEPALIVE_EXPIRY = float(os.getenv("STRIPE_KEEPALIVE_EXPIRY", 30))
+STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", 5))
+STRIPE_READ_TIMEOUT = float(os.getenv("STRIPE_READ_TIMEOUT", 20))
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv("STRIPE_MAX_NETWORK_RETRIES", 2))
+STRIPE_CIRCUIT_FAILURE_THRESHOLD = int(
+    os.getenv("STRIPE_CIRCUIT_FAILURE_THRESHOLD", 5),
+)
+STRIPE_CIRCUIT_RESET_TIMEOUT = float(
+    os.getenv("STRIPE_CIRCUIT_RESET_TIMEOUT", 30),
+)
+# Одновременных запросов в Stripe на процесс; сверх лимита - сразу 503
+STRIPE_MAX_IN_FLIGHT = int(os.getenv("STRIPE_MAX_IN_FLIGHT", 20))
+
+# Общий для всех процессов кэш - Redis; без REDIS_URL (локально, в тестах)
+# его заменяет файловый кэш. CACHE_VERSION сбрасывает все ключи разом
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    SHARED_CACHE = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+    }
+else:
+    SHARED_CACHE = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv("CACHE_DIR", "/tmp/payment_service_cache"),
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+
+CACHES = {
+    # Перед общим кэшем - LRU в памяти воркера: горячие ключи не ходят
+    # в Redis, но изменения из других процессов видны через CACHE_LOCAL_TIMEOUT
+    "default": {
+        "BACKEND": "config.cache.TieredCache",
+        "LOCATION": "shared",
+        "OPTIONS": {
+            "LOCAL_TIMEOUT": int(os.getenv("CACHE_LOCAL_TIMEOUT", 5)),
+            "LOCAL_MAX_ENTRIES": int(
+                os.getenv("CACHE_LOCAL_MAX_ENTRIES", 5000),
+            ),
+        },
+    },
+    # Без локального уровня - для того, что должно меняться сразу везде
+    "shared": {
+        **SHARED_CACHE,
+        "KEY_PREFIX": "payment",
+        "VERSION": int(os.getenv("CACHE_VERSION", 1)),
+    },
+}
+
+# Сессия (ID покупателя, корзина) - подписанная cookie: без запросов к БД
+# и кэшу. На страницах каталога сессия не сохраняется и не добавляет
+# Vary: Cookie, их кэшируют nginx и браузер
+SESSION_ENGINE = "django.contrib.sessions.backends.signed_cookies"
+SESSIONLESS_PATH_PREFIXES = ("/item/", "/api/items/")
+
+# Каталог: товаров на странице и сколько живет отрендеренная карточка
+ITEMS_PAGE_SIZE = int(os.getenv("ITEMS_PAGE_SIZE", 24))
+ITEM_CARD_CACHE_TIMEOUT = int(os.getenv("ITEM_CARD_CACHE_TIMEOUT", 86400))
+# Страница товара: сколько живет в кэше и сколько ее держат nginx/браузер
+ITEM_PAGE_CACHE_TIMEOUT = int(os.getenv("ITEM_PAGE_CACHE_TIMEOUT", 86400))
+ITEM_PAGE_MAX_AGE = int(os.getenv("ITEM_PAGE_MAX_AGE", 60))
+
+# JSON API каталога
+API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", 50))
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", 500))
+API_CACHE_TIMEOUT = int(os.getenv("API_CACHE_TIMEOUT", 3600))
+API_MAX_AGE = int(os.getenv("API_MAX_AGE", 60))
+
+# Сколько секунд воркер держит в памяти активные скидки и налоги
+PRICING_RULES_TTL = int(os.getenv("PRICING_RULES_TTL", 60))
+
+# Доля запросов, для которых собираются метрики (0 - выключено)
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", 1))
+
+# Token bucket на создание сессий оплаты: токенов в секунду и размер
+# ведра на IP клиента и на все воркеры вместе (лимиты Stripe - на аккаунт)
+RATE_LIMITED_VIEWS = {
+    "create_checkout_session",
+    "create_cart_checkout_session",
+}
+RATE_LIMIT_IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", 1))
+RATE_LIMIT_IP_BURST = int(os.getenv("RATE_LIMIT_IP_BURST", 10))
+RATE_LIMIT_GLOBAL_RATE = float(os.getenv("RATE_LIMIT_GLOBAL_RATE", 20))
+RATE_LIMIT_GLOBAL_BURST = int(os.getenv("RATE_LIMIT_GLOBAL_BURST", 50))
+# Адреса и сети прокси (nginx), которым верим X-Forwarded-For: от
+# остальных этот заголовок подделывается, и лимит по IP легко обойти
+TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",")
+
+# Время жизни сессии оплаты (от 1800 до 43200 секунд) и запас, при котором
+# сессия еще переиспользуется повторными запросами /buy/
+CHECKOUT_SESSION_TTL = int(os.getenv("CHECKOUT_SESSION_TTL", 1800))
+CHECKOUT_SESSION_REUSE_MARGIN = int(
+    os.getenv("CHECKOUT_SESSION_REUSE_MARGIN", 60),
+)
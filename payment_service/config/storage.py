@@ -0,0 +1,40 @@
+import gzip
+
+import brotli
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".map", ".svg", ".json", ".txt")
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Статика с хэшем в имени и готовыми .gz/.br рядом с файлом:
+    nginx отдает их через gzip_static/brotli_static, не сжимая на лету
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(
+            paths, dry_run, **options
+        ):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for hashed_name in sorted(hashed_names):
+            if hashed_name.endswith(COMPRESSIBLE_EXTENSIONS):
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        with self.open(name) as source:
+            content = source.read()
+        path = self.path(name)
+        for suffix, compressed in (
+            (".gz", gzip.compress(content, compresslevel=9, mtime=0)),
+            (".br", brotli.compress(content, quality=11)),
+        ):
+            # Мелкие файлы сжатием не уменьшить, их nginx отдаст как есть
+            if len(compressed) < len(content):
+                with open(path + suffix, "wb") as target:
+                    target.write(compressed)
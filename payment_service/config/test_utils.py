@@ -0,0 +1,39 @@
+"""Общие настройки тестов приложений"""
+
+import importlib.util
+from unittest import mock
+
+from django.conf import settings
+
+# Двухуровневый кэш поверх LocMemCache вместо Redis
+TEST_CACHES = {
+    "default": {
+        "BACKEND": "config.cache.TieredCache",
+        "LOCATION": "shared",
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
+
+# Манифест статики появляется только после collectstatic,
+# тестам хватает файлов из приложений
+TEST_STORAGES = {
+    **settings.STORAGES,
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
+
+def load_gunicorn_config(**env):
+    """Модуль gunicorn.py с профилем prod и переменными окружения env"""
+    spec = importlib.util.spec_from_file_location(
+        "gunicorn_config", settings.BASE_DIR / "gunicorn.py"
+    )
+    config = importlib.util.module_from_spec(spec)
+    # asgi - чтобы загрузка конфига не патчила stdlib через gevent
+    env = {"GUNICORN_PROFILE": "prod", "SERVER_MODE": "asgi", **env}
+    with mock.patch.dict("os.environ", env):
+        spec.loader.exec_module(config)
+    return config
@@ -0,0 +1,363 @@
+import gzip
+import io
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import brotli
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+from django.urls import reverse
+from prometheus_client.parser import text_string_to_metric_families
+
+from items.models import Item
+
+from .cache import TieredCache, shared_caches
+from .middleware import SessionMiddleware
+from .storage import CompressedManifestStaticFilesStorage
+from .test_utils import TEST_CACHES, TEST_STORAGES, load_gunicorn_config
+
+
+class CompressedStaticStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.source = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.files = {
+            "app.js": "console.log('каталог');\n".encode() * 100,
+            "tiny.css": b"a{}",
+            "logo.png": b"\x89PNG" + b"\0" * 500,
+        }
+        for name, content in self.files.items():
+            (self.source / name).write_bytes(content)
+        self.storage = CompressedManifestStaticFilesStorage(
+            location=self.root,
+        )
+
+    def collect(self):
+        # Как collectstatic: копия файла, затем post_process
+        source = FileSystemStorage(location=self.source)
+        for name in self.files:
+            with source.open(name) as content:
+                self.storage.save(name, content)
+        paths = {name: (source, name) for name in self.files}
+        for name, hashed_name, processed in self.storage.post_process(paths):
+            self.assertNotIsInstance(processed, Exception)
+
+    def test_compressed_copies_next_to_hashed_file(self):
+        self.collect()
+
+        hashed = self.root / self.storage.stored_name("app.js")
+        self.assertNotEqual(hashed.name, "app.js")
+        content = self.files["app.js"]
+        gz = Path(f"{hashed}.gz").read_bytes()
+        br = Path(f"{hashed}.br").read_bytes()
+        self.assertEqual(gzip.decompress(gz), content)
+        self.assertEqual(brotli.decompress(br), content)
+        # Исходное имя без хэша nginx не кэширует, его не сжимаем
+        self.assertFalse((self.root / "app.js.gz").exists())
+
+    def test_small_and_binary_files_are_skipped(self):
+        self.collect()
+
+        for name in ("tiny.css", "logo.png"):
+            with self.subTest(name=name):
+                hashed = self.root / self.storage.stored_name(name)
+                self.assertTrue(hashed.exists())
+                self.assertFalse(Path(f"{hashed}.gz").exists())
+                self.assertFalse(Path(f"{hashed}.br").exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = TieredCache(
+            "shared",
+            {"OPTIONS": {"LOCAL_TIMEOUT": 5, "LOCAL_MAX_ENTRIES": 2}},
+        )
+        self.cache.clear()
+        self.shared = shared_caches["shared"]
+
+    def test_local_lru_evicts_least_recently_used(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        # Общий кэш меняется мимо локального: видно, что осталось в памяти
+        self.shared.set_many({"a": 10, "b": 20, "c": 30})
+
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("b"), 20)
+        self.assertEqual(len(self.cache._local), 2)
+
+    def test_local_copy_expires_after_local_timeout(self):
+        now = time.monotonic()
+        with mock.patch("config.cache.time.monotonic", return_value=now):
+            self.cache.set("key", "old")
+            self.shared.set("key", "new")
+            self.assertEqual(self.cache.get("key"), "old")
+        with mock.patch("config.cache.time.monotonic", return_value=now + 5):
+            self.assertEqual(self.cache.get("key"), "new")
+
+    def test_versions_are_separate_keys(self):
+        self.cache.set("key", "v1", version=1)
+        self.cache.set("key", "v2", version=2)
+
+        self.assertEqual(self.cache.get("key", version=1), "v1")
+        self.assertEqual(self.cache.get("key", version=2), "v2")
+        self.cache.delete("key", version=2)
+        self.assertIsNone(self.cache.get("key", version=2))
+        self.assertIsNone(self.shared.get("key", version=2))
+        self.assertEqual(self.cache.get("key", version=1), "v1")
+
+    def test_get_or_set_computes_once_under_stampede(self):
+        calls = []
+        computing = threading.Event()
+        release = threading.Event()
+
+        def compute():
+            calls.append(1)
+            computing.set()
+            release.wait(5)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    self.cache.get_or_set("key", compute),
+                ),
+            )
+            for _ in range(3)
+        ]
+        threads[0].start()
+        computing.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ["value"] * 3)
+        self.assertIsNone(self.shared.get("key:lock"))
+
+    def test_get_or_set_does_not_wait_in_sync_to_async(self):
+        # Блокировку держит другой процесс
+        self.shared.add("key:lock", 1)
+        get_or_set = async_to_sync(sync_to_async(self.cache.get_or_set))
+
+        with mock.patch("config.cache.time.sleep") as sleep:
+            self.assertEqual(get_or_set("key", "value"), "value")
+        sleep.assert_not_called()
+        self.assertEqual(self.shared.get("key:lock"), 1)
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    STORAGES=TEST_STORAGES,
+    SECURE_SSL_REDIRECT=False,
+    METRICS_SAMPLE_RATE=1,
+)
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = Item.objects.create(name="Кружка", description="", price=1)
+
+    def scrape(self):
+        """{(имя образца, метки): значение} из /metrics"""
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        return {
+            (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in text_string_to_metric_families(
+                response.content.decode(),
+            )
+            for sample in family.samples
+        }
+
+    def test_request_is_counted_by_view_name(self):
+        latency = (
+            "payment_service_request_latency_seconds_count",
+            (("method", "GET"), ("status", "2xx"), ("view", "item_detail")),
+        )
+        not_found = (
+            "payment_service_request_latency_seconds_count",
+            (("method", "GET"), ("status", "4xx"), ("view", "<unmatched>")),
+        )
+        queries = (
+            "payment_service_request_db_queries_count",
+            (("view", "item_detail"),),
+        )
+        before = self.scrape()
+
+        self.client.get(reverse("item_detail", args=[self.item.pk]))
+        self.client.get("/no-such-page/")
+
+        after = self.scrape()
+        self.assertEqual(after[latency] - before.get(latency, 0), 1)
+        self.assertEqual(after[not_found] - before.get(not_found, 0), 1)
+        self.assertEqual(after[queries] - before.get(queries, 0), 1)
+        # Метка - имя маршрута, а не путь: у каждого товара свой путь
+        views = {
+            dict(labels).get("view")
+            for name, labels in after
+            if name.startswith("payment_service_request_")
+        }
+        self.assertIn("item_detail", views)
+        self.assertFalse([view for view in views if "/" in str(view)])
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    STORAGES=TEST_STORAGES,
+    SECURE_SSL_REDIRECT=False,
+)
+class SessionMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = Item.objects.create(name="Кружка", description="", price=1)
+        cls.admin = User.objects.create_superuser("admin", password="secret")
+
+    def catalogue_urls(self):
+        return [
+            reverse("items_list"),
+            reverse("item_detail", args=[self.item.pk]),
+            reverse("api_items"),
+        ]
+
+    def assertNotPersonalised(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.cookies, {})
+        self.assertNotIn("cookie", response.get("Vary", "").lower())
+
+    def test_catalogue_sends_no_session_cookie(self):
+        for url in self.catalogue_urls():
+            with self.subTest(url=url):
+                self.assertNotPersonalised(self.client.get(url))
+
+    def test_catalogue_ignores_existing_session(self):
+        # Кэш nginx общий: вошедший в админку видит те же страницы
+        self.client.force_login(self.admin)
+        for url in self.catalogue_urls():
+            with self.subTest(url=url):
+                self.assertNotPersonalised(self.client.get(url))
+
+    def test_modified_session_is_not_saved_on_catalogue(self):
+        def touch_session(request):
+            request.session["seen"] = True
+            return HttpResponse()
+
+        middleware = SessionMiddleware(touch_session)
+        factory = RequestFactory()
+        for path, personalised in (("/item/", False), ("/buy/cart/", True)):
+            with self.subTest(path=path):
+                request = factory.get(path)
+                middleware.process_request(request)
+                response = middleware(request)
+                self.assertEqual(
+                    settings.SESSION_COOKIE_NAME in response.cookies,
+                    personalised,
+                )
+                self.assertEqual(response.has_header("Vary"), personalised)
+
+    def test_admin_login_keeps_session(self):
+        response = self.client.post(
+            reverse("admin:login"),
+            {
+                "username": "admin",
+                "password": "secret",
+                "next": reverse("admin:index"),
+            },
+        )
+
+        self.assertRedirects(
+            response,
+            reverse("admin:index"),
+            fetch_redirect_response=False,
+        )
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(
+            self.client.get(reverse("admin:index")).status_code,
+            200,
+        )
+
+
+class GunicornSizingTests(SimpleTestCase):
+    """Воркеры и соединения gunicorn по CPU и памяти cgroup"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.config = load_gunicorn_config()
+
+    def sizing(self, files, cpus=8):
+        """(воркеры, соединения на воркер) при файлах cgroup files"""
+
+        def fake_open(path, *args, **kwargs):
+            if path not in files:
+                raise FileNotFoundError(path)
+            return io.StringIO(files[path])
+
+        with (
+            mock.patch.object(self.config, "open", fake_open, create=True),
+            mock.patch.object(
+                self.config,
+                "sched_getaffinity",
+                return_value=set(range(cpus)),
+            ),
+        ):
+            workers = self.config.max_workers()
+            return workers, self.config.max_worker_connections(workers)
+
+    def test_without_cgroup_files(self):
+        self.assertEqual(self.sizing({}), (9, 1000))
+        self.assertEqual(self.sizing({}, cpus=1), (2, 1000))
+
+    def test_cpu_quota(self):
+        for files, workers in (
+            ({"/sys/fs/cgroup/cpu.max": "max 100000\n"}, 9),
+            ({"/sys/fs/cgroup/cpu.max": "200000 100000\n"}, 3),
+            # Дробная квота округляется, но не меньше одного ядра
+            ({"/sys/fs/cgroup/cpu.max": "20000 100000\n"}, 2),
+            (
+                {
+                    "/sys/fs/cgroup/cpu/cpu.cfs_quota_us": "150000\n",
+                    "/sys/fs/cgroup/cpu/cpu.cfs_period_us": "100000\n",
+                },
+                3,
+            ),
+            ({"/sys/fs/cgroup/cpu/cpu.cfs_quota_us": "-1\n"}, 9),
+        ):
+            with self.subTest(files=files):
+                self.assertEqual(self.sizing(files), (workers, 1000))
+
+    def test_memory_limit_caps_workers(self):
+        files = {"/sys/fs/cgroup/cpu.max": "400000 100000\n"}
+        for memory, sizing in (
+            ("max\n", (5, 1000)),
+            (f"{2**62}\n", (5, 1000)),
+            # 300 МБ хватает на два воркера из пяти по CPU
+            (f"{300 * 2**20}\n", (2, 100)),
+            (f"{2000 * 2**20}\n", (5, 1000)),
+            (f"{1000 * 2**20}\n", (5, 200)),
+            (f"{100 * 2**20}\n", (1, 100)),
+        ):
+            with self.subTest(memory=memory):
+                limits = {**files, "/sys/fs/cgroup/memory.max": memory}
+                self.assertEqual(self.sizing(limits), sizing)
+        v1_limit = "/sys/fs/cgroup/memory/memory.limit_in_bytes"
+        self.assertEqual(
+            self.sizing({**files, v1_limit: f"{300 * 2**20}\n"}),
+            (2, 100),
+        )
@@ -2,9 +2,13 @@ from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("item/", include("items.urls")),
     path("buy/", include("payments.urls")),
+    path("api/", include("items.api_urls")),
+    path("metrics", metrics_view, name="metrics"),
     path("", RedirectView.as_view(url="/item/"), name="home"),
 ]
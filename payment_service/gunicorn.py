@@ -1,17 +1,150 @@
-from multiprocessing import cpu_count
-from os import environ
+import shutil
+from os import environ, makedirs, sched_getaffinity
+
+# dev - один-два воркера с автоперезагрузкой кода,
+# prod - воркеры по CPU и памяти контейнера, preload_app, без reload
+PROFILE = environ.get("GUNICORN_PROFILE", "prod")
+SERVER_MODE = environ.get("SERVER_MODE", "wsgi")
+
+# Сколько памяти закладываем на воркер и на одно соединение gevent
+WORKER_MEMORY_MB = int(environ.get("GUNICORN_WORKER_MEMORY_MB", 150))
+CONNECTION_MEMORY_KB = int(environ.get("GUNICORN_CONNECTION_MEMORY_KB", 256))
+MAX_WORKER_CONNECTIONS = 1000
+
+
+def _read_cgroup(*paths):
+    for path in paths:
+        try:
+            with open(path) as cgroup_file:
+                return cgroup_file.read().split()
+        except OSError:
+            continue
+    return None
+
+
+def cpu_limit():
+    """Число CPU с учетом affinity и квоты cgroup (docker --cpus)"""
+    cpus = len(sched_getaffinity(0))
+    quota = _read_cgroup("/sys/fs/cgroup/cpu.max")  # cgroup v2
+    if quota and quota[0] != "max":
+        cpus = min(cpus, int(quota[0]) / int(quota[1]))
+    else:
+        quota = _read_cgroup(
+            "/sys/fs/cgroup/cpu/cpu.cfs_quota_us",
+        )  # cgroup v1
+        period = _read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if quota and period and int(quota[0]) > 0:
+            cpus = min(cpus, int(quota[0]) / int(period[0]))
+    return max(1, round(cpus))
+
+
+def memory_limit_mb():
+    """Лимит памяти контейнера в МБ или None, если лимита нет"""
+    limit = _read_cgroup(
+        "/sys/fs/cgroup/memory.max",  # cgroup v2
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",  # cgroup v1
+    )
+    if not limit or limit[0] == "max":
+        return None
+    limit_mb = int(limit[0]) // 2**20
+    # Без лимита cgroup v1 отдает огромное число
+    return limit_mb if limit_mb < 2**30 else None
 
 
 def max_workers():
-    return cpu_count()
+    cpus = cpu_limit()
+    # gevent и uvicorn воркеры асинхронные: одного на ядро хватает,
+    # больше воркеров дает только лишнюю память
+    workers = cpus + 1
+    memory_mb = memory_limit_mb()
+    if memory_mb:
+        workers = min(workers, memory_mb // WORKER_MEMORY_MB)
+    return max(1, workers)
+
+
+def max_worker_connections(workers):
+    memory_mb = memory_limit_mb()
+    if not memory_mb:
+        return MAX_WORKER_CONNECTIONS
+    spare_kb = (memory_mb // workers - WORKER_MEMORY_MB) * 1024
+    return max(
+        100,
+        min(MAX_WORKER_CONNECTIONS, spare_kb // CONNECTION_MEMORY_KB),
+    )
 
 
 bind = "0.0.0.0:" + environ.get("PORT", "8000")
+name = "payment_service"
+env = {"DJANGO_SETTINGS_MODULE": "config.settings"}
+
+if SERVER_MODE == "asgi":
+    wsgi_app = "config.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    wsgi_app = "config.wsgi:application"
+    worker_class = "gevent"
+
+if PROFILE == "dev":
+    workers = int(environ.get("GUNICORN_WORKERS", 2))
+    reload = True
+    preload_app = False
+else:
+    workers = int(environ.get("GUNICORN_WORKERS", 0)) or max_workers()
+    reload = False
+    # Django импортируется один раз в мастере, воркеры делят память
+    # через copy-on-write. Код при этом перечитывается только рестартом
+    preload_app = True
+
+worker_connections = int(
+    environ.get("GUNICORN_WORKER_CONNECTIONS", 0)
+) or max_worker_connections(workers)
+
+# Перезапуск воркеров от утечек памяти; джиттер разносит рестарты во времени
 max_requests = 1000
-worker_class = "gevent"
-workers = max_workers()
+max_requests_jitter = 100
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
 
-env = {"DJANGO_SETTINGS_MODULE": "config.settings"}
+if preload_app and worker_class == "gevent":
+    # Приложение грузится в мастере до форка: патчим stdlib раньше, чем
+    # Django и stripe успеют импортировать ssl и socket
+    from gevent import monkey
 
-reload = True
-name = "payment_service"
+    monkey.patch_all()
+
+
+def on_starting(server):
+    # Файлы метрик прошлого запуска искажают счетчики
+    multiproc_dir = environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        makedirs(multiproc_dir)
+
+
+def pre_fork(server, worker):
+    # Соединения с БД и пулы, открытые мастером, нельзя делить между
+    # процессами: каждый воркер откроет свой пул при первом запросе
+    if preload_app:
+        from django.db import connections
+
+        connections.close_all()
+        for connection in connections.all(initialized_only=True):
+            if hasattr(connection, "close_pool"):
+                connection.close_pool()
+
+
+def post_fork(server, worker):
+    # Пул соединений и предохранитель Stripe созданы в мастере:
+    # каждому воркеру нужен свой
+    if preload_app:
+        from payments.stripe_client import configure_stripe
+
+        configure_stripe()
+
+
+def child_exit(server, worker):
+    if environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Item
+from .models import Discount, Item, SalesRollup, Tax
 from .forms import ItemForm
 
 
@@ -13,3 +13,45 @@ class ItemAdmin(admin.ModelAdmin):
 
     get_price_display.short_description = "Цена"
     get_price_display.admin_order_field = "price"
+
+
+@admin.register(Discount)
+class DiscountAdmin(admin.ModelAdmin):
+    list_display = ["name", "discount_type", "value", "is_active"]
+    list_filter = ["is_active"]
+
+
+@admin.register(Tax)
+class TaxAdmin(admin.ModelAdmin):
+    list_display = ["name", "tax_type", "value", "is_active"]
+    list_filter = ["is_active"]
+
+
+@admin.register(SalesRollup)
+class SalesRollupAdmin(admin.ModelAdmin):
+    """Только чтение: сводки ведет воркер вебхуков и rebuild_rollups"""
+
+    list_display = [
+        "period_start",
+        "granularity",
+        "item",
+        "get_revenue_display",
+        "units",
+        "order_count",
+    ]
+    list_select_related = ["item"]
+    list_filter = ["granularity", "period_start"]
+    raw_id_fields = ["item"]
+    ordering = ["-period_start"]
+
+    def get_revenue_display(self, obj):
+        return obj.revenue_display
+
+    get_revenue_display.short_description = "Выручка"
+    get_revenue_display.admin_order_field = "revenue"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
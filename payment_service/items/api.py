@@ -0,0 +1,230 @@
+import gzip
+import hashlib
+from datetime import date, datetime, time, timedelta
+
+import brotli
+import orjson
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import BadRequest
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.views import View
+
+from .catalogue import catalogue_version, parse_cursor
+from .models import Item, RollupGranularity, SalesRollup
+
+API_FIELDS = ("id", "name", "description", "price", "updated_at")
+SALES_FIELDS = ("period_start", "item_id", "revenue", "units", "order_count")
+MAX_SALES_DAYS = 366
+MAX_BATCH_IDS = 100
+# Сжимать имеет смысл только ответы больше пары сетевых пакетов
+MIN_COMPRESS_SIZE = 1024
+
+
+class ApiError(ValueError):
+    pass
+
+
+def _parse_int_list(value):
+    try:
+        return sorted({int(part) for part in value.split(",") if part})
+    except ValueError:
+        raise ApiError("ids должен быть списком целых чисел через запятую")
+
+
+def parse_params(query):
+    fields = ["id"]
+    for field in query.get("fields", ",".join(API_FIELDS)).split(","):
+        if field not in API_FIELDS:
+            raise ApiError(f"Неизвестное поле: {field}")
+        if field not in fields:
+            fields.append(field)
+
+    params = {"fields": fields}
+    if "ids" in query:
+        ids = _parse_int_list(query["ids"])
+        if not ids or len(ids) > MAX_BATCH_IDS:
+            raise ApiError(f"ids: от 1 до {MAX_BATCH_IDS} товаров")
+        params["ids"] = ids
+    else:
+        try:
+            limit = int(query.get("limit", settings.API_PAGE_SIZE))
+        except ValueError:
+            raise ApiError("limit должен быть целым числом")
+        try:
+            params["after"] = parse_cursor(query.get("after"))
+        except BadRequest as e:
+            raise ApiError(str(e))
+        params["limit"] = min(max(limit, 1), settings.API_MAX_PAGE_SIZE)
+    return params
+
+
+def build_payload(params):
+    """Один запрос values() и на пакетную выборку, и на страницу списка"""
+    queryset = Item.objects.values(*params["fields"]).order_by("pk")
+    if "ids" in params:
+        return {"items": list(queryset.filter(pk__in=params["ids"]))}
+
+    limit = params["limit"]
+    items = list(queryset.filter(pk__gt=params["after"])[: limit + 1])
+    next_after = items[limit - 1]["id"] if len(items) > limit else None
+    return {"items": items[:limit], "next_after": next_after}
+
+
+def parse_accept_encoding(header):
+    """{кодировка: q} из Accept-Encoding, без q - 1"""
+    weights = {}
+    for part in header.split(","):
+        coding, *params = part.split(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    return weights
+
+
+def choose_encoding(request):
+    """Кодировка с наибольшим q, при равных - br. q=0 ее запрещает"""
+    weights = parse_accept_encoding(request.headers.get("Accept-Encoding", ""))
+    best, best_weight = None, 0
+    for encoding in ("br", "gzip"):
+        weight = weights.get(encoding, weights.get("*", 0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def _cache_key(params, encoding):
+    raw = orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+    digest = hashlib.sha256(raw).hexdigest()
+    return f"api-items:{catalogue_version()}:{encoding}:{digest}"
+
+
+def get_api_response(params, encoding):
+    """
+    (ETag, Content-Encoding, тело) ответа. Ответы кэшируются уже
+    сжатыми, ключ включает версию каталога, которую сбрасывают сигналы
+    при изменении товаров
+    """
+
+    def build_entry():
+        body = orjson.dumps(build_payload(params))
+        etag = f'W/"{hashlib.md5(body).hexdigest()}"'
+        if encoding is None or len(body) < MIN_COMPRESS_SIZE:
+            return etag, None, body
+        return etag, encoding, compress(body, encoding)
+
+    return cache.get_or_set(
+        _cache_key(params, encoding), build_entry, settings.API_CACHE_TIMEOUT
+    )
+
+
+class ItemApiView(View):
+    """
+    GET /api/items/?ids=1,2,3 - пакетная выборка,
+    GET /api/items/?after=<id>&limit=<n> - список по курсору,
+    fields=id,name,... - выбор полей
+    """
+
+    def get(self, request):
+        try:
+            params = parse_params(request.GET)
+        except ApiError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        etag, encoding, body = get_api_response(
+            params,
+            choose_encoding(request),
+        )
+        response = HttpResponse(body, content_type="application/json")
+        response.headers["ETag"] = etag
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        patch_vary_headers(response, ["Accept-Encoding"])
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=settings.API_MAX_AGE,
+        )
+        return get_conditional_response(request, etag=etag, response=response)
+
+
+def _parse_day(query, name, default):
+    try:
+        return date.fromisoformat(query[name]) if name in query else default
+    except ValueError:
+        raise ApiError(f"{name} должен быть датой ГГГГ-ММ-ДД")
+
+
+def parse_sales_params(query):
+    granularity = query.get("granularity", RollupGranularity.DAY)
+    if granularity not in RollupGranularity.values:
+        raise ApiError("granularity: hour или day")
+    until = _parse_day(query, "to", timezone.localdate())
+    since = _parse_day(query, "from", until - timedelta(days=30))
+    if not 0 <= (until - since).days < MAX_SALES_DAYS:
+        raise ApiError(f"Период от 1 до {MAX_SALES_DAYS} дней")
+    item = query.get("item")
+    if item is not None and not item.isdigit():
+        raise ApiError("item должен быть целым числом")
+    return {
+        "granularity": granularity,
+        "start": timezone.make_aware(datetime.combine(since, time())),
+        "end": timezone.make_aware(
+            datetime.combine(until + timedelta(days=1), time()),
+        ),
+        "item": int(item) if item is not None else None,
+    }
+
+
+class SalesApiView(View):
+    """
+    GET /api/sales/?granularity=day&from=2026-01-01&to=2026-01-31&item=<id>
+    - продажи по периодам из сводок, без item - итоги по всем товарам.
+    Только для сотрудников
+    """
+
+    def get(self, request):
+        if not request.user.is_staff:
+            return JsonResponse({"error": "Доступ запрещен"}, status=403)
+        try:
+            params = parse_sales_params(request.GET)
+        except ApiError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        rollups = (
+            SalesRollup.objects.filter(
+                granularity=params["granularity"],
+                period_start__gte=params["start"],
+                period_start__lt=params["end"],
+                item_id=params["item"],
+            )
+            .order_by("period_start")
+            .values(*SALES_FIELDS)
+        )
+        response = HttpResponse(
+            orjson.dumps({"rollups": list(rollups)}),
+            content_type="application/json",
+        )
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
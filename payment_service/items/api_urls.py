@@ -0,0 +1,16 @@
+from django.urls import path
+
+from . import api
+
+urlpatterns = [
+    path(
+        "items/",
+        api.ItemApiView.as_view(),
+        name="api_items",
+    ),
+    path(
+        "sales/",
+        api.SalesApiView.as_view(),
+        name="api_sales",
+    ),
+]
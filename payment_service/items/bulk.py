@@ -0,0 +1,116 @@
+import csv
+import resource
+import sys
+from contextlib import contextmanager
+from decimal import Decimal
+
+import orjson
+from django.core.exceptions import ValidationError
+
+from .forms import ItemForm, to_minor_units
+from .models import Item
+
+ITEM_FIELDS = ("id", "name", "description", "price")
+FORMATS = ("csv", "jsonl")
+
+
+def detect_format(path, file_format=None):
+    if file_format:
+        return file_format
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+@contextmanager
+def open_stream(path, mode):
+    """Файл или stdin/stdout для пути "-" """
+    if path == "-":
+        yield sys.stdin if mode == "r" else sys.stdout
+        return
+    with open(path, mode, encoding="utf-8", newline="") as stream:
+        yield stream
+
+
+def read_rows(stream, file_format):
+    """
+    Построчно отдает пары (номер строки, словарь). Для битой строки JSONL
+    вместо словаря отдается None
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_num, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            row = None
+        yield line_num, row if isinstance(row, dict) else None
+
+
+def parse_item(row):
+    """
+    Строка импорта -> несохраненный Item. Цена в рублях/долларах
+    проверяется тем же полем, что и в ItemForm
+    """
+    if row is None:
+        raise ValidationError("Строка не является JSON объектом")
+    errors = []
+    item = Item()
+    raw_id = row.get("id")
+    if raw_id not in (None, ""):
+        try:
+            item.pk = int(raw_id)
+        except (TypeError, ValueError):
+            errors.append(f"id: некорректное значение {raw_id!r}")
+        else:
+            if item.pk < 1:
+                errors.append(f"id: некорректное значение {raw_id!r}")
+    for field_name in ("name", "description"):
+        field = Item._meta.get_field(field_name)
+        try:
+            setattr(item, field_name, field.clean(row.get(field_name), item))
+        except ValidationError as error:
+            for message in error.messages:
+                errors.append(f"{field_name}: {message}")
+    try:
+        item.price = to_minor_units(
+            ItemForm.base_fields["price_decimal"].clean(row.get("price"))
+        )
+    except ValidationError as error:
+        errors.extend(f"price: {message}" for message in error.messages)
+    if errors:
+        raise ValidationError(errors)
+    return item
+
+
+def export_row(pk, name, description, price):
+    return {
+        "id": pk,
+        "name": name,
+        "description": description,
+        "price": f"{Decimal(price) / Decimal(100):.2f}",
+    }
+
+
+class RowWriter:
+    def __init__(self, stream, file_format):
+        self.stream = stream
+        self.file_format = file_format
+        if file_format == "csv":
+            self.csv_writer = csv.DictWriter(stream, fieldnames=ITEM_FIELDS)
+            self.csv_writer.writeheader()
+
+    def write(self, row):
+        if self.file_format == "csv":
+            self.csv_writer.writerow(row)
+        else:
+            self.stream.write(orjson.dumps(row).decode())
+            self.stream.write("\n")
+
+
+def peak_memory_mb():
+    # ru_maxrss в Linux - килобайты
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
@@ -0,0 +1,169 @@
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import BadRequest
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.template import Context
+from django.template.loader import get_template, render_to_string
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    quote_etag,
+)
+from django.utils.http import http_date
+from django.utils.safestring import mark_safe
+
+from .models import Item
+
+CARD_FIELDS = ("id", "name", "description", "price", "updated_at")
+CATALOGUE_VERSION_KEY = "catalogue-version"
+# Версия шаблонов карточки и страницы товара: входит в ключи кэша и ETag.
+# Вместе с ней меняется дата, раньше которой Last-Modified не бывает
+TEMPLATE_VERSION = "v3"
+TEMPLATE_VERSION_DATE = datetime(2026, 10, 18, tzinfo=timezone.utc)
+
+
+def item_card_cache_key(pk):
+    return f"item-card:{TEMPLATE_VERSION}:{pk}"
+
+
+def item_page_cache_key(pk):
+    return f"item-page:{TEMPLATE_VERSION}:{pk}"
+
+
+def parse_cursor(value):
+    """
+    Курсор after из запроса. Без курсора - первая страница, испорченный
+    курсор - BadRequest (400), а не молча первая страница
+    """
+    if not value:
+        return 0
+    try:
+        after = int(value)
+    except ValueError:
+        after = -1
+    if after < 0:
+        raise BadRequest("after должен быть id товара")
+    return after
+
+
+def catalogue_queryset(after):
+    """
+    Страница каталога по курсору (id последнего показанного товара):
+    запрос по первичному ключу стоит одинаково на любой странице.
+    Берем на один товар больше, чтобы узнать, есть ли следующая страница
+    """
+    return (
+        Item.objects.only(*CARD_FIELDS)
+        .filter(pk__gt=after)
+        .order_by("pk")[: settings.ITEMS_PAGE_SIZE + 1]
+    )
+
+
+def split_page(items):
+    page = items[: settings.ITEMS_PAGE_SIZE]
+    has_next = len(items) > settings.ITEMS_PAGE_SIZE
+    return page, page[-1].pk if has_next else None
+
+
+def render_item_cards(items):
+    """
+    HTML карточек товаров. Готовые карточки берутся из кэша одним
+    get_many, версия карточки - время изменения товара.
+    Промахи рендерятся одним скомпилированным шаблоном в общем контексте
+    """
+    keys = {item.pk: item_card_cache_key(item.pk) for item in items}
+    cached = cache.get_many(keys.values())
+    cards, rendered = [], {}
+    template, context = None, Context()
+    for item in items:
+        version = item.updated_at.timestamp()
+        entry = cached.get(keys[item.pk])
+        if entry is None or entry[0] != version:
+            if template is None:
+                template = get_template("components/item_card.html").template
+            with context.push(item=item):
+                html = template.render(context)
+            entry = rendered[keys[item.pk]] = (version, html)
+        cards.append(mark_safe(entry[1]))
+    if rendered:
+        cache.set_many(rendered, settings.ITEM_CARD_CACHE_TIMEOUT)
+    return cards
+
+
+def get_item_page(pk):
+    """
+    Время изменения товара и готовый HTML его страницы. После сброса
+    кэша страницу рендерит один процесс, остальные ждут результат
+    """
+
+    def render_page():
+        item = get_object_or_404(Item, pk=pk)
+        return (
+            item.updated_at,
+            render_to_string(
+                "item.html",
+                {
+                    "item": item,
+                    "stripe_publishable_key": settings.STRIPE_PUBLISHABLE_KEY,
+                },
+            ),
+        )
+
+    return cache.get_or_set(
+        item_page_cache_key(pk), render_page, settings.ITEM_PAGE_CACHE_TIMEOUT
+    )
+
+
+def item_page_response(request, pk, updated_at, content):
+    """
+    Отдает страницу товара с ETag/Last-Modified и Cache-Control для nginx.
+    Оба зависят и от товара, и от версии шаблонов. На условный запрос
+    с актуальной версией отвечает 304 без тела
+    """
+    last_modified = int(max(updated_at, TEMPLATE_VERSION_DATE).timestamp())
+    etag = quote_etag(
+        f"item-{pk}-{TEMPLATE_VERSION}-{updated_at.timestamp()}",
+    )
+    response = HttpResponse(content)
+    response.headers["ETag"] = etag
+    response.headers["Last-Modified"] = http_date(last_modified)
+    patch_cache_control(
+        response,
+        public=True,
+        max_age=settings.ITEM_PAGE_MAX_AGE,
+    )
+    return get_conditional_response(
+        request, etag=etag, last_modified=last_modified, response=response
+    )
+
+
+def forget_item(pk):
+    forget_items([pk])
+
+
+def forget_items(pks):
+    cache.delete_many(
+        [
+            key
+            for pk in pks
+            for key in (item_card_cache_key(pk), item_page_cache_key(pk))
+        ]
+    )
+
+
+def catalogue_version():
+    """Версия каталога для ключей кэша, меняется при любом изменении товаров"""
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        version = bump_catalogue_version()
+    return version
+
+
+def bump_catalogue_version():
+    version = time.time_ns()
+    cache.set(CATALOGUE_VERSION_KEY, version, None)
+    return version
@@ -2,6 +2,11 @@ from django import forms
 from .models import Item
 
 
+def to_minor_units(price_decimal):
+    """Цена в рублях/долларах -> копейки/центы, как хранится в Item.price"""
+    return int(price_decimal * 100)
+
+
 class ItemForm(forms.ModelForm):
     price_decimal = forms.DecimalField(
         max_digits=10,
@@ -22,5 +27,5 @@ class ItemForm(forms.ModelForm):
     def save(self, commit=True):
         price_decimal = self.cleaned_data.get("price_decimal")
         if price_decimal is not None:
-            self.instance.price = int(price_decimal * 100)
+            self.instance.price = to_minor_units(price_decimal)
         return super().save(commit)
@@ -0,0 +1,76 @@
+from datetime import date, datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from items.models import Order, RollupGranularity
+from items.rollups import period_start, rebuild_rollups
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Дата должна быть в формате ГГГГ-ММ-ДД: {value}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересобирает сводки продаж по оплаченным заказам кусками по "
+        "--chunk-days дней, каждый кусок в своей транзакции"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--granularity",
+            choices=RollupGranularity.values,
+            help="По умолчанию - все",
+        )
+        parser.add_argument(
+            "--since",
+            type=parse_date,
+            help="Первый день, по умолчанию - день первого оплаченного заказа",
+        )
+        parser.add_argument(
+            "--until",
+            type=parse_date,
+            help="Последний день включительно, по умолчанию - сегодня",
+        )
+        parser.add_argument("--chunk-days", type=int, default=7)
+
+    def handle(self, *args, **options):
+        granularities = (
+            [options["granularity"]]
+            if options["granularity"]
+            else RollupGranularity.values
+        )
+        since = options["since"]
+        if since is None:
+            first_paid = Order.objects.paid().aggregate(
+                first=Min("created_at"),
+            )["first"]
+            if first_paid is None:
+                self.stdout.write("Оплаченных заказов нет")
+                return
+            since = timezone.localdate(first_paid)
+        until = options["until"] or timezone.localdate()
+
+        start = self.day_start(since)
+        end = self.day_start(until + timedelta(days=1))
+        step = timedelta(days=options["chunk_days"])
+        while start < end:
+            chunk_end = min(start + step, end)
+            for granularity in granularities:
+                rebuilt = rebuild_rollups(granularity, start, chunk_end)
+                self.stdout.write(
+                    f"{start:%Y-%m-%d} - {chunk_end:%Y-%m-%d} "
+                    f"({granularity}): {rebuilt} строк"
+                )
+            start = chunk_end
+
+    def day_start(self, day):
+        return period_start(
+            timezone.make_aware(datetime.combine(day, time())),
+            RollupGranularity.DAY,
+        )
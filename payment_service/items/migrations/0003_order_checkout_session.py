@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("items", "0002_discount_tax_order_updates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="stripe_session_expires_at",
+            field=models.DateTimeField(
+                blank=True,
+                null=True,
+                verbose_name="Сессия Stripe действительна до",
+            ),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="checkout_key",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                max_length=64,
+                null=True,
+                verbose_name="Ключ идемпотентности",
+            ),
+        ),
+    ]
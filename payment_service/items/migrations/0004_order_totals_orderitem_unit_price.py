@@ -0,0 +1,118 @@
+# Generated by Django 6.0 on 2026-10-18 13:05
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def adjustment_amount(amount, adjustment_type, value):
+    # Копия items.models.adjustment_amount: миграция не зависит от моделей
+    if adjustment_type == "percent":
+        share = amount * value / 100
+        return int(share.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    return int(value)
+
+
+def fill_unit_prices_and_totals(apps, schema_editor):
+    """Фиксирует текущие цены товаров в позициях и считает суммы заказов"""
+    Item = apps.get_model("items", "Item")
+    Order = apps.get_model("items", "Order")
+    OrderItem = apps.get_model("items", "OrderItem")
+
+    OrderItem.objects.update(
+        unit_price=Subquery(
+            Item.objects.filter(pk=OuterRef("item_id")).values("price")[:1]
+        )
+    )
+    Order.objects.update(
+        subtotal_amount=Coalesce(
+            Subquery(
+                OrderItem.objects.filter(order=OuterRef("pk"))
+                .values("order")
+                .annotate(total=Sum(F("quantity") * F("unit_price")))
+                .values("total")
+            ),
+            0,
+        )
+    )
+    Order.objects.update(total_amount=F("subtotal_amount"))
+
+    # Скидка и налог заказа - как в Order.recalculate_totals
+    adjusted = Order.objects.filter(
+        Q(discount__isnull=False) | Q(tax__isnull=False)
+    ).select_related("discount", "tax")
+    orders = []
+    for order in adjusted.iterator(chunk_size=1000):
+        subtotal = order.subtotal_amount
+        order.discount_amount = 0
+        if order.discount:
+            order.discount_amount = min(
+                adjustment_amount(
+                    subtotal,
+                    order.discount.discount_type,
+                    order.discount.value,
+                ),
+                subtotal,
+            )
+        order.tax_amount = 0
+        if order.tax:
+            order.tax_amount = adjustment_amount(
+                subtotal - order.discount_amount,
+                order.tax.tax_type,
+                order.tax.value,
+            )
+        order.total_amount = subtotal - order.discount_amount
+        order.total_amount += order.tax_amount
+        orders.append(order)
+    Order.objects.bulk_update(
+        orders,
+        ["discount_amount", "tax_amount", "total_amount"],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("items", "0003_order_checkout_session"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="subtotal_amount",
+            field=models.IntegerField(default=0, verbose_name="Сумма позиций"),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="discount_amount",
+            field=models.IntegerField(default=0, verbose_name="Сумма скидки"),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="tax_amount",
+            field=models.IntegerField(default=0, verbose_name="Сумма налога"),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="total_amount",
+            field=models.IntegerField(default=0, verbose_name="Итого"),
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="unit_price",
+            field=models.IntegerField(
+                blank=True,
+                default=0,
+                help_text="Если не указана, берется текущая цена товара",
+                verbose_name="Цена за единицу",
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(
+            fill_unit_prices_and_totals,
+            migrations.RunPython.noop,
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 6.0 on 2026-10-18 14:30
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("items", "0004_order_totals_orderitem_unit_price"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="discount",
+            name="value",
+            field=models.DecimalField(
+                decimal_places=2,
+                help_text=(
+                    "Для процента: 0-100, для фиксированной суммы: значение в "
+                    "копейках/центах"
+                ),
+                max_digits=10,
+                validators=[django.core.validators.MinValueValidator(0)],
+                verbose_name="Значение скидки",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="tax",
+            name="value",
+            field=models.DecimalField(
+                decimal_places=2,
+                help_text=(
+                    "Для процента: 0-100, для фиксированной суммы: значение в "
+                    "копейках/центах"
+                ),
+                max_digits=10,
+                validators=[django.core.validators.MinValueValidator(0)],
+                verbose_name="Значение налога",
+            ),
+        ),
+        migrations.AddField(
+            model_name="discount",
+            name="stripe_coupon_id",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                max_length=255,
+                null=True,
+                verbose_name="ID купона Stripe",
+            ),
+        ),
+        migrations.AddField(
+            model_name="tax",
+            name="stripe_tax_rate_id",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                max_length=255,
+                null=True,
+                verbose_name="ID налоговой ставки Stripe",
+            ),
+        ),
+    ]
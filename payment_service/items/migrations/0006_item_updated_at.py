@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 15:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("items", "0005_restore_discount_tax_models"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="item",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True,
+                default=django.utils.timezone.now,
+                verbose_name="Дата изменения",
+            ),
+            preserve_default=False,
+        ),
+    ]
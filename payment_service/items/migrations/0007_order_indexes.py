@@ -0,0 +1,54 @@
+# Generated by Django 6.0 on 2026-10-18 17:05
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def deduplicate_stripe_sessions(apps, schema_editor):
+    """
+    До уникального индекса параллельные запросы могли создать несколько
+    заказов на одну сессию: сессия остается за самым ранним заказом
+    """
+    Order = apps.get_model("items", "Order")
+    Order.objects.filter(stripe_session_id="").update(stripe_session_id=None)
+    earlier = Order.objects.filter(
+        stripe_session_id=OuterRef("stripe_session_id"),
+        pk__lt=OuterRef("pk"),
+    )
+    Order.objects.filter(Exists(earlier)).update(stripe_session_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("items", "0006_item_updated_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            deduplicate_stripe_sessions,
+            migrations.RunPython.noop,
+        ),
+        migrations.AddConstraint(
+            model_name="order",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(stripe_session_id__isnull=False),
+                fields=("stripe_session_id",),
+                name="order_stripe_session_id_uniq",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["is_paid", "created_at"],
+                name="order_is_paid_created_at_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="orderitem",
+            index=models.Index(
+                fields=["order", "item"],
+                name="orderitem_order_item_idx",
+            ),
+        ),
+    ]
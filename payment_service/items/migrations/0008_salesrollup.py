@@ -0,0 +1,88 @@
+# Generated by Django 6.0 on 2026-10-18 18:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("items", "0007_order_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SalesRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "granularity",
+                    models.CharField(
+                        choices=[("hour", "Час"), ("day", "День")],
+                        max_length=4,
+                        verbose_name="Период",
+                    ),
+                ),
+                (
+                    "period_start",
+                    models.DateTimeField(verbose_name="Начало периода"),
+                ),
+                (
+                    "revenue",
+                    models.BigIntegerField(default=0, verbose_name="Выручка"),
+                ),
+                (
+                    "units",
+                    models.BigIntegerField(
+                        default=0,
+                        verbose_name="Продано единиц",
+                    ),
+                ),
+                (
+                    "order_count",
+                    models.IntegerField(default=0, verbose_name="Заказов"),
+                ),
+                (
+                    "item",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sales_rollups",
+                        to="items.item",
+                        verbose_name="Товар",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Продажи за период",
+                "verbose_name_plural": "Продажи по периодам",
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("item__isnull", False)),
+                        fields=("granularity", "period_start", "item"),
+                        name="salesrollup_item_period_uniq",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("item__isnull", True)),
+                        fields=("granularity", "period_start"),
+                        name="salesrollup_total_period_uniq",
+                    ),
+                ],
+                "indexes": [
+                    models.Index(
+                        fields=["item", "granularity", "period_start"],
+                        name="salesrollup_item_period_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
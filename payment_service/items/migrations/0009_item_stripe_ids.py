@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("items", "0008_salesrollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="item",
+            name="stripe_product_id",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                max_length=255,
+                null=True,
+                verbose_name="ID продукта Stripe",
+            ),
+        ),
+        migrations.AddField(
+            model_name="item",
+            name="stripe_price_id",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                max_length=255,
+                null=True,
+                verbose_name="ID цены Stripe",
+            ),
+        ),
+        migrations.AddField(
+            model_name="item",
+            name="stripe_price_amount",
+            field=models.IntegerField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="Сумма цены Stripe",
+            ),
+        ),
+    ]
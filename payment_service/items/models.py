@@ -1,6 +1,8 @@
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Prefetch, Q, Sum
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
 
 
@@ -15,6 +17,31 @@ class Item(models.Model):
     price = models.IntegerField(  # Цена а копейках/центах
         verbose_name="Цена",
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Дата изменения",
+    )
+    # Заполняет фоновая синхронизация с Stripe (sync_stripe_products)
+    stripe_product_id = models.CharField(
+        max_length=255,
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name="ID продукта Stripe",
+    )
+    stripe_price_id = models.CharField(
+        max_length=255,
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name="ID цены Stripe",
+    )
+    stripe_price_amount = models.IntegerField(  # Сумма цены stripe_price_id
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name="Сумма цены Stripe",
+    )
 
     class Meta:
         verbose_name = "Товар"
@@ -31,6 +58,185 @@ class Item(models.Model):
     def price_display(self):
         return f"{self.price_decimal:.2f} руб./$"
 
+    @property
+    def synced_stripe_price_id(self):
+        """ID цены Stripe, если она соответствует текущей цене товара"""
+        if self.stripe_price_amount == self.price:
+            return self.stripe_price_id
+        return None
+
+
+class AdjustmentType(models.TextChoices):
+    PERCENT = "percent", "Процент"
+    FIXED = "fixed", "Фиксированная сумма"
+
+
+def adjustment_amount(amount, adjustment_type, value):
+    """Скидка или налог в копейках/центах для суммы amount"""
+    if adjustment_type == AdjustmentType.PERCENT:
+        share = amount * value / 100
+        return int(share.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    return int(value)
+
+
+def _rule_changed(rule, type_field):
+    fields = (type_field, "value")
+    saved = type(rule).objects.filter(pk=rule.pk).values(*fields).first()
+    return saved != {
+        type_field: getattr(rule, type_field),
+        "value": rule.value,
+    }
+
+
+class Discount(models.Model):
+    name = models.CharField(
+        max_length=100,
+        verbose_name="Название скидки",
+    )
+    description = models.TextField(
+        blank=True,
+        verbose_name="Описание скидки",
+    )
+    discount_type = models.CharField(
+        max_length=10,
+        choices=AdjustmentType.choices,
+        default=AdjustmentType.PERCENT,
+        verbose_name="Тип скидки",
+    )
+    value = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        validators=[
+            MinValueValidator(0),
+        ],
+        verbose_name="Значение скидки",
+        help_text=(
+            "Для процента: 0-100, для фиксированной суммы: значение в "
+            "копейках/центах"
+        ),
+    )
+    is_active = models.BooleanField(
+        default=True,
+        verbose_name="Активна",
+    )
+    stripe_coupon_id = models.CharField(
+        max_length=255,
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name="ID купона Stripe",
+    )
+
+    class Meta:
+        verbose_name = "Скидка"
+        verbose_name_plural = "Скидки"
+
+    def __str__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        # Купоны Stripe неизменяемы: после смены скидки нужен новый купон
+        if self.stripe_coupon_id and _rule_changed(self, "discount_type"):
+            self.stripe_coupon_id = None
+        super().save(*args, **kwargs)
+
+    def amount_for(self, amount):
+        return min(
+            adjustment_amount(amount, self.discount_type, self.value),
+            amount,
+        )
+
+
+class Tax(models.Model):
+    name = models.CharField(
+        max_length=100,
+        verbose_name="Название налога",
+    )
+    description = models.TextField(
+        blank=True,
+        verbose_name="Описание налога",
+    )
+    tax_type = models.CharField(
+        max_length=10,
+        choices=AdjustmentType.choices,
+        default=AdjustmentType.PERCENT,
+        verbose_name="Тип налога",
+    )
+    value = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        validators=[
+            MinValueValidator(0),
+        ],
+        verbose_name="Значение налога",
+        help_text=(
+            "Для процента: 0-100, для фиксированной суммы: значение в "
+            "копейках/центах"
+        ),
+    )
+    is_active = models.BooleanField(
+        default=True,
+        verbose_name="Активен",
+    )
+    stripe_tax_rate_id = models.CharField(
+        max_length=255,
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name="ID налоговой ставки Stripe",
+    )
+
+    class Meta:
+        verbose_name = "Налог"
+        verbose_name_plural = "Налоги"
+
+    def __str__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        if self.stripe_tax_rate_id and _rule_changed(self, "tax_type"):
+            self.stripe_tax_rate_id = None
+        super().save(*args, **kwargs)
+
+    def amount_for(self, amount):
+        return adjustment_amount(amount, self.tax_type, self.value)
+
+
+def line_total():
+    """Стоимость позиции заказа в копейках/центах как SQL выражение"""
+    return F("quantity") * F("unit_price")
+
+
+class OrderQuerySet(models.QuerySet):
+    # Условия фильтров совпадают с индексами Order.Meta
+
+    def for_stripe_session(self, session_id):
+        return self.filter(stripe_session_id=session_id)
+
+    def for_stripe_sessions(self, session_ids):
+        return self.filter(stripe_session_id__in=session_ids)
+
+    def paid(self):
+        return self.filter(is_paid=True)
+
+    def unpaid(self):
+        return self.filter(is_paid=False)
+
+    def created_between(self, start, end):
+        """Заказы с created_at в полуинтервале [start, end)"""
+        return self.filter(created_at__gte=start, created_at__lt=end)
+
+    def with_items(self):
+        return self.prefetch_related(
+            Prefetch(
+                "order_items",
+                queryset=OrderItem.objects.select_related("item"),
+            )
+        )
+
+
+ADJUSTMENT_FIELDS = {"discount", "discount_id", "tax", "tax_id"}
+
 
 class Order(models.Model):
     created_at = models.DateTimeField(
@@ -43,24 +249,127 @@ class Order(models.Model):
         null=True,
         verbose_name="ID сессии Stripe",
     )
+    stripe_session_expires_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name="Сессия Stripe действительна до",
+    )
+    # sha256 от (товар, количество, цена, клиент)
+    checkout_key = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        db_index=True,
+        verbose_name="Ключ идемпотентности",
+    )
     is_paid = models.BooleanField(
         default=False,
         verbose_name="Оплачен",
     )
+    discount = models.ForeignKey(
+        Discount,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        verbose_name="Скидка",
+    )
+    tax = models.ForeignKey(
+        Tax,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        verbose_name="Налог",
+    )
+    # Суммы в копейках/центах поддерживаются при изменении позиций заказа
+    subtotal_amount = models.IntegerField(
+        default=0,
+        verbose_name="Сумма позиций",
+    )
+    discount_amount = models.IntegerField(
+        default=0,
+        verbose_name="Сумма скидки",
+    )
+    tax_amount = models.IntegerField(
+        default=0,
+        verbose_name="Сумма налога",
+    )
+    total_amount = models.IntegerField(
+        default=0,
+        verbose_name="Итого",
+    )
+
+    objects = OrderQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
+        constraints = [
+            # Вебхуки и страница успеха ищут заказ по сессии Stripe
+            models.UniqueConstraint(
+                fields=["stripe_session_id"],
+                condition=Q(stripe_session_id__isnull=False),
+                name="order_stripe_session_id_uniq",
+            ),
+        ]
+        indexes = [
+            # Отчеты: оплаченные/неоплаченные заказы за период
+            models.Index(
+                fields=["is_paid", "created_at"],
+                name="order_is_paid_created_at_idx",
+            ),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._saved_adjustments = self._adjustments()
 
     def __str__(self):
-        return f"Заказ #{self.id} от {self.created_at.strftime('%d.%m.%Y %H:%M')}"
+        return f"Заказ #{self.id} от {self.created_at:%d.%m.%Y %H:%M}"
 
-    @property
-    def total_amount(self):
-        total = 0
-        for order_item in self.order_items.all():
-            total += order_item.total_price
-        return total
+    def _adjustments(self):
+        # Через __dict__: отложенное поле не должно стоить запроса
+        return self.__dict__.get("discount_id"), self.__dict__.get("tax_id")
+
+    def save(self, *args, **kwargs):
+        # Смена скидки или налога (например, в админке) меняет суммы
+        # заказа. Позиции пересчитывают их сами при сохранении
+        saved = self._saved_adjustments
+        changed = self.pk is not None and self._adjustments() != saved
+        update_fields = kwargs.get("update_fields")
+        if changed and update_fields is not None:
+            changed = not ADJUSTMENT_FIELDS.isdisjoint(update_fields)
+        if changed:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                self.recalculate_totals()
+        else:
+            super().save(*args, **kwargs)
+        self._saved_adjustments = self._adjustments()
+
+    def apply_price(self, price):
+        self.discount = price.discount
+        self.tax = price.tax
+        self.subtotal_amount = price.subtotal
+        self.discount_amount = price.discount_amount
+        self.tax_amount = price.tax_amount
+        self.total_amount = price.total
+
+    def recalculate_totals(self):
+        """Пересчитывает суммы заказа по позициям одним агрегатом"""
+        from .pricing import apply_rules
+
+        subtotal = self.order_items.aggregate(
+            total=Coalesce(Sum(line_total()), 0),
+        )["total"]
+        self.apply_price(apply_rules(subtotal, self.discount, self.tax))
+        self.save(
+            update_fields=[
+                "subtotal_amount",
+                "discount_amount",
+                "tax_amount",
+                "total_amount",
+            ]
+        )
 
     @property
     def total_amount_display(self):
@@ -87,18 +396,117 @@ class OrderItem(models.Model):
         ],
         help_text="Количество единиц товара при заказе должно быть >= 1",
     )
+    unit_price = models.IntegerField(  # Цена на момент покупки
+        blank=True,
+        verbose_name="Цена за единицу",
+        help_text="Если не указана, берется текущая цена товара",
+    )
 
     class Meta:
         verbose_name = "Позиция заказа"
         verbose_name_plural = "Позиции заказов"
+        indexes = [
+            models.Index(
+                fields=["order", "item"],
+                name="orderitem_order_item_idx",
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.item.name} x{self.quantity} (Заказ #{self.order.id})"
+        return f"{self.item.name} x{self.quantity} (Заказ #{self.order_id})"
+
+    def save(self, *args, **kwargs):
+        # bulk_create и QuerySet.update сюда не попадают: вызывающий код
+        # сам заполняет unit_price и суммы заказа
+        if self.unit_price is None:
+            self.unit_price = self.item.price
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.order.recalculate_totals()
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self.order.recalculate_totals()
+        return result
 
     @property
     def total_price(self):
-        return self.item.price * self.quantity
+        return self.unit_price * self.quantity
 
     @property
     def total_price_display(self):
         return Decimal(self.total_price) / Decimal(100)
+
+
+class RollupGranularity(models.TextChoices):
+    HOUR = "hour", "Час"
+    DAY = "day", "День"
+
+
+class SalesRollup(models.Model):
+    """
+    Продажи оплаченных заказов за час/день по товару. Строка без товара -
+    итог периода по всем товарам (число заказов по товарам не суммируется)
+    """
+
+    granularity = models.CharField(
+        max_length=4,
+        choices=RollupGranularity.choices,
+        verbose_name="Период",
+    )
+    period_start = models.DateTimeField(
+        verbose_name="Начало периода",
+    )
+    item = models.ForeignKey(
+        Item,
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name="sales_rollups",
+        verbose_name="Товар",
+    )
+    # В копейках/центах, без скидок и налогов
+    revenue = models.BigIntegerField(
+        default=0,
+        verbose_name="Выручка",
+    )
+    units = models.BigIntegerField(
+        default=0,
+        verbose_name="Продано единиц",
+    )
+    order_count = models.IntegerField(
+        default=0,
+        verbose_name="Заказов",
+    )
+
+    class Meta:
+        verbose_name = "Продажи за период"
+        verbose_name_plural = "Продажи по периодам"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["granularity", "period_start", "item"],
+                condition=Q(item__isnull=False),
+                name="salesrollup_item_period_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["granularity", "period_start"],
+                condition=Q(item__isnull=True),
+                name="salesrollup_total_period_uniq",
+            ),
+        ]
+        indexes = [
+            # Продажи товара за период без сканирования всей таблицы
+            models.Index(
+                fields=["item", "granularity", "period_start"],
+                name="salesrollup_item_period_idx",
+            ),
+        ]
+
+    def __str__(self):
+        item = self.item or "Все товары"
+        return f"{item} за {self.period_start:%d.%m.%Y %H:%M}"
+
+    @property
+    def revenue_display(self):
+        return Decimal(self.revenue) / Decimal(100)
@@ -0,0 +1,77 @@
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Discount, Tax
+
+_lock = threading.Lock()
+_rules = None
+_loaded_at = 0.0
+
+
+class OrderPrice:
+    """Итог заказа в копейках/центах с примененными скидкой и налогом"""
+
+    def __init__(self, subtotal, discount, discount_amount, tax, tax_amount):
+        self.subtotal = subtotal
+        self.discount = discount
+        self.discount_amount = discount_amount
+        self.tax = tax
+        self.tax_amount = tax_amount
+
+    @property
+    def total(self):
+        return self.subtotal - self.discount_amount + self.tax_amount
+
+
+def invalidate_rules(**kwargs):
+    global _rules
+    _rules = None
+
+
+def active_rules():
+    """
+    Активные скидки и налоги из памяти процесса. Сохранение правила
+    сбрасывает кэш через сигналы, а TTL ограничивает устаревание правил
+    в остальных воркерах gunicorn
+    """
+    global _rules, _loaded_at
+    rules = _rules
+    age = time.monotonic() - _loaded_at
+    if rules is not None and age < settings.PRICING_RULES_TTL:
+        return rules
+
+    with _lock:
+        if (
+            _rules is None
+            or time.monotonic() - _loaded_at >= settings.PRICING_RULES_TTL
+        ):
+            _rules = (
+                list(Discount.objects.filter(is_active=True).order_by("pk")),
+                list(Tax.objects.filter(is_active=True).order_by("pk")),
+            )
+            _loaded_at = time.monotonic()
+        return _rules
+
+
+def apply_rules(subtotal, discount, tax):
+    discount_amount = discount.amount_for(subtotal) if discount else 0
+    tax_amount = tax.amount_for(subtotal - discount_amount) if tax else 0
+    return OrderPrice(subtotal, discount, discount_amount, tax, tax_amount)
+
+
+def price_order(subtotal):
+    """
+    Применяет к сумме позиций самую выгодную активную скидку и первый
+    активный налог. Без запросов к БД, пока правила лежат в кэше
+    """
+    discounts, taxes = active_rules()
+    discount = max(
+        discounts,
+        key=lambda rule: rule.amount_for(subtotal),
+        default=None,
+    )
+    if discount is not None and not discount.amount_for(subtotal):
+        discount = None
+    return apply_rules(subtotal, discount, taxes[0] if taxes else None)
@@ -0,0 +1,111 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import OrderItem, RollupGranularity, SalesRollup, line_total
+
+TRUNCATE = {
+    RollupGranularity.HOUR: TruncHour,
+    RollupGranularity.DAY: TruncDay,
+}
+
+
+def period_start(moment, granularity):
+    """Начало часа/дня в текущей временной зоне, как TruncHour/TruncDay"""
+    local = timezone.localtime(moment)
+    # Обрезаем время на часах, смещение зоны считаем заново: начало дня
+    # перехода на летнее/зимнее время может быть в другом смещении
+    start = local.replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    if granularity == RollupGranularity.DAY:
+        start = start.replace(hour=0, fold=0)
+    # fold сохраняет повторный час при переводе часов назад
+    return timezone.make_aware(start)
+
+
+def record_paid_orders(order_ids):
+    """
+    Добавляет только что оплаченные заказы к сводкам. Вызывается в той же
+    транзакции, что и отметка об оплате: каждый заказ учитывается один раз,
+    а прибавление через F() не теряет параллельные обновления
+    """
+    lines = OrderItem.objects.filter(order_id__in=order_ids).values_list(
+        "order_id", "order__created_at", "item_id", "quantity", "unit_price"
+    )
+    deltas = defaultdict(lambda: [0, 0, set()])
+    for order_id, created_at, item_id, quantity, unit_price in lines:
+        for granularity in TRUNCATE:
+            start = period_start(created_at, granularity)
+            for item in (item_id, None):
+                delta = deltas[granularity, start, item]
+                delta[0] += quantity * unit_price
+                delta[1] += quantity
+                delta[2].add(order_id)
+    if not deltas:
+        return
+
+    # Ключи сортированы и для вставки, и для обновления: воркеры блокируют
+    # строки сводок в одном порядке и не ждут друг друга по кругу
+    keys = sorted(deltas, key=lambda key: (*key[:2], key[2] or 0))
+    SalesRollup.objects.bulk_create(
+        [
+            SalesRollup(
+                granularity=granularity,
+                period_start=start,
+                item_id=item,
+            )
+            for granularity, start, item in keys
+        ],
+        ignore_conflicts=True,
+    )
+    for granularity, start, item in keys:
+        revenue, units, orders = deltas[granularity, start, item]
+        SalesRollup.objects.filter(
+            granularity=granularity,
+            period_start=start,
+            item_id=item,
+        ).update(
+            revenue=F("revenue") + revenue,
+            units=F("units") + units,
+            order_count=F("order_count") + len(orders),
+        )
+
+
+def aggregate_rollups(granularity, start, end):
+    """Сводки за [start, end), посчитанные заново по оплаченным заказам"""
+    lines = OrderItem.objects.filter(
+        order__is_paid=True,
+        order__created_at__gte=start,
+        order__created_at__lt=end,
+    ).annotate(period=TRUNCATE[granularity]("order__created_at"))
+    totals = {
+        "revenue": Sum(line_total()),
+        "units": Sum("quantity"),
+        "order_count": Count("order", distinct=True),
+    }
+    for group_by in (("period", "item"), ("period",)):
+        for row in lines.values(*group_by).annotate(**totals).order_by():
+            yield SalesRollup(
+                granularity=granularity,
+                period_start=row["period"],
+                item_id=row.get("item"),
+                revenue=row["revenue"],
+                units=row["units"],
+                order_count=row["order_count"],
+            )
+
+
+def rebuild_rollups(granularity, start, end):
+    """Пересобирает сводки за [start, end); границы - начала периодов"""
+    with transaction.atomic():
+        SalesRollup.objects.filter(
+            granularity=granularity,
+            period_start__gte=start,
+            period_start__lt=end,
+        ).delete()
+        rollups = SalesRollup.objects.bulk_create(
+            aggregate_rollups(granularity, start, end), batch_size=1000
+        )
+    return len(rollups)
@@ -0,0 +1,30 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .catalogue import bump_catalogue_version, forget_item
+from .models import Discount, Item, Tax
+from .pricing import invalidate_rules
+
+# bulk_create не вызывает post_save: import_items сообщает ID товаров сам
+items_imported = Signal()
+
+
+@receiver([post_save, post_delete], sender=Discount)
+@receiver([post_save, post_delete], sender=Tax)
+def invalidate_pricing_rules(sender, **kwargs):
+    invalidate_rules()
+
+
+def _forget_item(pk):
+    forget_item(pk)
+    bump_catalogue_version()
+
+
+@receiver([post_save, post_delete], sender=Item)
+def invalidate_item_cache(sender, instance, **kwargs):
+    # После коммита: иначе параллельный запрос успеет положить в кэш
+    # старую версию товара, которую еще видит до конца транзакции
+    transaction.on_commit(partial(_forget_item, instance.pk))
@@ -0,0 +1,93 @@
+// Карточки товаров: количество и покупка через data-атрибуты,
+// один обработчик на страницу вместо скрипта в каждой карточке
+let stripe;
+let csrfToken;
+
+function getStripe() {
+    if (!stripe) {
+        const key = document.querySelector('meta[name="stripe-publishable-key"]').content;
+        stripe = Stripe(key);
+    }
+    return stripe;
+}
+
+// Страницы каталога кэшируются без cookie, токен берем перед первой покупкой
+async function getCsrfToken() {
+    if (!csrfToken) {
+        const response = await fetch('/buy/csrf/', { credentials: 'same-origin' });
+        if (!response.ok) {
+            throw new Error(`CSRF token: ${response.status}`);
+        }
+        csrfToken = (await response.json()).token;
+    }
+    return csrfToken;
+}
+
+function showError(card, message) {
+    const error = card.querySelector('[data-error]');
+    error.textContent = message;
+    error.hidden = !message;
+}
+
+async function errorMessage(response) {
+    // 429 - лимит запросов, 503 - Stripe недоступен; оба с Retry-After
+    if (response.status === 429 || response.status === 503) {
+        const retryAfter = Math.ceil(Number(response.headers.get('Retry-After')));
+        const when = retryAfter > 0 ? `через ${retryAfter} с` : 'чуть позже';
+        const reason = response.status === 429 ? 'Слишком много запросов' : 'Оплата временно недоступна';
+        return `${reason}, попробуйте еще раз ${when}`;
+    }
+    if (response.status === 403) {
+        // Токен мог устареть: следующая попытка возьмет новый
+        csrfToken = undefined;
+    }
+    const body = await response.json().catch(() => ({}));
+    return body.error || 'Не удалось перейти к оплате, попробуйте еще раз';
+}
+
+async function buy(card, quantity) {
+    showError(card, '');
+    try {
+        const response = await fetch(`/buy/${card.dataset.itemId}/`, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: { 'X-CSRFToken': await getCsrfToken() },
+            body: new URLSearchParams({ quantity }),
+        });
+        if (!response.ok) {
+            showError(card, await errorMessage(response));
+            return;
+        }
+        const session = await response.json();
+        const result = await getStripe().redirectToCheckout({ sessionId: session.id });
+        if (result.error) {
+            showError(card, result.error.message);
+        }
+    } catch (error) {
+        showError(card, 'Нет связи с сервером, попробуйте еще раз');
+    }
+}
+
+document.addEventListener('click', (event) => {
+    const button = event.target.closest('[data-action]');
+    if (!button) {
+        return;
+    }
+    const card = button.closest('[data-item-id]');
+    const counter = card.querySelector('[data-quantity]');
+    const quantity = Number(counter.textContent);
+
+    switch (button.dataset.action) {
+        case 'increment':
+            counter.textContent = quantity + 1;
+            break;
+        case 'decrement':
+            if (quantity > 1) {
+                counter.textContent = quantity - 1;
+            }
+            break;
+        case 'buy':
+            buy(card, quantity);
+            break;
+    }
+});
@@ -0,0 +1,626 @@
+import gzip
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+
+import brotli
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from config.test_utils import TEST_CACHES, TEST_STORAGES
+
+from .api import MAX_BATCH_IDS, choose_encoding
+from .bulk import RowWriter, read_rows
+from .models import (
+    AdjustmentType,
+    Discount,
+    Item,
+    Order,
+    OrderItem,
+    RollupGranularity,
+    SalesRollup,
+    Tax,
+)
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    STORAGES=TEST_STORAGES,
+    SECURE_SSL_REDIRECT=False,
+)
+class QueryCountTests(TestCase):
+    """Число SQL запросов не должно расти с числом товаров и позиций"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = Item.objects.bulk_create(
+            [
+                Item(name=f"Товар {i}", description="", price=100 + i)
+                for i in range(300)
+            ],
+        )
+        cls.small_order = cls.create_order(cls.items[:1])
+        cls.large_order = cls.create_order(cls.items)
+        cls.admin = User.objects.create_superuser("admin", password="admin")
+
+    @classmethod
+    def create_order(cls, items):
+        order = Order.objects.create()
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(
+                    order=order,
+                    item=item,
+                    quantity=2,
+                    unit_price=item.price,
+                )
+                for item in items
+            ]
+        )
+        order.recalculate_totals()
+        return order
+
+    def setUp(self):
+        cache.clear()
+
+    def test_item_list(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse("items_list"))
+        with self.assertNumQueries(1):
+            self.client.get(reverse("items_list"))
+
+    def test_item_detail(self):
+        url = reverse("item_detail", args=[self.items[0].pk])
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        # Страница товара берется из кэша
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+    def test_api_items(self):
+        ids = ",".join(str(item.pk) for item in self.items[:50])
+        with self.assertNumQueries(1):
+            self.client.get(reverse("api_items"), {"ids": ids})
+
+    def test_order_totals(self):
+        with self.assertNumQueries(2):
+            orders = list(Order.objects.with_items())
+            for order in orders:
+                order.total_amount_display
+                for line in order.order_items.all():
+                    str(line)
+                    line.total_price_display
+        self.assertEqual(
+            self.large_order.total_amount,
+            sum(2 * item.price for item in self.items),
+        )
+
+    def test_order_admin(self):
+        self.client.force_login(self.admin)
+        # Первые запросы заполняют кэш ContentType
+        self.client.get(reverse("admin:items_order_changelist"))
+        self.client.get(
+            reverse("admin:items_order_change", args=[self.small_order.pk]),
+        )
+
+        # В Postgres число заказов без фильтров - оценка из pg_class
+        expected = 4 if connection.vendor == "postgresql" else 3
+        with self.assertNumQueries(expected):
+            self.client.get(reverse("admin:items_order_changelist"))
+        for order in (self.small_order, self.large_order):
+            with self.subTest(lines=order.order_items.count()):
+                with self.assertNumQueries(5):
+                    self.client.get(
+                        reverse("admin:items_order_change", args=[order.pk])
+                    )
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    STORAGES=TEST_STORAGES,
+    SECURE_SSL_REDIRECT=False,
+    ITEMS_PAGE_SIZE=3,
+)
+class CatalogueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        names = [f"Товар {i}" for i in range(7)]
+        cls.items = Item.objects.bulk_create(
+            [Item(name=name, description="", price=100) for name in names],
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def get_page(self, after=None):
+        params = {} if after is None else {"after": after}
+        response = self.client.get(reverse("items_list"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context["items"], response.context["next_after"]
+
+    def test_pages_stay_consistent_when_items_are_added(self):
+        seen, after, added = [], None, []
+        while True:
+            items, after = self.get_page(after)
+            seen.extend(item.pk for item in items)
+            if after is None:
+                break
+            # Новый и удаленный товары между страницами не сдвигают курсор
+            added.append(
+                Item.objects.create(name="Новый", description="", price=1),
+            )
+            Item.objects.filter(pk=seen[-1]).delete()
+
+        expected = [item.pk for item in self.items + added]
+        self.assertEqual(seen, expected)
+
+    def test_malformed_cursor_is_bad_request(self):
+        for after in ("abc", "-1", "1.5"):
+            with self.subTest(after=after):
+                response = self.client.get(
+                    reverse("items_list"),
+                    {"after": after},
+                )
+                self.assertEqual(response.status_code, 400)
+                response = self.client.get(
+                    reverse("api_items"),
+                    {"after": after},
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("after", response.json()["error"])
+
+    def test_saving_item_refreshes_its_card(self):
+        item = self.items[0]
+        response = self.client.get(reverse("items_list"))
+        self.assertContains(response, item.name)
+
+        item.name = "Переименован"
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+
+        response = self.client.get(reverse("items_list"))
+        self.assertContains(response, "Переименован")
+        self.assertNotContains(response, "Товар 0")
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    STORAGES=TEST_STORAGES,
+    SECURE_SSL_REDIRECT=False,
+)
+class ItemPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = Item.objects.create(
+            name="Кружка",
+            description="",
+            price=1500,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse("item_detail", args=[self.item.pk])
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        etag = response.headers["ETag"]
+        last_modified = response.headers["Last-Modified"]
+
+        response = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            self.url,
+            headers={"If-Modified-Since": last_modified},
+        )
+        self.assertEqual(response.status_code, 304)
+
+        with mock.patch("items.catalogue.TEMPLATE_VERSION", "v4"):
+            response = self.client.get(
+                self.url,
+                headers={"If-None-Match": etag},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        later = self.item.updated_at + timedelta(days=1)
+        with mock.patch("items.catalogue.TEMPLATE_VERSION_DATE", later):
+            response = self.client.get(
+                self.url,
+                headers={"If-Modified-Since": last_modified},
+            )
+        self.assertEqual(response.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.save()
+        response = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_page_is_rebuilt_after_commit(self):
+        self.client.get(self.url)
+        self.item.name = "Чашка"
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.item.save()
+        # До коммита кэш не трогаем: страницу еще могут собрать по
+        # старым данным
+        self.assertContains(self.client.get(self.url), "Кружка")
+
+        for callback in callbacks:
+            callback()
+        self.assertContains(self.client.get(self.url), "Чашка")
+
+
+@override_settings(CACHES=TEST_CACHES, SECURE_SSL_REDIRECT=False)
+class ItemApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = Item.objects.bulk_create(
+            [
+                Item(name=f"Товар {i}", description="Описание " * 5, price=i)
+                for i in range(30)
+            ],
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse("api_items")
+
+    def test_fields_and_cursor(self):
+        response = self.client.get(
+            self.url,
+            {"fields": "name,price", "after": self.items[0].pk, "limit": 2},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {
+                "items": [
+                    {"id": item.pk, "name": item.name, "price": item.price}
+                    for item in self.items[1:3]
+                ],
+                "next_after": self.items[2].pk,
+            },
+        )
+        ids = [self.items[5].pk, self.items[3].pk]
+        response = self.client.get(
+            self.url,
+            {"ids": ",".join(map(str, ids)), "fields": "id"},
+        )
+        expected = [{"id": pk} for pk in sorted(ids)]
+        self.assertEqual(response.json(), {"items": expected})
+
+    def test_not_modified_for_matching_weak_etag(self):
+        response = self.client.get(self.url)
+        etag = response.headers["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+
+        response = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_compressed_bodies(self):
+        identity = self.client.get(self.url, {"limit": 30}).content
+        self.assertGreater(len(identity), 1024)
+        decoders = {"gzip": gzip.decompress, "br": brotli.decompress}
+
+        for accept, encoding in (
+            ("gzip", "gzip"),
+            ("gzip, deflate, br", "br"),
+            ("br;q=0, gzip", "gzip"),
+            ("gzip;q=0.5, br;q=0.8", "br"),
+            ("br;q=0.1, gzip", "gzip"),
+            ("gzip;q=0", None),
+            ("identity", None),
+        ):
+            with self.subTest(accept=accept):
+                response = self.client.get(
+                    self.url,
+                    {"limit": 30},
+                    headers={"Accept-Encoding": accept},
+                )
+                self.assertEqual(
+                    response.headers.get("Content-Encoding"),
+                    encoding,
+                )
+                self.assertIn("Accept-Encoding", response.headers["Vary"])
+                decode = decoders.get(encoding, bytes)
+                self.assertEqual(decode(response.content), identity)
+
+    def test_choose_encoding(self):
+        factory = RequestFactory()
+        for accept, encoding in (
+            ("", None),
+            ("*", "br"),
+            ("*;q=0", None),
+            ("*, br;q=0", "gzip"),
+            ("GZIP; Q=1", "gzip"),
+            ("br;q=bad, gzip;q=0.3", "gzip"),
+        ):
+            with self.subTest(accept=accept):
+                request = factory.get("/", headers={"Accept-Encoding": accept})
+                self.assertEqual(choose_encoding(request), encoding)
+
+    def test_bad_params(self):
+        too_many = ",".join(str(pk) for pk in range(1, MAX_BATCH_IDS + 2))
+        for params in (
+            {"fields": "name,secret"},
+            {"ids": "1,a"},
+            {"ids": ","},
+            {"ids": too_many},
+            {"limit": "ten"},
+            {"after": "x"},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+
+class ImportExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mug = Item.objects.create(
+            name="Кружка",
+            description="Белая",
+            price=150,
+        )
+        cls.shirt = Item.objects.create(
+            name="Футболка",
+            description="Белая",
+            price=2500,
+        )
+
+    def setUp(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.directory = Path(directory)
+
+    def test_round_trip(self):
+        for file_format in ("csv", "jsonl"):
+            with self.subTest(format=file_format):
+                with transaction.atomic():
+                    self.check_round_trip(file_format)
+                    transaction.set_rollback(True)
+
+    def check_round_trip(self, file_format):
+        def row(pk, name, price):
+            return {
+                "id": pk,
+                "name": name,
+                "description": "Белая",
+                "price": price,
+            }
+
+        path = self.directory / f"items.{file_format}"
+        call_command("export_items", str(path), stdout=StringIO())
+        with open(path, encoding="utf-8", newline="") as stream:
+            rows = [row for _, row in read_rows(stream, file_format)]
+        # В CSV все значения - строки
+        mug_id = self.mug.pk if file_format == "jsonl" else str(self.mug.pk)
+        self.assertEqual(rows[0], row(mug_id, "Кружка", "1.50"))
+
+        explicit_id = self.shirt.pk + 10
+        rows[0] = row(mug_id, "Кружка 2", "2.00")
+        rows += [
+            row(explicit_id, "Шарф", "9"),
+            row("", "Носки", "1.10"),
+            row("", "", "1"),
+            row("x", "Шапка", "abc"),
+        ]
+        with open(path, "w", encoding="utf-8", newline="") as stream:
+            writer = RowWriter(stream, file_format)
+            for line in rows:
+                writer.write(line)
+        stdout, stderr = StringIO(), StringIO()
+
+        call_command(
+            "import_items",
+            str(path),
+            batch_size=2,
+            stdout=stdout,
+            stderr=stderr,
+        )
+
+        self.assertIn(
+            "Импортировано товаров: 4, пропущено строк: 2",
+            stdout.getvalue(),
+        )
+        errors = stderr.getvalue().splitlines()
+        self.assertEqual(len(errors), 2)
+        self.assertIn("name", errors[0])
+        self.assertIn("id", errors[1])
+        self.assertIn("price", errors[1])
+        items = Item.objects.order_by("pk").values_list("name", "price")
+        self.assertEqual(
+            list(items),
+            [
+                ("Кружка 2", 200),
+                ("Футболка", 2500),
+                ("Шарф", 900),
+                ("Носки", 110),
+            ],
+        )
+        self.assertEqual(Item.objects.get(name="Шарф").pk, explicit_id)
+        # Последовательность сдвинута за явные id: новые не конфликтуют
+        self.assertGreater(Item.objects.get(name="Носки").pk, explicit_id)
+        created = Item.objects.create(name="Новый", description="", price=1)
+        self.assertGreater(created.pk, explicit_id)
+
+
+class OrderTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = Item.objects.create(
+            name="Товар",
+            description="",
+            price=1000,
+        )
+        cls.discount = Discount.objects.create(
+            name="Скидка",
+            discount_type=AdjustmentType.PERCENT,
+            value=Decimal(10),
+        )
+        cls.tax = Tax.objects.create(
+            name="НДС",
+            tax_type=AdjustmentType.PERCENT,
+            value=Decimal(20),
+        )
+
+    def test_changing_discount_and_tax_recalculates_totals(self):
+        order = Order.objects.create()
+        OrderItem.objects.create(order=order, item=self.item, quantity=2)
+        self.assertEqual(order.total_amount, 2000)
+
+        order.discount = self.discount
+        order.tax = self.tax
+        order.save()
+
+        order.refresh_from_db()
+        self.assertEqual(order.discount_amount, 200)
+        self.assertEqual(order.tax_amount, 360)
+        self.assertEqual(order.total_amount, 2160)
+
+        order = Order.objects.get(pk=order.pk)
+        order.discount = None
+        order.save(update_fields=["discount"])
+        order.refresh_from_db()
+        self.assertEqual(order.total_amount, 2400)
+
+    def test_save_without_adjustment_changes_skips_recalculation(self):
+        order = Order.objects.create(discount=self.discount)
+        order = Order.objects.get(pk=order.pk)
+        order.is_paid = True
+
+        with self.assertNumQueries(1):
+            order.save()
+
+
+class OrderTotalsMigrationTests(TransactionTestCase):
+    migrate_from = [("items", "0003_order_checkout_session")]
+    migrate_to = [("items", "0004_order_totals_orderitem_unit_price")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_stored_totals_apply_discount_and_tax(self):
+        apps = self.migrate(self.migrate_from)
+        item = apps.get_model("items", "Item").objects.create(
+            name="Товар",
+            description="",
+            price=1000,
+        )
+        discount = apps.get_model("items", "Discount").objects.create(
+            name="Скидка",
+            discount_type="fixed",
+            value=Decimal(300),
+        )
+        tax = apps.get_model("items", "Tax").objects.create(
+            name="НДС",
+            tax_type="percent",
+            value=Decimal(20),
+        )
+        Order = apps.get_model("items", "Order")
+        OrderItem = apps.get_model("items", "OrderItem")
+        orders = [
+            Order.objects.create(),
+            Order.objects.create(discount=discount, tax=tax),
+        ]
+        for order in orders:
+            OrderItem.objects.create(order=order, item=item, quantity=2)
+
+        apps = self.migrate(self.migrate_to)
+
+        amounts = apps.get_model("items", "Order").objects.order_by("pk")
+        self.assertEqual(
+            list(
+                amounts.values_list(
+                    "subtotal_amount",
+                    "discount_amount",
+                    "tax_amount",
+                    "total_amount",
+                )
+            ),
+            [(2000, 0, 0, 2000), (2000, 300, 340, 2040)],
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "планы запросов Postgres")
+class IndexUsageTests(TestCase):
+    """Горячие запросы заказов и сводок идут по своим индексам"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = Item.objects.create(name="Товар", description="", price=100)
+        cls.order = Order.objects.create(stripe_session_id="cs_test")
+        OrderItem.objects.create(
+            order=cls.order, item=cls.item, quantity=1, unit_price=100
+        )
+
+    def setUp(self):
+        # На пустых таблицах последовательное чтение всегда дешевле,
+        # проверяем, что индекс подходит запросу
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(f"Index Scan using {index}", plan.replace("Only ", ""))
+
+    def test_order_lookups(self):
+        now = timezone.now()
+        cases = [
+            (
+                Order.objects.for_stripe_session("cs_test"),
+                "order_stripe_session_id_uniq",
+            ),
+            (
+                Order.objects.paid().created_between(
+                    now - timedelta(days=1),
+                    now,
+                ),
+                "order_is_paid_created_at_idx",
+            ),
+            (
+                OrderItem.objects.filter(order=self.order, item=self.item),
+                "orderitem_order_item_idx",
+            ),
+        ]
+        for queryset, index in cases:
+            with self.subTest(index=index):
+                self.assertUsesIndex(queryset, index)
+
+    def test_sales_rollups(self):
+        now = timezone.now()
+        rollups = SalesRollup.objects.filter(
+            granularity=RollupGranularity.DAY,
+            period_start__gte=now - timedelta(days=30),
+            period_start__lt=now,
+        )
+        self.assertUsesIndex(
+            rollups.filter(item=None),
+            "salesrollup_total_period_uniq",
+        )
+        self.assertUsesIndex(
+            rollups.filter(item=self.item),
+            "salesrollup_item_period",
+        )
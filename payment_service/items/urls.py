@@ -1,16 +1,22 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
+if settings.SERVER_MODE == "asgi":
+    item_view, item_list_view = views.AsyncItemView, views.AsyncItemListView
+else:
+    item_view, item_list_view = views.ItemView, views.ItemListView
+
 urlpatterns = [
     path(
         "<int:pk>/",
-        views.ItemView.as_view(),
+        item_view.as_view(),
         name="item_detail",
     ),
     path(
         "",
-        views.ItemListView.as_view(),
+        item_list_view.as_view(),
         name="items_list",
-    )
+    ),
 ]
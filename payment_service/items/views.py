@@ -1,24 +1,24 @@
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.shortcuts import get_object_or_404
-from django.views.generic import DetailView
+from django.shortcuts import render
+from django.views import View
 from django.views.generic.list import ListView
 
+from .catalogue import (
+    catalogue_queryset,
+    get_item_page,
+    item_page_response,
+    parse_cursor,
+    render_item_cards,
+    split_page,
+)
 from .models import Item
 
 
-class ItemView(DetailView):
-    model = Item
-    template_name = "item.html"
-    context_object_name = "item"
-
-    def get_object(self, queryset=None):
-        pk = self.kwargs.get("pk")
-        return get_object_or_404(Item, pk=pk)
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["stripe_publishable_key"] = settings.STRIPE_PUBLISHABLE_KEY
-        return context
+class ItemView(View):
+    def get(self, request, pk):
+        updated_at, content = get_item_page(pk)
+        return item_page_response(request, pk, updated_at, content)
 
 
 class ItemListView(ListView):
@@ -26,7 +26,36 @@ class ItemListView(ListView):
     template_name = "items.html"
     context_object_name = "items"
 
+    def get_queryset(self):
+        return catalogue_queryset(parse_cursor(self.request.GET.get("after")))
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        items, next_after = split_page(list(context["items"]))
+        context["items"] = items
+        context["cards"] = render_item_cards(items)
+        context["next_after"] = next_after
         context["stripe_publishable_key"] = settings.STRIPE_PUBLISHABLE_KEY
         return context
+
+
+class AsyncItemView(View):
+    async def get(self, request, pk):
+        updated_at, content = await sync_to_async(get_item_page)(pk)
+        return item_page_response(request, pk, updated_at, content)
+
+
+class AsyncItemListView(View):
+    async def get(self, request):
+        queryset = catalogue_queryset(parse_cursor(request.GET.get("after")))
+        items, next_after = split_page([item async for item in queryset])
+        return render(
+            request,
+            "items.html",
+            {
+                "items": items,
+                "cards": await sync_to_async(render_item_cards)(items),
+                "next_after": next_after,
+                "stripe_publishable_key": settings.STRIPE_PUBLISHABLE_KEY,
+            },
+        )
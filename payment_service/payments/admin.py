@@ -0,0 +1,154 @@
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.widgets import ForeignKeyRawIdWidget
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import Http404
+from django.urls import NoReverseMatch, path, reverse
+from django.utils.functional import cached_property
+from django.utils.text import Truncator
+
+from items.models import Order, OrderItem
+
+from .reports import EXPORT_FORMATS, export_response
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Для большой таблицы без фильтров берет оценку числа строк из
+    статистики Postgres вместо COUNT(*) по всей таблице
+    """
+
+    exact_count_threshold = 10_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql" and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            # reltuples = -1, пока таблицу ни разу не анализировали
+            if row and row[0] > self.exact_count_threshold:
+                return int(row[0])
+        return super().count
+
+
+class LoadedRawIdWidget(ForeignKeyRawIdWidget):
+    """
+    Подпись рядом с ID берет из уже загруженного объекта (obj), а не
+    отдельным запросом: в заказе могут быть сотни позиций
+    """
+
+    obj = None
+
+    def label_and_url_for_value(self, value):
+        obj = self.obj
+        if obj is None or str(obj.pk) != str(value):
+            return super().label_and_url_for_value(value)
+        opts = obj._meta
+        view_name = f"{opts.app_label}_{opts.model_name}_change"
+        try:
+            url = reverse(
+                f"{self.admin_site.name}:{view_name}",
+                args=(obj.pk,),
+            )
+        except NoReverseMatch:
+            url = ""
+        return Truncator(obj).words(14), url
+
+
+class OrderItemInlineForm(forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.item_id is not None:
+            self.fields["item"].widget.obj = self.instance.item
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    form = OrderItemInlineForm
+    fields = ["item", "quantity", "unit_price"]
+    raw_id_fields = ["item"]
+    extra = 0
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("item")
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == "item":
+            kwargs["widget"] = LoadedRawIdWidget(
+                db_field.remote_field,
+                self.admin_site,
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "created_at",
+        "is_paid",
+        "get_total_display",
+        "discount",
+        "tax",
+    ]
+    list_select_related = ["discount", "tax"]
+    list_filter = ["is_paid", "created_at"]
+    search_fields = ["=stripe_session_id"]
+    readonly_fields = [
+        "created_at",
+        "stripe_session_id",
+        "stripe_session_expires_at",
+        "checkout_key",
+        "subtotal_amount",
+        "discount_amount",
+        "tax_amount",
+        "total_amount",
+    ]
+    inlines = [OrderItemInline]
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+
+    def get_total_display(self, obj):
+        return obj.total_amount_display
+
+    get_total_display.short_description = "Итого"
+    get_total_display.admin_order_field = "total_amount"
+
+    def get_urls(self):
+        return [
+            path(
+                "export/<str:file_format>/",
+                self.admin_site.admin_view(self.export_view),
+                name="items_order_export",
+            ),
+        ] + super().get_urls()
+
+    def export_view(self, request, file_format):
+        """Выгрузка заказов с фильтрами текущего списка в CSV или JSONL"""
+        if file_format not in EXPORT_FORMATS:
+            raise Http404
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        changelist = self.get_changelist_instance(request)
+        return export_response(
+            changelist.get_queryset(request),
+            file_format,
+            "orders",
+        )
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(admin.ModelAdmin):
+    list_display = ["__str__", "quantity", "unit_price"]
+    list_select_related = ["order", "item"]
+    raw_id_fields = ["order", "item"]
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
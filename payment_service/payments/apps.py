@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class PaymentConfig(AppConfig):
     name = "payments"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .stripe_client import configure_stripe
+
+        configure_stripe()
@@ -0,0 +1,282 @@
+import hashlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.connection import ConnectionProxy
+
+from config.cache import shared_caches
+from items.models import AdjustmentType, Order, OrderItem
+from items.pricing import price_order
+
+CACHE_KEY_PREFIX = "checkout-session"
+# Оплаченная сессия должна пропасть из кэша сразу во всех воркерах,
+# поэтому без локального уровня. Бэкенд и пул соединений с Redis - один
+# на процесс, а не на гринлет
+cache = ConnectionProxy(shared_caches, "shared")
+
+
+def make_checkout_key(lines, client_id):
+    # ID цены Stripe меняет параметры Session.create, а с ними должен
+    # меняться и idempotency key
+    raw = ";".join(
+        f"{item.pk}:{quantity}:{item.price}:{item.synced_stripe_price_id}"
+        for item, quantity in sorted(lines, key=lambda line: line[0].pk)
+    )
+    return hashlib.sha256(f"{raw}|{client_id}".encode()).hexdigest()
+
+
+def _cache_key(checkout_key):
+    return f"{CACHE_KEY_PREFIX}:{checkout_key}"
+
+
+def forget_checkout_sessions(checkout_keys):
+    cache.delete_many([_cache_key(key) for key in checkout_keys])
+
+
+def _cache_timeout(order, now):
+    margin = settings.CHECKOUT_SESSION_REUSE_MARGIN
+    return int(
+        (order.stripe_session_expires_at - now).total_seconds() - margin,
+    )
+
+
+def _session_window(now):
+    """
+    Окно жизни сессии: сессии, созданные в одном окне, получают одинаковые
+    idempotency key и expires_at, поэтому параллельные запросы клиента
+    Stripe схлопывает в одну сессию
+    """
+    ttl = settings.CHECKOUT_SESSION_TTL
+    window = int(now.timestamp()) // ttl
+    return window, (window + 2) * ttl
+
+
+def _store_stripe_id(rule, field, stripe_id):
+    # update() вместо save(): не сбрасываем кэш правил, объект из кэша
+    # получает ID сразу, остальные воркеры - при следующей загрузке правил
+    type(rule).objects.filter(pk=rule.pk).update(**{field: stripe_id})
+    setattr(rule, field, stripe_id)
+
+
+def stripe_coupon_id(discount):
+    """Купон Stripe создается один раз на скидку, а не на каждую покупку"""
+    if discount.stripe_coupon_id is None:
+        params = {"name": discount.name, "duration": "once"}
+        if discount.discount_type == AdjustmentType.PERCENT:
+            params["percent_off"] = float(discount.value)
+        else:
+            params["amount_off"] = int(discount.value)
+            params["currency"] = "usd"
+        terms = f"{discount.discount_type}:{discount.value}"
+        coupon = stripe.Coupon.create(
+            **params,
+            idempotency_key=f"discount:{discount.pk}:{terms}",
+        )
+        _store_stripe_id(discount, "stripe_coupon_id", coupon.id)
+    return discount.stripe_coupon_id
+
+
+def stripe_tax_rate_id(tax):
+    if tax.stripe_tax_rate_id is None:
+        tax_rate = stripe.TaxRate.create(
+            display_name=tax.name,
+            percentage=float(tax.value),
+            inclusive=False,
+            idempotency_key=f"tax:{tax.pk}:{tax.value}",
+        )
+        _store_stripe_id(tax, "stripe_tax_rate_id", tax_rate.id)
+    return tax.stripe_tax_rate_id
+
+
+def _line_item(item, quantity):
+    price_id = item.synced_stripe_price_id
+    if price_id:
+        return {"price": price_id, "quantity": quantity}
+    # Товар еще не синхронизирован со Stripe (sync_stripe_products)
+    return {
+        "price_data": {
+            "currency": "usd",
+            "product_data": {
+                "name": item.name,
+                "description": item.description or None,
+            },
+            "unit_amount": item.price,
+        },
+        "quantity": quantity,
+    }
+
+
+def _line_items(lines, price):
+    line_items = [_line_item(item, quantity) for item, quantity in lines]
+    tax = price.tax
+    if tax is not None and tax.tax_type == AdjustmentType.PERCENT:
+        tax_rate_id = stripe_tax_rate_id(tax)
+        for line_item in line_items:
+            line_item["tax_rates"] = [tax_rate_id]
+    return line_items
+
+
+def _fixed_tax_shipping_options(price):
+    """
+    Налоговые ставки Stripe бывают только процентными. Фиксированный налог
+    уходит стоимостью доставки: отдельную позицию уменьшил бы купон
+    скидки, а на доставку купоны не действуют
+    """
+    return [
+        {
+            "shipping_rate_data": {
+                "type": "fixed_amount",
+                "display_name": price.tax.name,
+                "fixed_amount": {
+                    "amount": price.tax_amount,
+                    "currency": "usd",
+                },
+            },
+        },
+    ]
+
+
+def prepare_session(
+    lines,
+    checkout_key,
+    attempt,
+    success_url,
+    cancel_url,
+    now,
+):
+    """Считает цену заказа и параметры Session.create"""
+    price = price_order(sum(item.price * quantity for item, quantity in lines))
+    window, expires_at = _session_window(now)
+    params = {
+        "line_items": _line_items(lines, price),
+        "mode": "payment",
+        "success_url": success_url,
+        "cancel_url": cancel_url,
+        "expires_at": expires_at,
+        # attempt - число прежних заказов с этим ключом: после оплаты или
+        # истечения сессии Stripe не должен вернуть ее повторно
+        "idempotency_key": f"{checkout_key}:{window}:{attempt}",
+    }
+    if price.discount is not None:
+        params["discounts"] = [{"coupon": stripe_coupon_id(price.discount)}]
+    if price.tax is not None and price.tax.tax_type == AdjustmentType.FIXED:
+        params["shipping_options"] = _fixed_tax_shipping_options(price)
+    return price, params
+
+
+def open_orders(checkout_key, now):
+    reuse_until = now + timedelta(
+        seconds=settings.CHECKOUT_SESSION_REUSE_MARGIN,
+    )
+    return (
+        Order.objects.unpaid()
+        .filter(
+            checkout_key=checkout_key,
+            stripe_session_expires_at__gt=reuse_until,
+        )
+        .only("stripe_session_id", "stripe_session_expires_at")
+        .order_by("-stripe_session_expires_at")
+    )
+
+
+def save_order(session, lines, price, checkout_key):
+    with transaction.atomic():
+        order, created = Order.objects.get_or_create(
+            stripe_session_id=session.id,
+            defaults={
+                "checkout_key": checkout_key,
+                "stripe_session_expires_at": datetime.fromtimestamp(
+                    session.expires_at, tz=dt_timezone.utc
+                ),
+                "discount": price.discount,
+                "tax": price.tax,
+                "subtotal_amount": price.subtotal,
+                "discount_amount": price.discount_amount,
+                "tax_amount": price.tax_amount,
+                "total_amount": price.total,
+            },
+        )
+        if created:
+            OrderItem.objects.bulk_create(
+                [
+                    OrderItem(
+                        order=order,
+                        item=item,
+                        quantity=quantity,
+                        unit_price=item.price,
+                    )
+                    for item, quantity in lines
+                ]
+            )
+    return order
+
+
+def get_or_create_checkout_session(lines, client_id, success_url, cancel_url):
+    """
+    Возвращает ID открытой сессии Stripe для корзины lines - списка пар
+    (товар, количество) - и клиента.
+    Сначала смотрим кэш, затем незакрытый заказ в БД, и только потом
+    создаем новую сессию в Stripe
+    """
+    checkout_key = make_checkout_key(lines, client_id)
+    session_id = cache.get(_cache_key(checkout_key))
+    if session_id:
+        return session_id
+
+    now = timezone.now()
+    order = open_orders(checkout_key, now).first()
+    if order is None:
+        attempt = Order.objects.filter(checkout_key=checkout_key).count()
+        price, params = prepare_session(
+            lines, checkout_key, attempt, success_url, cancel_url, now
+        )
+        session = stripe.checkout.Session.create(**params)
+        order = save_order(session, lines, price, checkout_key)
+
+    timeout = _cache_timeout(order, now)
+    if timeout > 0:
+        cache.set(_cache_key(checkout_key), order.stripe_session_id, timeout)
+    return order.stripe_session_id
+
+
+async def aget_or_create_checkout_session(
+    lines,
+    client_id,
+    success_url,
+    cancel_url,
+):
+    """Асинхронный вариант get_or_create_checkout_session для ASGI"""
+    checkout_key = make_checkout_key(lines, client_id)
+    session_id = await cache.aget(_cache_key(checkout_key))
+    if session_id:
+        return session_id
+
+    now = timezone.now()
+    order = await open_orders(checkout_key, now).afirst()
+    if order is None:
+        attempt = await Order.objects.filter(
+            checkout_key=checkout_key,
+        ).acount()
+        price, params = await sync_to_async(prepare_session)(
+            lines, checkout_key, attempt, success_url, cancel_url, now
+        )
+        session = await stripe.checkout.Session.create_async(**params)
+        order = await sync_to_async(save_order)(
+            session,
+            lines,
+            price,
+            checkout_key,
+        )
+
+    timeout = _cache_timeout(order, now)
+    if timeout > 0:
+        await cache.aset(
+            _cache_key(checkout_key),
+            order.stripe_session_id,
+            timeout,
+        )
+    return order.stripe_session_id
@@ -0,0 +1,121 @@
+import hashlib
+import hmac
+import itertools
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Префикс ID объектов и тип объекта по пути запроса Stripe API
+OBJECTS = {
+    "/v1/checkout/sessions": ("cs_fake", "checkout.session"),
+    "/v1/coupons": ("co_fake", "coupon"),
+    "/v1/tax_rates": ("txr_fake", "tax_rate"),
+    "/v1/products": ("prod_fake", "product"),
+    "/v1/prices": ("price_fake", "price"),
+}
+
+
+def sign_webhook(payload, secret):
+    """Заголовок Stripe-Signature для тела вебхука, как его считает Stripe"""
+    timestamp = int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        collection, _, object_id = self.path.rpartition("/")
+        if self.path in OBJECTS:
+            collection, object_id = self.path, None
+        elif collection not in OBJECTS or object_id not in self.server.objects:
+            return self._respond(404, {"error": {"message": "Unknown path"}})
+
+        time.sleep(self.server.latency)
+        key = self.headers.get("Idempotency-Key")
+        with self.server.lock:
+            self.server.connections.add(self.client_address)
+            self.server.requests += 1
+            self.server.request_bytes += len(body)
+            if self.server.failures:
+                self.server.failures -= 1
+                return self._respond(500, {"error": {"message": "Fake error"}})
+            if key in self.server.replies:
+                return self._respond(200, self.server.replies[key])
+            params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+            if object_id is not None:
+                # Изменение существующего объекта: POST /v1/<объекты>/<id>
+                self.server.objects[object_id].update(params)
+                return self._respond(200, self.server.objects[object_id])
+            prefix, object_name = OBJECTS[collection]
+            reply = {
+                "id": f"{prefix}_{next(self.server.ids)}",
+                "object": object_name,
+            }
+            if object_name == "checkout.session":
+                reply["expires_at"] = int(
+                    params.get("expires_at", time.time() + 1800),
+                )
+            self.server.objects[reply["id"]] = {**params, **reply}
+            if key:
+                self.server.replies[key] = reply
+        self._respond(200, reply)
+
+    def _respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    """
+    Локальная заглушка Stripe API для бенчмарков: создает и изменяет
+    сессии, купоны, налоговые ставки, продукты и цены с заданной задержкой
+    и учитывает Idempotency-Key как настоящий Stripe. failures - сколько
+    следующих запросов ответить ошибкой 500, port=0 - любой свободный порт.
+    connections - адреса клиентов: по ним видно переиспользование соединений
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, port=0):
+        super().__init__(("127.0.0.1", port), FakeStripeHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.replies = {}
+        self.objects = {}
+        self.connections = set()
+        self.requests = 0
+        self.request_bytes = 0
+        self.failures = 0
+
+    def handle_error(self, request, client_address):
+        # Клиент не дождался ответа (таймаут) - это не ошибка заглушки
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def api_base(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,477 @@
+import json
+import random
+import statistics
+import threading
+import time
+from datetime import timedelta
+
+import httpx
+import stripe
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, connections
+from django.db.models import Q
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from items.models import Item, Order, OrderItem, RollupGranularity
+from items.rollups import period_start, rebuild_rollups
+from payments.fake_stripe import FakeStripeServer, sign_webhook
+from payments.models import StripeSyncTask, WebhookEvent
+from payments.product_sync import enqueue_item_sync, process_sync_tasks
+from payments.webhooks import process_pending_events
+
+BENCH_PREFIX = "bench-"
+ROLLUP_PERIODS = {
+    RollupGranularity.HOUR: timedelta(hours=1),
+    RollupGranularity.DAY: timedelta(days=1),
+}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(latencies, percent):
+    if len(latencies) < 2:
+        return latencies[0] if latencies else None
+    return statistics.quantiles(latencies, n=100)[percent - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет БД синтетическими товарами и заказами, нагружает /item/, "
+        "/item/<pk>/ и /buy/<pk>/ с локальной заглушкой Stripe и печатает "
+        "результат в JSON. С --webhooks проигрывает вебхуки Stripe, с --url "
+        "нагружает по HTTP запущенный сервер, например gunicorn с "
+        "SERVER_MODE=wsgi и SERVER_MODE=asgi"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=1000)
+        parser.add_argument("--orders", type=int, default=200)
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=500,
+            help="Запросов на каждую ручку",
+        )
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--clients",
+            type=int,
+            default=50,
+            help="Число разных покупателей для /buy/",
+        )
+        parser.add_argument(
+            "--stripe-latency",
+            type=float,
+            default=50,
+            help="Задержка ответа заглушки Stripe, мс",
+        )
+        parser.add_argument(
+            "--url",
+            help=(
+                "Адрес запущенного сервера вместо тестового клиента в "
+                "процессе. Сервер должен работать с той же БД, "
+                "STRIPE_API_BASE=http://127.0.0.1:<--stripe-port> и, для "
+                "--webhooks, заданным STRIPE_WEBHOOK_SECRET"
+            ),
+        )
+        parser.add_argument(
+            "--stripe-port",
+            type=int,
+            default=0,
+            help="Порт заглушки Stripe, по умолчанию любой свободный",
+        )
+        parser.add_argument("--output", help="Файл для JSON результата")
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Не удалять синтетические данные после прогона",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--sync-products",
+            action="store_true",
+            help="Перед нагрузкой синхронизировать товары с продуктами Stripe",
+        )
+        parser.add_argument(
+            "--webhooks",
+            action="store_true",
+            help=(
+                "Проиграть события Stripe об оплате и истечении заказов "
+                "бенчмарка на /buy/webhook/ (каждое дважды, как при "
+                "повторной доставке) и замерить разбор очереди"
+            ),
+        )
+        parser.add_argument(
+            "--rate-limit",
+            action="store_true",
+            help="Не отключать лимит частоты на /buy/ (отказы - ошибки 429)",
+        )
+
+    def handle(self, *args, **options):
+        self.check_no_bench_data()
+        random.seed(options["seed"])
+        started_at = timezone.now()
+        item_ids = self.seed_items(options["items"])
+        order_ids = self.seed_orders(item_ids, options["orders"])
+        # Ровно те события, которые отправит webhook_request
+        event_ids = sorted(
+            {f"evt_{BENCH_PREFIX}{n // 2}" for n in range(options["requests"])}
+        )
+        webhook_secret = settings.STRIPE_WEBHOOK_SECRET or "whsec_bench"
+
+        # Ручка -> функция номера запроса в (путь, тело POST или None для
+        # GET, заголовки). Тело bytes уходит как JSON, словарь - как форма
+        endpoints = {
+            "item_list": lambda n: ("/item/", None, {}),
+            "item_detail": lambda n: (
+                f"/item/{random.choice(item_ids)}/",
+                None,
+                {},
+            ),
+            # Каждый покупатель повторно жмет "купить" на своем товаре
+            "checkout": lambda n: (
+                f"/buy/{item_ids[n % options['clients'] % len(item_ids)]}/",
+                {"quantity": 1 + n % options["clients"] % 3},
+                {},
+            ),
+        }
+        if options["webhooks"]:
+            endpoints["webhook"] = lambda n: self.webhook_request(
+                n, options["orders"], webhook_secret
+            )
+
+        stripe_api_base, stripe_api_key = stripe.api_base, stripe.api_key
+        # По умолчанию меряем само приложение: лимит на /buy/ отрезал бы
+        # почти всю нагрузку
+        bench_settings = override_settings(
+            RATE_LIMITED_VIEWS=(
+                settings.RATE_LIMITED_VIEWS if options["rate_limit"] else set()
+            ),
+            STRIPE_WEBHOOK_SECRET=webhook_secret,
+        )
+        try:
+            with bench_settings, FakeStripeServer(
+                options["stripe_latency"] / 1000, options["stripe_port"]
+            ) as server:
+                stripe.api_base = server.api_base
+                # Заглушке подходит любой ключ, настоящий не нужен
+                stripe.api_key = stripe_api_key or "sk_test_bench"
+                if options["sync_products"]:
+                    enqueue_item_sync(item_ids)
+                    while process_sync_tasks(settings.STRIPE_SYNC_BATCH_SIZE):
+                        pass
+                    server.requests = server.request_bytes = 0
+                results = {
+                    name: self.run_load(path_for, options)
+                    for name, path_for in endpoints.items()
+                }
+                results["checkout"].update(
+                    stripe_requests=server.requests,
+                    stripe_request_bytes=server.request_bytes,
+                )
+                if options["webhooks"]:
+                    results["webhook"]["queue"] = self.process_webhooks(
+                        event_ids,
+                        order_ids,
+                    )
+        finally:
+            stripe.api_base, stripe.api_key = stripe_api_base, stripe_api_key
+            if not options["keep"]:
+                self.cleanup(
+                    item_ids,
+                    order_ids,
+                    event_ids if options["webhooks"] else [],
+                    started_at if options["webhooks"] else None,
+                )
+
+        # Режим сервера из --url задает его окружение, а не наше
+        server_mode = None if options["url"] else settings.SERVER_MODE
+        report = json.dumps(
+            {
+                "config": {
+                    key: options[key]
+                    for key in (
+                        "items",
+                        "orders",
+                        "requests",
+                        "concurrency",
+                        "clients",
+                        "stripe_latency",
+                        "seed",
+                        "sync_products",
+                        "webhooks",
+                        "rate_limit",
+                        "url",
+                    )
+                },
+                "server_mode": server_mode,
+                "endpoints": results,
+            },
+            indent=2,
+        )
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                output.write(report)
+        self.stdout.write(report)
+
+    def check_no_bench_data(self):
+        """
+        Чистка удаляет только созданное этим прогоном, но чужие строки
+        с теми же ключами сломали бы заказы и вебхуки бенчмарка
+        """
+        orders = Order.objects.filter(
+            Q(checkout_key__startswith=BENCH_PREFIX)
+            | Q(stripe_session_id__startswith=f"cs_{BENCH_PREFIX}"),
+        )
+        leftovers = (
+            Item.objects.filter(name__startswith=BENCH_PREFIX),
+            orders,
+            WebhookEvent.objects.filter(
+                event_id__startswith=f"evt_{BENCH_PREFIX}",
+            ),
+        )
+        if any(queryset.exists() for queryset in leftovers):
+            raise CommandError(
+                f"В базе уже есть данные с префиксом {BENCH_PREFIX!r} "
+                "(например, после --keep): запустите bench на отдельной "
+                "базе или удалите их"
+            )
+
+    def seed_items(self, count):
+        items = Item.objects.bulk_create(
+            [
+                Item(
+                    name=f"{BENCH_PREFIX}{i}",
+                    description="Синтетический товар для бенчмарка",
+                    price=random.randint(100, 100_000),
+                )
+                for i in range(count)
+            ],
+            batch_size=1000,
+        )
+        return [item.pk for item in items]
+
+    def seed_orders(self, item_ids, count):
+        orders = Order.objects.bulk_create(
+            [
+                Order(
+                    checkout_key=f"{BENCH_PREFIX}{i}",
+                    stripe_session_id=f"cs_{BENCH_PREFIX}{i}",
+                )
+                for i in range(count)
+            ]
+        )
+        prices = dict(
+            Item.objects.filter(pk__in=item_ids).values_list("pk", "price"),
+        )
+        lines = []
+        for order in orders:
+            for item_id in random.sample(item_ids, min(5, len(item_ids))):
+                lines.append(
+                    OrderItem(
+                        order=order,
+                        item_id=item_id,
+                        quantity=random.randint(1, 3),
+                        unit_price=prices[item_id],
+                    )
+                )
+        OrderItem.objects.bulk_create(lines, batch_size=1000)
+        return [order.pk for order in orders]
+
+    def webhook_request(self, n, orders, secret):
+        # Каждое событие приходит дважды подряд, как при повторной
+        # доставке Stripe; каждое четвертое - истечение сессии
+        number = n // 2
+        expired = number % 4 == 3
+        payload = json.dumps(
+            {
+                "id": f"evt_{BENCH_PREFIX}{number}",
+                "object": "event",
+                "type": (
+                    WebhookEvent.CHECKOUT_EXPIRED
+                    if expired
+                    else WebhookEvent.CHECKOUT_COMPLETED
+                ),
+                "data": {
+                    "object": {
+                        "id": f"cs_{BENCH_PREFIX}{number % orders}",
+                        "object": "checkout.session",
+                        "payment_status": "unpaid" if expired else "paid",
+                    }
+                },
+            }
+        )
+        headers = {"Stripe-Signature": sign_webhook(payload, secret)}
+        return "/buy/webhook/", payload.encode(), headers
+
+    def process_webhooks(self, event_ids, order_ids):
+        queued = WebhookEvent.objects.filter(event_id__in=event_ids).count()
+        batches = 0
+        started = time.perf_counter()
+        while process_pending_events(settings.WEBHOOK_BATCH_SIZE):
+            batches += 1
+        duration = time.perf_counter() - started
+        paid = Order.objects.paid().filter(pk__in=order_ids)
+        return {
+            "events": queued,
+            "batches": batches,
+            "duration_s": round(duration, 3),
+            "events_per_s": round(queued / duration, 1) if duration else None,
+            "paid_orders": paid.count(),
+        }
+
+    def cleanup(self, item_ids, order_ids, event_ids, rollups_since=None):
+        """
+        Удаляет только строки этого прогона: засеянные товары и заказы,
+        заказы покупок этих товаров и отправленные события
+        """
+        Order.objects.filter(order_items__item_id__in=item_ids).delete()
+        Order.objects.filter(pk__in=order_ids).delete()
+        Item.objects.filter(pk__in=item_ids).delete()
+        # Удаление товаров ставит в очередь архивацию их продуктов Stripe
+        StripeSyncTask.objects.filter(item_id__in=item_ids).delete()
+        WebhookEvent.objects.filter(event_id__in=event_ids).delete()
+        # Оплаченные вебхуками заказы попали в сводки продаж
+        if rollups_since is not None:
+            now = timezone.now()
+            for granularity, period in ROLLUP_PERIODS.items():
+                rebuild_rollups(
+                    granularity,
+                    period_start(rollups_since, granularity),
+                    period_start(now, granularity) + period,
+                )
+
+    def csrf_headers(self, client):
+        """Токен и cookie CSRF для покупок, как их берет catalogue.js"""
+        response = client.get(
+            "/buy/csrf/",
+            headers={"X-Forwarded-Proto": "https"},
+        )
+        response.raise_for_status()
+        # Cookie с флагом Secure httpx по http не отправит, передаем сами.
+        # Запрос считается https, поэтому Django сверяет и Origin
+        cookie = response.cookies[settings.CSRF_COOKIE_NAME]
+        return {
+            "X-CSRFToken": response.json()["token"],
+            "Cookie": f"{settings.CSRF_COOKIE_NAME}={cookie}",
+            "Origin": f"https://{client.base_url.netloc.decode()}",
+        }
+
+    def run_load(self, path_for, options):
+        latencies, queries, errors = [], [], []
+        lock = threading.Lock()
+        counter = iter(range(options["requests"]))
+        host = next(
+            (host for host in settings.ALLOWED_HOSTS if host != "*"),
+            "localhost",
+        ).lstrip(".")
+
+        # Номер покупателя -> его заголовки CSRF, общие для всех потоков
+        csrf_by_client = {}
+
+        def client_csrf_headers(client, client_number):
+            if not options["url"]:
+                # Тестовый клиент CSRF не проверяет, cookie задает покупателя
+                secret = f"{client_number:032d}"
+                cookie = f"{settings.CSRF_COOKIE_NAME}={secret}"
+                return {"Cookie": cookie}
+            with lock:
+                if client_number not in csrf_by_client:
+                    client.cookies.clear()
+                    csrf_by_client[client_number] = self.csrf_headers(client)
+                return csrf_by_client[client_number]
+
+        def worker():
+            if options["url"]:
+                client = httpx.Client(base_url=options["url"], timeout=60)
+            else:
+                client = Client(raise_request_exception=False, HTTP_HOST=host)
+            while True:
+                with lock:
+                    n = next(counter, None)
+                if n is None:
+                    break
+                query_counter = QueryCounter()
+                client_number = n % options["clients"]
+                path, data, extra_headers = path_for(n)
+                # Покупателя задают IP и CSRF cookie, а не cookie сессии
+                # предыдущего запроса этого потока
+                headers = {
+                    "User-Agent": "bench",
+                    "X-Forwarded-For": (
+                        f"10.0.{client_number // 256}.{client_number % 256}"
+                    ),
+                    "X-Forwarded-Proto": "https",
+                    **client_csrf_headers(client, client_number),
+                    **extra_headers,
+                }
+                client.cookies.clear()
+                started = time.perf_counter()
+                if options["url"]:
+                    response = client.request(
+                        "GET" if data is None else "POST",
+                        path,
+                        headers=headers,
+                        **(
+                            {"content": data}
+                            if isinstance(data, bytes)
+                            else {"data": data}
+                        ),
+                    )
+                else:
+                    send = client.get if data is None else client.post
+                    kwargs = {"headers": headers}
+                    if isinstance(data, bytes):
+                        kwargs["content_type"] = "application/json"
+                    with connection.execute_wrapper(query_counter):
+                        response = send(path, data, **kwargs)
+                    # Тестовый клиент не закрывает соединения в конце
+                    # запроса, как это делает обработчик Django: без этого
+                    # поток не возвращает соединение в пул
+                    close_old_connections()
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    queries.append(query_counter.count)
+                    if response.status_code >= 400:
+                        errors.append(response.status_code)
+            if options["url"]:
+                client.close()
+            connections.close_all()
+
+        started = time.perf_counter()
+        count = options["concurrency"]
+        threads = [threading.Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - started
+
+        if not latencies:
+            return {"requests": 0, "errors": 0}
+        return {
+            "requests": len(latencies),
+            "errors": len(errors),
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(len(latencies) / duration, 1),
+            "latency_ms": {
+                "mean": round(statistics.fmean(latencies), 2),
+                "p50": round(percentile(latencies, 50), 2),
+                "p95": round(percentile(latencies, 95), 2),
+                "p99": round(percentile(latencies, 99), 2),
+            },
+            # Запросы к БД чужого процесса (--url) не видны
+            "queries_per_request": (
+                None if options["url"] else round(statistics.fmean(queries), 2)
+            ),
+        }
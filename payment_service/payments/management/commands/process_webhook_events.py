@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.webhooks import process_pending_events
+
+
+class Command(BaseCommand):
+    help = "Применяет события Stripe из очереди вебхуков к заказам"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Обработать накопившиеся события и выйти",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.WEBHOOK_BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        while True:
+            processed = process_pending_events(batch_size)
+            if processed:
+                self.stdout.write(f"Обработано событий: {processed}")
+            if processed < batch_size:
+                if options["once"]:
+                    return
+                time.sleep(settings.WEBHOOK_POLL_INTERVAL)
@@ -0,0 +1,47 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from items.models import Item
+from payments.product_sync import enqueue_item_sync, process_sync_tasks
+
+
+class Command(BaseCommand):
+    help = (
+        "Синхронизирует товары с продуктами и ценами Stripe из очереди, "
+        "которую пополняют изменения товаров"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Обработать готовые задачи и выйти",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Сначала поставить в очередь все товары",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.STRIPE_SYNC_BATCH_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        if options["all"]:
+            item_ids = list(Item.objects.values_list("pk", flat=True))
+            enqueue_item_sync(item_ids)
+            self.stdout.write(f"В очереди товаров: {len(item_ids)}")
+
+        batch_size = options["batch_size"]
+        while True:
+            processed = process_sync_tasks(batch_size)
+            if processed:
+                self.stdout.write(f"Обработано товаров: {processed}")
+            if processed < batch_size:
+                if options["once"]:
+                    return
+                time.sleep(settings.STRIPE_SYNC_POLL_INTERVAL)
@@ -0,0 +1,69 @@
+# Generated by Django 6.0 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "event_id",
+                    models.CharField(
+                        max_length=255,
+                        unique=True,
+                        verbose_name="ID события Stripe",
+                    ),
+                ),
+                (
+                    "event_type",
+                    models.CharField(
+                        max_length=64,
+                        verbose_name="Тип события",
+                    ),
+                ),
+                (
+                    "stripe_session_id",
+                    models.CharField(
+                        max_length=255,
+                        verbose_name="ID сессии Stripe",
+                    ),
+                ),
+                (
+                    "received_at",
+                    models.DateTimeField(
+                        auto_now_add=True,
+                        verbose_name="Получено",
+                    ),
+                ),
+                (
+                    "processed_at",
+                    models.DateTimeField(
+                        blank=True,
+                        db_index=True,
+                        null=True,
+                        verbose_name="Обработано",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Событие Stripe",
+                "verbose_name_plural": "События Stripe",
+            },
+        ),
+    ]
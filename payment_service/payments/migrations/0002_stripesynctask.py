@@ -0,0 +1,65 @@
+# Generated by Django 6.0 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StripeSyncTask",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "item_id",
+                    models.IntegerField(unique=True, verbose_name="ID товара"),
+                ),
+                (
+                    "stripe_product_id",
+                    models.CharField(
+                        blank=True,
+                        max_length=255,
+                        null=True,
+                        verbose_name="ID продукта Stripe",
+                    ),
+                ),
+                (
+                    "requested_at",
+                    models.DateTimeField(verbose_name="Запрошено"),
+                ),
+                (
+                    "next_attempt_at",
+                    models.DateTimeField(
+                        db_index=True, verbose_name="Следующая попытка"
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.IntegerField(default=0, verbose_name="Попыток"),
+                ),
+                (
+                    "last_error",
+                    models.TextField(
+                        blank=True,
+                        verbose_name="Последняя ошибка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Синхронизация товара со Stripe",
+                "verbose_name_plural": "Синхронизация товаров со Stripe",
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0002_stripesynctask"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="webhookevent",
+            name="payment_status",
+            field=models.CharField(
+                blank=True,
+                max_length=32,
+                verbose_name="Статус оплаты",
+            ),
+        ),
+    ]
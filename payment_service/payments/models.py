@@ -0,0 +1,106 @@
+from django.db import models
+
+
+class WebhookEvent(models.Model):
+    """
+    Очередь событий Stripe: вебхук только сохраняет событие, заказы
+    обновляет воркер process_webhook_events пачками
+    """
+
+    CHECKOUT_COMPLETED = "checkout.session.completed"
+    CHECKOUT_ASYNC_PAID = "checkout.session.async_payment_succeeded"
+    CHECKOUT_EXPIRED = "checkout.session.expired"
+    HANDLED_TYPES = (
+        CHECKOUT_COMPLETED,
+        CHECKOUT_ASYNC_PAID,
+        CHECKOUT_EXPIRED,
+    )
+    # completed с отложенной оплатой (банковский перевод) приходит с unpaid,
+    # деньги подтверждает async_payment_succeeded
+    PAID_STATUSES = ("paid", "no_payment_required")
+
+    event_id = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name="ID события Stripe",
+    )
+    event_type = models.CharField(
+        max_length=64,
+        verbose_name="Тип события",
+    )
+    stripe_session_id = models.CharField(
+        max_length=255,
+        verbose_name="ID сессии Stripe",
+    )
+    payment_status = models.CharField(
+        max_length=32,
+        blank=True,
+        verbose_name="Статус оплаты",
+    )
+    received_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Получено",
+    )
+    processed_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_index=True,
+        verbose_name="Обработано",
+    )
+
+    class Meta:
+        verbose_name = "Событие Stripe"
+        verbose_name_plural = "События Stripe"
+
+    def __str__(self):
+        return f"{self.event_type} ({self.event_id})"
+
+    @property
+    def confirms_payment(self):
+        if self.event_type == self.CHECKOUT_ASYNC_PAID:
+            return True
+        return (
+            self.event_type == self.CHECKOUT_COMPLETED
+            and self.payment_status in self.PAID_STATUSES
+        )
+
+
+class StripeSyncTask(models.Model):
+    """
+    Очередь синхронизации товаров с продуктами и ценами Stripe: одна строка
+    на товар, повторные изменения товара только сдвигают requested_at
+    """
+
+    item_id = models.IntegerField(  # Без FK: задача переживает удаление товара
+        unique=True,
+        verbose_name="ID товара",
+    )
+    # Для архивации продукта удаленного товара
+    stripe_product_id = models.CharField(
+        max_length=255,
+        blank=True,
+        null=True,
+        verbose_name="ID продукта Stripe",
+    )
+    requested_at = models.DateTimeField(
+        verbose_name="Запрошено",
+    )
+    next_attempt_at = models.DateTimeField(
+        db_index=True,
+        verbose_name="Следующая попытка",
+    )
+    attempts = models.IntegerField(
+        default=0,
+        verbose_name="Попыток",
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name="Последняя ошибка",
+    )
+
+    class Meta:
+        verbose_name = "Синхронизация товара со Stripe"
+        verbose_name_plural = "Синхронизация товаров со Stripe"
+
+    def __str__(self):
+        return f"Товар #{self.item_id}"
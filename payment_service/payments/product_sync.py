@@ -0,0 +1,154 @@
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from items.models import Item
+
+from .models import StripeSyncTask
+
+# Пока воркер ходит в Stripe, взятые задачи не достанутся другим воркерам
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+def enqueue_item_sync(item_ids, stripe_product_ids=None):
+    """
+    Ставит товары в очередь синхронизации. Уже ожидающая задача товара
+    не дублируется, а запрашивается заново со сбросом счетчика попыток
+    """
+    stripe_product_ids = stripe_product_ids or {}
+    now = timezone.now()
+    StripeSyncTask.objects.bulk_create(
+        [
+            StripeSyncTask(
+                item_id=item_id,
+                stripe_product_id=stripe_product_ids.get(item_id),
+                requested_at=now,
+                next_attempt_at=now,
+            )
+            for item_id in item_ids
+        ],
+        update_conflicts=True,
+        unique_fields=["item_id"],
+        batch_size=1000,
+        update_fields=[
+            "stripe_product_id",
+            "requested_at",
+            "next_attempt_at",
+            "attempts",
+            "last_error",
+        ],
+    )
+
+
+def sync_item(item, requested_at):
+    """Создает или обновляет продукт и цену Stripe для товара"""
+    product_id = item.stripe_product_id
+    if product_id is None:
+        product = stripe.Product.create(
+            name=item.name,
+            description=item.description,
+            metadata={"item_id": item.pk},
+            idempotency_key=f"item-product:{item.pk}",
+        )
+        product_id = product.id
+        Item.objects.filter(pk=item.pk).update(stripe_product_id=product_id)
+
+    price_id = item.synced_stripe_price_id
+    if price_id is None:
+        # Цены Stripe неизменяемы: новая сумма - новая цена. Ключ включает
+        # время запроса, чтобы возврат к прежней сумме не вернул архивную цену
+        timestamp = requested_at.timestamp()
+        price = stripe.Price.create(
+            product=product_id,
+            unit_amount=item.price,
+            currency="usd",
+            idempotency_key=f"item-price:{item.pk}:{item.price}:{timestamp}",
+        )
+        price_id = price.id
+    stripe.Product.modify(
+        product_id,
+        name=item.name,
+        description=item.description,
+        default_price=price_id,
+    )
+    if item.stripe_price_id and item.stripe_price_id != price_id:
+        stripe.Price.modify(item.stripe_price_id, active=False)
+    # update() вместо save(): не вызываем сигналы и новую синхронизацию
+    Item.objects.filter(pk=item.pk).update(
+        stripe_price_id=price_id, stripe_price_amount=item.price
+    )
+
+
+def archive_product(product_id):
+    if product_id:
+        stripe.Product.modify(product_id, active=False)
+
+
+def claim_tasks(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        tasks = list(
+            StripeSyncTask.objects.filter(next_attempt_at__lte=now)
+            .select_for_update(skip_locked=True)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        StripeSyncTask.objects.filter(
+            pk__in=[task.pk for task in tasks],
+        ).update(next_attempt_at=now + CLAIM_TIMEOUT)
+    return tasks
+
+
+def _unchanged(tasks):
+    # Товар, измененный во время синхронизации, остается в очереди
+    return reduce(
+        or_, (Q(pk=task.pk, requested_at=task.requested_at) for task in tasks)
+    )
+
+
+def retry_delay(attempts):
+    return timedelta(
+        seconds=min(
+            settings.STRIPE_SYNC_RETRY_DELAY * 2 ** (attempts - 1),
+            settings.STRIPE_SYNC_MAX_RETRY_DELAY,
+        )
+    )
+
+
+def process_sync_tasks(batch_size):
+    """
+    Синхронизирует пачку товаров со Stripe. Ошибки Stripe (включая
+    открытый предохранитель) откладывают задачу с растущей задержкой.
+    Возвращает количество взятых задач
+    """
+    tasks = claim_tasks(batch_size)
+    if not tasks:
+        return 0
+
+    items = Item.objects.in_bulk([task.item_id for task in tasks])
+    synced = []
+    for task in tasks:
+        item = items.get(task.item_id)
+        try:
+            if item is None:
+                archive_product(task.stripe_product_id)
+            else:
+                sync_item(item, task.requested_at)
+        except stripe.error.StripeError as error:
+            delay = retry_delay(task.attempts + 1)
+            StripeSyncTask.objects.filter(_unchanged([task])).update(
+                attempts=F("attempts") + 1,
+                next_attempt_at=timezone.now() + delay,
+                last_error=str(error),
+            )
+        else:
+            synced.append(task)
+
+    if synced:
+        StripeSyncTask.objects.filter(_unchanged(synced)).delete()
+    return len(tasks)
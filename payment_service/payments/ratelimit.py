@@ -0,0 +1,142 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+
+from config.metrics import RATE_LIMITED
+
+from .utils import get_client_ip
+
+RATE_LIMIT_ERROR = "Слишком много запросов, попробуйте позже"
+
+# Ведро в Redis: пополнение и списание одним атомарным скриптом,
+# время берется у Redis, чтобы часы воркеров не расходились
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated_at", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(retry_after)
+"""
+
+
+class LocalTokenBuckets:
+    """
+    Ведра в памяти процесса: без Redis и когда он недоступен.
+    Лимит тогда действует на каждый воркер отдельно
+    """
+
+    def __init__(self, max_buckets=10000):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """0, если токен списан, иначе через сколько секунд он появится"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            retry_after = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            # Ведра давно не приходивших клиентов вытесняются первыми
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class RateLimiter:
+    # Сколько секунд после ошибки Redis считать только в памяти
+    REDIS_RETRY_INTERVAL = 5
+
+    def __init__(self, redis_url=None):
+        self.local = LocalTokenBuckets()
+        self.script = None
+        self.redis_retry_at = 0
+        if redis_url:
+            client = redis.Redis.from_url(
+                redis_url, socket_timeout=0.1, socket_connect_timeout=0.1
+            )
+            self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key, rate, burst):
+        if self.script is not None and time.monotonic() >= self.redis_retry_at:
+            try:
+                return float(
+                    self.script(keys=[f"ratelimit:{key}"], args=[rate, burst]),
+                )
+            except redis.RedisError:
+                retry_in = self.REDIS_RETRY_INTERVAL
+                self.redis_retry_at = time.monotonic() + retry_in
+        return self.local.take(key, rate, burst)
+
+
+# Клиент Redis создается в воркере при первом запросе, а не в мастере
+rate_limiter = SimpleLazyObject(lambda: RateLimiter(settings.REDIS_URL))
+
+
+def check_rate_limits(client_ip):
+    """
+    Списывает токен из ведра клиента и из общего ведра.
+    Возвращает (scope, retry_after) для отказа или None
+    """
+    limits = (
+        (
+            "ip",
+            f"ip:{client_ip}",
+            settings.RATE_LIMIT_IP_RATE,
+            settings.RATE_LIMIT_IP_BURST,
+        ),
+        (
+            "global",
+            "global",
+            settings.RATE_LIMIT_GLOBAL_RATE,
+            settings.RATE_LIMIT_GLOBAL_BURST,
+        ),
+    )
+    for scope, key, rate, burst in limits:
+        retry_after = rate_limiter.take(key, rate, burst)
+        if retry_after:
+            return scope, max(1, math.ceil(retry_after))
+    return None
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    """
+    Лимит на вьюхи, которые ходят в Stripe (RATE_LIMITED_VIEWS): сверх
+    лимита клиент сразу получает 429 с Retry-After, не занимая воркер
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.resolver_match.url_name not in settings.RATE_LIMITED_VIEWS:
+            return None
+        rejected = check_rate_limits(get_client_ip(request))
+        if rejected is None:
+            return None
+        scope, retry_after = rejected
+        RATE_LIMITED.labels(scope).inc()
+        response = JsonResponse({"error": RATE_LIMIT_ERROR}, status=429)
+        response.headers["Retry-After"] = str(retry_after)
+        return response
@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from items.models import Item
+from items.signals import items_imported
+
+from .product_sync import enqueue_item_sync
+
+# Поля товара, которые попадают в продукт и цену Stripe
+STRIPE_FIELDS = {"name", "description", "price"}
+
+
+@receiver(post_save, sender=Item)
+def sync_saved_item(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not STRIPE_FIELDS & set(update_fields):
+        return
+    enqueue_item_sync([instance.pk])
+
+
+@receiver(post_delete, sender=Item)
+def archive_deleted_item(sender, instance, **kwargs):
+    enqueue_item_sync([instance.pk], {instance.pk: instance.stripe_product_id})
+
+
+@receiver(items_imported)
+def sync_imported_items(sender, item_ids, **kwargs):
+    enqueue_item_sync(item_ids)
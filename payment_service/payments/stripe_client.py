@@ -0,0 +1,253 @@
+import math
+import ssl
+import threading
+import time
+
+import httpx
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from config.metrics import STRIPE_ERRORS, STRIPE_REQUEST_LATENCY
+
+
+class StripeUnavailableError(stripe.error.APIConnectionError):
+    """
+    Запрос в Stripe не отправлялся, повторить его можно через
+    retry_after секунд
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(StripeUnavailableError):
+    pass
+
+
+class StripeBusyError(StripeUnavailableError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold неудачных вызовов подряд перестаем ходить в Stripe
+    на reset_timeout секунд, затем пропускаем один пробный запрос
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def seconds_until_retry(self):
+        opened_at = self._opened_at
+        if opened_at is None:
+            return 0
+        return max(0, self.reset_timeout - (time.monotonic() - opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class ConcurrencyLimiter:
+    """
+    Не больше limit одновременных запросов в Stripe на процесс. Лишние
+    сразу отклоняются, а не ждут в очереди, занимая гринлеты воркера
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self._in_flight >= self.limit:
+                return False
+            self._in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+
+class CircuitBreakerMixin:
+    """
+    Оборачивает вызов со всеми повторами stripe-python: повторы с
+    экспоненциальной задержкой и джиттером делает сама библиотека
+    (stripe.max_network_retries), предохранитель считает только итог
+    """
+
+    def __init__(self, *args, breaker, limiter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker
+        self.limiter = limiter
+
+    def _admit(self):
+        if not self.breaker.allow_request():
+            STRIPE_ERRORS.labels("circuit_open").inc()
+            raise CircuitOpenError(
+                "Stripe временно недоступен, попробуйте позже",
+                retry_after=max(
+                    1,
+                    math.ceil(self.breaker.seconds_until_retry()),
+                ),
+            )
+        if not self.limiter.try_acquire():
+            STRIPE_ERRORS.labels("busy").inc()
+            raise StripeBusyError(
+                "Слишком много одновременных оплат, попробуйте позже",
+                retry_after=1,
+            )
+
+    def _record(self, response, started):
+        status = response[1]
+        if status >= 500:
+            self.breaker.record_failure()
+            STRIPE_ERRORS.labels("server_error").inc()
+        else:
+            self.breaker.record_success()
+            if status >= 400:
+                STRIPE_ERRORS.labels("client_error").inc()
+        STRIPE_REQUEST_LATENCY.labels(f"{status // 100}xx").observe(
+            time.perf_counter() - started
+        )
+
+    def _record_connection_error(self, started):
+        self.breaker.record_failure()
+        STRIPE_ERRORS.labels("connection").inc()
+        STRIPE_REQUEST_LATENCY.labels("connection_error").observe(
+            time.perf_counter() - started
+        )
+
+    def request_with_retries(self, *args, **kwargs):
+        self._admit()
+        started = time.perf_counter()
+        try:
+            response = super().request_with_retries(*args, **kwargs)
+        except stripe.error.APIConnectionError:
+            self._record_connection_error(started)
+            raise
+        finally:
+            self.limiter.release()
+        self._record(response, started)
+        return response
+
+    async def request_with_retries_async(self, *args, **kwargs):
+        self._admit()
+        started = time.perf_counter()
+        try:
+            response = await super().request_with_retries_async(
+                *args,
+                **kwargs,
+            )
+        except stripe.error.APIConnectionError:
+            self._record_connection_error(started)
+            raise
+        finally:
+            self.limiter.release()
+        self._record(response, started)
+        return response
+
+
+class StripeRequestsClient(CircuitBreakerMixin, stripe.RequestsClient):
+    pass
+
+
+class StripeHTTPXClient(CircuitBreakerMixin, stripe.HTTPXClient):
+    def __init__(self, *args, limits, allow_sync_methods=False, **kwargs):
+        super().__init__(
+            *args,
+            allow_sync_methods=allow_sync_methods,
+            **kwargs,
+        )
+        # stripe.HTTPXClient не принимает лимиты пула, пересоздаем клиентов
+        verify = ssl.create_default_context(cafile=stripe.ca_bundle_path)
+        self._client_async = httpx.AsyncClient(verify=verify, limits=limits)
+        if allow_sync_methods:
+            self._client = httpx.Client(verify=verify, limits=limits)
+
+
+def build_requests_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.STRIPE_POOL_SIZE,
+        max_retries=0,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def build_http_client(breaker=None):
+    breaker = breaker or CircuitBreaker(
+        settings.STRIPE_CIRCUIT_FAILURE_THRESHOLD,
+        settings.STRIPE_CIRCUIT_RESET_TIMEOUT,
+    )
+    # Общий лимит на синхронный и асинхронный клиенты процесса
+    limiter = ConcurrencyLimiter(settings.STRIPE_MAX_IN_FLIGHT)
+    httpx_client = StripeHTTPXClient(
+        breaker=breaker,
+        limiter=limiter,
+        timeout=httpx.Timeout(
+            settings.STRIPE_READ_TIMEOUT,
+            connect=settings.STRIPE_CONNECT_TIMEOUT,
+        ),
+        limits=httpx.Limits(
+            max_connections=settings.STRIPE_POOL_SIZE,
+            max_keepalive_connections=settings.STRIPE_POOL_SIZE,
+            keepalive_expiry=settings.STRIPE_KEEPALIVE_EXPIRY,
+        ),
+        allow_sync_methods=settings.SERVER_MODE == "asgi",
+    )
+    if settings.SERVER_MODE == "asgi":
+        return httpx_client
+
+    return StripeRequestsClient(
+        breaker=breaker,
+        limiter=limiter,
+        session=build_requests_session(),
+        timeout=(
+            settings.STRIPE_CONNECT_TIMEOUT,
+            settings.STRIPE_READ_TIMEOUT,
+        ),
+        async_fallback_client=httpx_client,
+    )
+
+
+def configure_stripe():
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    if settings.STRIPE_API_VERSION:
+        stripe.api_version = settings.STRIPE_API_VERSION
+    if settings.STRIPE_API_BASE:
+        stripe.api_base = settings.STRIPE_API_BASE
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    stripe.default_http_client = build_http_client()
@@ -0,0 +1,1138 @@
+import csv
+import json
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from io import StringIO
+from unittest import mock, skipUnless
+
+import redis
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import (
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from config.cache import shared_caches
+from config.test_utils import (
+    TEST_CACHES,
+    TEST_STORAGES,
+    load_gunicorn_config,
+)
+from items.models import (
+    AdjustmentType,
+    Discount,
+    Item,
+    Order,
+    OrderItem,
+    RollupGranularity,
+    SalesRollup,
+    Tax,
+)
+from items.pricing import invalidate_rules
+from items.rollups import period_start, rebuild_rollups
+
+from . import checkout, ratelimit
+from .fake_stripe import FakeStripeServer, sign_webhook
+from .models import StripeSyncTask, WebhookEvent
+from .product_sync import process_sync_tasks
+from .reports import EXPORT_FIELDS
+from .stripe_client import CircuitOpenError, StripeBusyError, build_http_client
+from .utils import get_client_ip
+from .webhooks import enqueue_event, process_pending_events
+
+try:
+    import redislite
+except ImportError:
+    redislite = None
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    STORAGES=TEST_STORAGES,
+    SECURE_SSL_REDIRECT=False,
+    RATE_LIMITED_VIEWS=set(),
+    STRIPE_SECRET_KEY="sk_test_fake",
+)
+class FakeStripeTestCase(TestCase):
+    """Тесты с локальной заглушкой Stripe API вместо api.stripe.com"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stripe = cls.enterClassContext(FakeStripeServer())
+        cls.addClassCleanup(setattr, stripe, "api_base", stripe.api_base)
+        cls.addClassCleanup(setattr, stripe, "api_key", stripe.api_key)
+        # Ключ из окружения не нужен: заглушка принимает любой
+        stripe.api_base = cls.stripe.api_base
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+
+    def setUp(self):
+        cache.clear()
+        invalidate_rules()
+        self.stripe.latency = 0
+        self.stripe.failures = 0
+        self.stripe.requests = 0
+        self.stripe.connections.clear()
+        # Между тестами ключи идемпотентности совпадают
+        self.stripe.replies.clear()
+
+    def stripe_object(self, object_id):
+        return self.stripe.objects[object_id]
+
+
+class CheckoutSessionTests(FakeStripeTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = Item.objects.create(
+            name="Кружка",
+            description="Белая",
+            price=1500,
+        )
+        cls.other_item = Item.objects.create(
+            name="Футболка", description="", price=2500
+        )
+
+    def buy(self, item, quantity=1, client=None):
+        client = client or self.client
+        response = client.post(
+            reverse("create_checkout_session", args=[item.pk]),
+            {"quantity": quantity},
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()["id"]
+
+    def test_creates_session_and_order(self):
+        session_id = self.buy(self.item, quantity=2)
+
+        self.assertEqual(self.stripe.requests, 1)
+        session = self.stripe_object(session_id)
+        self.assertEqual(session["mode"], "payment")
+        self.assertEqual(session["line_items[0][quantity]"], "2")
+        self.assertEqual(
+            session["line_items[0][price_data][unit_amount]"],
+            "1500",
+        )
+        order = Order.objects.with_items().get(stripe_session_id=session_id)
+        self.assertEqual(order.total_amount, 3000)
+        lines = order.order_items.all()
+        self.assertEqual(
+            [(line.item_id, line.quantity) for line in lines],
+            [(self.item.pk, 2)],
+        )
+
+    def test_reuses_session_for_same_client_and_quantity(self):
+        session_id = self.buy(self.item)
+
+        self.assertEqual(self.buy(self.item), session_id)
+        self.assertEqual(self.stripe.requests, 1)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_reuses_open_order_when_cache_is_empty(self):
+        session_id = self.buy(self.item)
+        cache.clear()
+
+        self.assertEqual(self.buy(self.item), session_id)
+        self.assertEqual(self.stripe.requests, 1)
+
+    def test_new_session_for_other_quantity_item_or_client(self):
+        session_id = self.buy(self.item)
+        other_client = self.client_class(HTTP_USER_AGENT="other-browser")
+
+        session_ids = {
+            self.buy(self.item, quantity=2),
+            self.buy(self.other_item),
+            self.buy(self.item, client=other_client),
+        }
+
+        self.assertNotIn(session_id, session_ids)
+        self.assertEqual(len(session_ids), 3)
+        self.assertEqual(self.stripe.requests, 4)
+
+    def test_clients_behind_one_address_get_own_sessions(self):
+        # Один IP и User-Agent, но разные браузеры - разные CSRF cookie
+        clients = [self.client_class(), self.client_class()]
+        clients[0].cookies[settings.CSRF_COOKIE_NAME] = "a" * 32
+        clients[1].cookies[settings.CSRF_COOKIE_NAME] = "b" * 32
+
+        session_ids = {self.buy(self.item, client=c) for c in clients}
+
+        self.assertEqual(len(session_ids), 2)
+        self.assertEqual(self.stripe.requests, 2)
+
+    def test_double_click_before_session_cookie_reuses_session(self):
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = "a" * 32
+        session_id = self.buy(self.item)
+        # Второй POST ушел до того, как браузер сохранил cookie сессии
+        del self.client.cookies[settings.SESSION_COOKIE_NAME]
+
+        self.assertEqual(self.buy(self.item), session_id)
+        self.assertEqual(self.stripe.requests, 1)
+
+    def test_new_session_after_payment(self):
+        session_id = self.buy(self.item)
+        Order.objects.filter(stripe_session_id=session_id).update(is_paid=True)
+        cache.clear()
+
+        new_session_id = self.buy(self.item)
+
+        self.assertNotEqual(new_session_id, session_id)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_invalid_quantity(self):
+        response = self.client.post(
+            reverse("create_checkout_session", args=[self.item.pk]),
+            {"quantity": 0},
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stripe.requests, 0)
+
+    def test_stripe_error(self):
+        self.stripe.failures = 10
+
+        response = self.client.post(
+            reverse("create_checkout_session", args=[self.item.pk]),
+            {"quantity": 1},
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_requires_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        requests = [
+            (
+                reverse("create_checkout_session", args=[self.item.pk]),
+                "quantity=2",
+                "application/x-www-form-urlencoded",
+            ),
+            (
+                reverse("create_cart_checkout_session"),
+                json.dumps({"items": [{"id": self.item.pk}]}),
+                "application/json",
+            ),
+        ]
+        for url, data, content_type in requests:
+            with self.subTest(url=url):
+                response = client.post(
+                    url,
+                    data,
+                    content_type=content_type,
+                )
+                self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.stripe.requests, 0)
+
+        response = client.get(reverse("csrf_token"))
+        self.assertIn("no-cache", response.headers["Cache-Control"])
+        token = response.json()["token"]
+        for url, data, content_type in requests:
+            with self.subTest(url=url):
+                response = client.post(
+                    url,
+                    data,
+                    content_type=content_type,
+                    headers={"X-CSRFToken": token},
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_cart_session_is_reused_from_session_cookie(self):
+        response = self.client.post(
+            reverse("create_cart_checkout_session"),
+            json.dumps(
+                {
+                    "items": [
+                        {"id": self.item.pk, "quantity": 2},
+                        {"id": self.other_item.pk},
+                    ]
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        session_id = response.json()["id"]
+
+        # Пустой POST повторяет корзину из сессии
+        response = self.client.post(
+            reverse("create_cart_checkout_session"),
+            "",
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.json()["id"], session_id)
+        self.assertEqual(self.stripe.requests, 1)
+        order = Order.objects.get(stripe_session_id=session_id)
+        self.assertEqual(order.total_amount, 2 * 1500 + 2500)
+
+
+class CheckoutPricingTests(FakeStripeTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = Item.objects.create(
+            name="Кружка",
+            description="",
+            price=1000,
+        )
+        Discount.objects.create(
+            name="Скидка 10%",
+            description="",
+            discount_type=AdjustmentType.PERCENT,
+            value=10,
+        )
+
+    def buy(self):
+        response = self.client.post(
+            reverse("create_checkout_session", args=[self.item.pk]),
+            {"quantity": 2},
+        )
+        session_id = response.json()["id"]
+        return (
+            self.stripe_object(session_id),
+            Order.objects.get(stripe_session_id=session_id),
+        )
+
+    def test_fixed_tax_is_not_discounted(self):
+        Tax.objects.create(
+            name="Сбор",
+            description="",
+            tax_type=AdjustmentType.FIXED,
+            value=150,
+        )
+
+        session, order = self.buy()
+
+        # Купон действует на позиции, налог - доставка, купон его не трогает
+        self.assertIn("discounts[0][coupon]", session)
+        self.assertNotIn("line_items[1][quantity]", session)
+        rate = "shipping_options[0][shipping_rate_data]"
+        self.assertEqual(session[f"{rate}[display_name]"], "Сбор")
+        self.assertEqual(session[f"{rate}[fixed_amount][amount]"], "150")
+        self.assertEqual(
+            (order.subtotal_amount, order.discount_amount, order.tax_amount),
+            (2000, 200, 150),
+        )
+        self.assertEqual(order.total_amount, 2000 - 200 + 150)
+
+    def test_percent_tax(self):
+        Tax.objects.create(
+            name="НДС",
+            description="",
+            tax_type=AdjustmentType.PERCENT,
+            value=20,
+        )
+
+        session, order = self.buy()
+
+        self.assertIn("line_items[0][tax_rates][0]", session)
+        self.assertNotIn(
+            "shipping_options[0][shipping_rate_data][type]",
+            session,
+        )
+        self.assertEqual(order.tax_amount, 360)
+
+
+class CheckoutQueryCountTests(FakeStripeTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = Item.objects.bulk_create(
+            Item(name=f"Товар {i}", price=100 + i) for i in range(50)
+        )
+
+    # Новая сессия: товар, открытый заказ, номер попытки, скидки и налоги,
+    # get_or_create заказа (2 запроса и 4 точки сохранения) и позиции
+    def test_buy(self):
+        url = reverse("create_checkout_session", args=[self.items[0].pk])
+        with self.assertNumQueries(12):
+            self.client.post(url, {"quantity": 1})
+        # Открытая сессия берется из кэша
+        with self.assertNumQueries(1):
+            self.client.post(url, {"quantity": 1})
+
+    def test_cart(self):
+        cart = json.dumps(
+            {"items": [{"id": item.pk, "quantity": 2} for item in self.items]}
+        )
+        url = reverse("create_cart_checkout_session")
+        with self.assertNumQueries(12):
+            self.client.post(url, cart, content_type="application/json")
+        with self.assertNumQueries(1):
+            self.client.post(url, "", content_type="application/json")
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SharedCacheTests(TestCase):
+    def test_backend_is_shared_between_threads(self):
+        # Под gevent каждый гринлет - отдельный поток для caches
+        found = []
+        threads = [
+            threading.Thread(
+                target=lambda: found.append(caches["default"].shared),
+            )
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        shared = shared_caches["shared"]
+        self.assertEqual(found, [shared, shared])
+        self.assertIs(caches["default"].shared, shared)
+        self.assertTrue(checkout.cache == shared)
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class BenchTests(TransactionTestCase):
+    def bench(self):
+        output = StringIO()
+        # Общая in-memory база SQLite блокирует таблицы при параллельной записи
+        concurrency = 2 if connection.vendor == "postgresql" else 1
+        call_command(
+            "bench",
+            items=30,
+            orders=5,
+            requests=30,
+            concurrency=concurrency,
+            clients=5,
+            stripe_latency=0,
+            webhooks=True,
+            stdout=output,
+        )
+        return json.loads(output.getvalue())["endpoints"]
+
+    def test_queries_per_request(self):
+        endpoints = self.bench()
+
+        for name, report in endpoints.items():
+            with self.subTest(endpoint=name):
+                self.assertEqual(report["errors"], 0)
+        self.assertLessEqual(endpoints["item_list"]["queries_per_request"], 1)
+        self.assertLessEqual(
+            endpoints["item_detail"]["queries_per_request"],
+            1,
+        )
+        self.assertLessEqual(endpoints["checkout"]["queries_per_request"], 12)
+        self.assertLessEqual(endpoints["webhook"]["queries_per_request"], 2)
+        self.assertEqual(endpoints["webhook"]["queue"]["events"], 15)
+        self.assertFalse(Item.objects.exists())
+        self.assertFalse(Order.objects.exists())
+
+    def test_cleanup_deletes_only_its_own_rows(self):
+        # Строки с тем же префиксом, появившиеся в обход проверки
+        item = Item.objects.create(name="bench-0", description="", price=1)
+        order = Order.objects.create(checkout_key="bench-real")
+        event = WebhookEvent.objects.create(
+            event_id="evt_bench-real",
+            event_type=WebhookEvent.CHECKOUT_COMPLETED,
+            stripe_session_id="cs_real",
+            processed_at=timezone.now(),
+        )
+
+        with mock.patch(
+            "payments.management.commands.bench.Command.check_no_bench_data",
+        ):
+            self.bench()
+
+        self.assertQuerySetEqual(Item.objects.all(), [item])
+        self.assertQuerySetEqual(Order.objects.all(), [order])
+        self.assertQuerySetEqual(WebhookEvent.objects.all(), [event])
+
+    def test_refuses_to_run_over_bench_data(self):
+        item = Item.objects.create(name="bench-1", description="", price=1)
+
+        with self.assertRaisesMessage(CommandError, "bench-"):
+            self.bench()
+        self.assertQuerySetEqual(Item.objects.all(), [item])
+
+
+@skipUnless(connection.vendor == "postgresql", "пул соединений - Postgres")
+class PreForkTests(TransactionTestCase):
+    """Мастер gunicorn с preload_app не оставляет воркерам свои соединения"""
+
+    def backend_pids(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pid FROM pg_stat_activity "
+                "WHERE datname = current_database()",
+            )
+            return {pid for (pid,) in cursor.fetchall()}
+
+    def test_pre_fork_closes_connections(self):
+        config = load_gunicorn_config()
+        self.assertTrue(config.preload_app)
+        connection.ensure_connection()
+        pool = connection.pool
+        master_pids = self.backend_pids()
+
+        config.pre_fork(server=None, worker=None)
+
+        self.assertIsNone(connection.connection)
+        if pool is not None:
+            self.assertTrue(pool.closed)
+        # Соединения воркера открываются заново, серверных процессов
+        # от соединений мастера остаться не должно
+        inherited = self.backend_pids() & master_pids
+        deadline = time.monotonic() + 5
+        while inherited and time.monotonic() < deadline:
+            time.sleep(0.05)
+            inherited = self.backend_pids() & master_pids
+        self.assertEqual(inherited, set())
+
+
+class StripeClientTests(FakeStripeTestCase):
+    """Пул соединений, таймауты, повторы и предохранитель клиента Stripe"""
+
+    def make_client(self, retries=0, **overrides):
+        with self.settings(**overrides):
+            http_client = build_http_client()
+        return stripe.StripeClient(
+            "sk_test_x",
+            base_addresses={"api": self.stripe.api_base},
+            http_client=http_client,
+            max_network_retries=retries,
+        )
+
+    def create_session(self, client):
+        return client.v1.checkout.sessions.create(
+            {
+                "mode": "payment",
+                "success_url": "https://example.com/success/",
+                "cancel_url": "https://example.com/cancel/",
+            }
+        )
+
+    def test_reuses_pooled_connection(self):
+        client = self.make_client()
+
+        for _ in range(5):
+            self.create_session(client)
+
+        self.assertEqual(self.stripe.requests, 5)
+        self.assertEqual(len(self.stripe.connections), 1)
+
+    def test_retries_server_errors(self):
+        client = self.make_client(retries=2)
+        self.stripe.failures = 2
+
+        session = self.create_session(client)
+
+        self.assertTrue(session.id.startswith("cs_fake"))
+        self.assertEqual(self.stripe.requests, 3)
+
+    def test_gives_up_after_retries(self):
+        client = self.make_client(retries=1)
+        self.stripe.failures = 2
+
+        with self.assertRaises(stripe.error.APIError):
+            self.create_session(client)
+        self.assertEqual(self.stripe.requests, 2)
+
+    def test_read_timeout(self):
+        client = self.make_client(STRIPE_READ_TIMEOUT=0.1)
+        self.stripe.latency = 0.5
+
+        started = time.monotonic()
+        with self.assertRaises(stripe.error.APIConnectionError):
+            self.create_session(client)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+        # Заглушка досыпает запрос: ждем, чтобы он не попал в другой тест
+        while not self.stripe.requests and time.monotonic() - started < 2:
+            time.sleep(0.05)
+
+    def test_circuit_opens_after_failures(self):
+        client = self.make_client(
+            STRIPE_CIRCUIT_FAILURE_THRESHOLD=2,
+            STRIPE_CIRCUIT_RESET_TIMEOUT=60,
+        )
+        self.stripe.failures = 2
+        for _ in range(2):
+            with self.assertRaises(stripe.error.APIError):
+                self.create_session(client)
+
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.create_session(client)
+
+        self.assertEqual(self.stripe.requests, 2)
+        self.assertGreater(raised.exception.retry_after, 0)
+
+    def test_in_flight_limit(self):
+        client = self.make_client(STRIPE_MAX_IN_FLIGHT=0)
+
+        with self.assertRaises(StripeBusyError):
+            self.create_session(client)
+        self.assertEqual(self.stripe.requests, 0)
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    STORAGES=TEST_STORAGES,
+    SECURE_SSL_REDIRECT=False,
+    RATE_LIMIT_IP_RATE=1,
+    RATE_LIMIT_IP_BURST=2,
+    RATE_LIMIT_GLOBAL_RATE=10,
+    RATE_LIMIT_GLOBAL_BURST=3,
+)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        # Часы ведер в памяти двигает тест, а не реальное время
+        self.now = 1000.0
+        clock = self.enterContext(mock.patch("payments.ratelimit.time"))
+        clock.monotonic.side_effect = lambda: self.now
+        self.limiter = ratelimit.RateLimiter()
+        self.enterContext(
+            mock.patch.object(ratelimit, "rate_limiter", self.limiter),
+        )
+
+    def test_rejected_request_gets_429_with_retry_after(self):
+        item = Item.objects.create(name="Кружка", description="", price=1)
+        url = reverse("create_checkout_session", args=[item.pk])
+
+        # Неверное количество: до Stripe запрос не доходит, но токен тратит
+        data = {"quantity": "x"}
+        responses = [self.client.post(url, data) for _ in range(3)]
+        statuses = [response.status_code for response in responses[:2]]
+        response = responses[2]
+
+        self.assertEqual(statuses, [400, 400])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(
+            response.json(),
+            {"error": ratelimit.RATE_LIMIT_ERROR},
+        )
+
+    def test_ip_and_global_scopes(self):
+        check = ratelimit.check_rate_limits
+
+        self.assertIsNone(check("10.0.0.1"))
+        self.assertIsNone(check("10.0.0.1"))
+        self.assertEqual(check("10.0.0.1"), ("ip", 1))
+        # Отказ по IP не тратит общий токен: третий остался другому клиенту
+        self.assertIsNone(check("10.0.0.2"))
+        self.assertEqual(check("10.0.0.3"), ("global", 1))
+
+    def test_bucket_refills_up_to_burst(self):
+        take = self.limiter.local.take
+        self.assertEqual([take("key", 2, 3) for _ in range(3)], [0, 0, 0])
+        self.assertEqual(take("key", 2, 3), 0.5)
+
+        self.now += 0.5
+        self.assertEqual(take("key", 2, 3), 0)
+        self.assertGreater(take("key", 2, 3), 0)
+
+        # Долгий простой наполняет ведро только до burst
+        self.now += 60
+        self.assertEqual([take("key", 2, 3) for _ in range(4)][-1], 0.5)
+
+    def test_falls_back_to_local_buckets_on_redis_error(self):
+        self.limiter.script = mock.Mock(side_effect=redis.ConnectionError)
+
+        self.assertEqual(self.limiter.take("key", 1, 1), 0)
+        self.assertEqual(self.limiter.take("key", 1, 1), 1)
+        # До REDIS_RETRY_INTERVAL Redis не дергаем, потом пробуем снова
+        self.assertEqual(self.limiter.script.call_count, 1)
+        self.now += self.limiter.REDIS_RETRY_INTERVAL
+        self.limiter.take("key", 1, 1)
+        self.assertEqual(self.limiter.script.call_count, 2)
+
+    def test_least_recently_used_bucket_is_evicted(self):
+        buckets = ratelimit.LocalTokenBuckets(max_buckets=2)
+        buckets.take("a", 1, 1)
+        buckets.take("b", 1, 1)
+        self.assertGreater(buckets.take("a", 1, 1), 0)
+
+        buckets.take("c", 1, 1)
+
+        # Вытеснено "b": к нему обращались раньше всех
+        self.assertGreater(buckets.take("a", 1, 1), 0)
+        self.assertEqual(buckets.take("b", 1, 1), 0)
+
+    @skipUnless(redislite, "нужен redislite")
+    def test_redis_script(self):
+        server = redislite.Redis(
+            self.enterContext(tempfile.TemporaryDirectory()) + "/redis.db",
+        )
+        self.addCleanup(server.shutdown)
+        limiter = ratelimit.RateLimiter(f"unix://{server.socket_file}")
+
+        self.assertEqual([limiter.take("key", 1, 2) for _ in range(2)], [0, 0])
+        retry_after = limiter.take("key", 1, 2)
+
+        self.assertGreater(retry_after, 0)
+        self.assertLessEqual(retry_after, 1)
+        self.assertEqual(
+            set(server.hkeys("ratelimit:key")),
+            {b"tokens", b"updated_at"},
+        )
+        self.assertGreater(server.ttl("ratelimit:key"), 0)
+
+
+class ClientIpTests(SimpleTestCase):
+    def get_ip(self, remote_addr):
+        request = RequestFactory().get(
+            "/",
+            REMOTE_ADDR=remote_addr,
+            HTTP_X_FORWARDED_FOR="1.2.3.4, 10.1.2.3",
+        )
+        return get_client_ip(request)
+
+    @override_settings(TRUSTED_PROXIES=["172.16.0.0/12", "::1"])
+    def test_forwarded_for_only_from_trusted_proxy(self):
+        self.assertEqual(self.get_ip("172.18.0.5"), "10.1.2.3")
+        self.assertEqual(self.get_ip("::1"), "10.1.2.3")
+        # Напрямую заголовок подделывается: берем адрес соединения
+        self.assertEqual(self.get_ip("203.0.113.7"), "203.0.113.7")
+        self.assertEqual(self.get_ip(""), "")
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    SECURE_SSL_REDIRECT=False,
+    STRIPE_WEBHOOK_SECRET="whsec_test",
+)
+class WebhookTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        item = Item.objects.create(name="Кружка", description="", price=1500)
+        cls.order = Order.objects.create(
+            stripe_session_id="cs_test_1",
+            checkout_key="key",
+            stripe_session_expires_at=timezone.now() + timedelta(hours=1),
+            subtotal_amount=1500,
+            total_amount=1500,
+        )
+        cls.order.order_items.create(item=item, quantity=1, unit_price=1500)
+
+    def send(self, event_id, event_type, payment_status="paid", secret=None):
+        payload = json.dumps(
+            {
+                "id": event_id,
+                "object": "event",
+                "type": event_type,
+                "data": {
+                    "object": {
+                        "id": self.order.stripe_session_id,
+                        "object": "checkout.session",
+                        "payment_status": payment_status,
+                    }
+                },
+            }
+        )
+        return self.client.post(
+            reverse("stripe_webhook"),
+            payload,
+            content_type="application/json",
+            headers={
+                "Stripe-Signature": sign_webhook(
+                    payload,
+                    secret or "whsec_test",
+                ),
+            },
+        )
+
+    def process(self):
+        processed = process_pending_events(100)
+        self.order.refresh_from_db()
+        return processed
+
+    def test_rejects_bad_signature(self):
+        response = self.send(
+            "evt_1", WebhookEvent.CHECKOUT_COMPLETED, secret="whsec_other"
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_completed_and_paid(self):
+        self.assertEqual(
+            self.send("evt_1", WebhookEvent.CHECKOUT_COMPLETED).status_code,
+            200,
+        )
+
+        self.assertEqual(self.process(), 1)
+        self.assertTrue(self.order.is_paid)
+        rollup = SalesRollup.objects.get(
+            granularity=RollupGranularity.DAY,
+            item=None,
+        )
+        self.assertEqual(rollup.revenue, 1500)
+
+    def test_duplicate_delivery_is_applied_once(self):
+        for _ in range(2):
+            self.send("evt_1", WebhookEvent.CHECKOUT_COMPLETED)
+        self.send("evt_2", WebhookEvent.CHECKOUT_COMPLETED)
+
+        self.assertEqual(self.process(), 2)
+        rollup = SalesRollup.objects.get(
+            granularity=RollupGranularity.DAY,
+            item=None,
+        )
+        self.assertEqual(rollup.order_count, 1)
+
+    def test_async_payment(self):
+        self.send(
+            "evt_1",
+            WebhookEvent.CHECKOUT_COMPLETED,
+            payment_status="unpaid",
+        )
+        self.process()
+
+        # Сессия завершена, но деньги еще не пришли
+        self.assertFalse(self.order.is_paid)
+        self.assertLessEqual(
+            self.order.stripe_session_expires_at,
+            timezone.now(),
+        )
+
+        self.send("evt_2", WebhookEvent.CHECKOUT_ASYNC_PAID)
+        self.process()
+
+        self.assertTrue(self.order.is_paid)
+
+    def test_expired(self):
+        self.send(
+            "evt_1",
+            WebhookEvent.CHECKOUT_EXPIRED,
+            payment_status="unpaid",
+        )
+        self.process()
+
+        self.assertFalse(self.order.is_paid)
+        self.assertLessEqual(
+            self.order.stripe_session_expires_at,
+            timezone.now(),
+        )
+
+    def test_ignores_other_events(self):
+        response = self.send("evt_1", "payment_intent.created")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.process(), 0)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+# Сутки 25.10.2026 в Берлине длятся 25 часов: часы переводят назад
+@override_settings(TIME_ZONE="Europe/Berlin")
+class SalesRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mug = Item.objects.create(name="Кружка", description="", price=1)
+        cls.tea = Item.objects.create(name="Чай", description="", price=1)
+        cls.orders = [
+            # 00:30 по летнему времени, уже 25.10
+            cls.create_order(
+                "cs_1",
+                utc(2026, 10, 24, 22, 30),
+                [(cls.mug, 2, 1500), (cls.tea, 1, 300)],
+            ),
+            # 13:00 по зимнему времени, те же сутки
+            cls.create_order(
+                "cs_2",
+                utc(2026, 10, 25, 12),
+                [(cls.mug, 1, 1500)],
+            ),
+            # 23:30 24.10 по местному времени
+            cls.create_order(
+                "cs_3",
+                utc(2026, 10, 24, 21, 30),
+                [(cls.tea, 3, 300)],
+            ),
+        ]
+        # Не оплачен: в сводки не попадает
+        cls.create_order(
+            "cs_4",
+            utc(2026, 10, 25, 12),
+            [(cls.mug, 5, 1500)],
+        )
+
+    @staticmethod
+    def create_order(session_id, created_at, lines):
+        order = Order.objects.create(stripe_session_id=session_id)
+        for item, quantity, unit_price in lines:
+            order.order_items.create(
+                item=item,
+                quantity=quantity,
+                unit_price=unit_price,
+            )
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        return order
+
+    def pay(self, *orders):
+        for order in orders:
+            enqueue_event(
+                {
+                    "id": f"evt_{order.stripe_session_id}",
+                    "type": WebhookEvent.CHECKOUT_COMPLETED,
+                    "data": {
+                        "object": {
+                            "id": order.stripe_session_id,
+                            "payment_status": "paid",
+                        },
+                    },
+                }
+            )
+        process_pending_events(100)
+
+    def rollups(self):
+        return sorted(
+            SalesRollup.objects.values_list(
+                "granularity",
+                "period_start",
+                "item_id",
+                "revenue",
+                "units",
+                "order_count",
+            ),
+            key=lambda row: (*row[:2], row[2] or 0),
+        )
+
+    def day_totals(self, start, item=None):
+        return SalesRollup.objects.values_list(
+            "revenue",
+            "units",
+            "order_count",
+        ).get(granularity=RollupGranularity.DAY, period_start=start, item=item)
+
+    def test_day_totals_follow_local_time(self):
+        self.pay(*self.orders)
+
+        # Полночь 25.10 еще по летнему времени, UTC+2
+        day = utc(2026, 10, 24, 22)
+        self.assertEqual(self.day_totals(day), (4800, 4, 2))
+        self.assertEqual(self.day_totals(day, self.mug), (4500, 3, 2))
+        self.assertEqual(self.day_totals(day, self.tea), (300, 1, 1))
+        self.assertEqual(
+            self.day_totals(utc(2026, 10, 23, 22)),
+            (900, 3, 1),
+        )
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.pay(self.orders[0])
+        self.pay(*self.orders[1:])
+        incremental = self.rollups()
+
+        for granularity in RollupGranularity.values:
+            rebuild_rollups(
+                granularity,
+                utc(2026, 10, 23, 22),
+                utc(2026, 10, 25, 23),
+            )
+
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_repeated_hour_is_a_separate_period(self):
+        # 02:30 летнего и 02:30 зимнего времени - разные часы
+        starts = [
+            period_start(
+                utc(2026, 10, 25, hour, 30),
+                RollupGranularity.HOUR,
+            ).astimezone(dt_timezone.utc)
+            for hour in (0, 1)
+        ]
+
+        self.assertEqual(
+            starts,
+            [utc(2026, 10, 25, 0), utc(2026, 10, 25, 1)],
+        )
+
+
+@override_settings(STRIPE_SYNC_RETRY_DELAY=30, STRIPE_SYNC_MAX_RETRY_DELAY=50)
+class ProductSyncTests(FakeStripeTestCase):
+    """Очередь синхронизации товаров с продуктами и ценами Stripe"""
+
+    def setUp(self):
+        super().setUp()
+        # Повторы stripe-python не должны съедать сбои заглушки
+        patcher = mock.patch.object(stripe, "max_network_retries", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.item = Item.objects.create(
+            name="Кружка",
+            description="Белая",
+            price=1500,
+        )
+
+    def task(self):
+        return StripeSyncTask.objects.get(item_id=self.item.pk)
+
+    def make_due(self):
+        StripeSyncTask.objects.update(next_attempt_at=timezone.now())
+
+    def test_save_enqueues_item(self):
+        self.assertEqual(self.task().attempts, 0)
+        # Изменение поля, которого нет в Stripe, задачу не ставит
+        StripeSyncTask.objects.all().delete()
+        self.item.save(update_fields=["updated_at"])
+        self.assertFalse(StripeSyncTask.objects.exists())
+
+    def test_sync_creates_product_and_price(self):
+        self.assertEqual(process_sync_tasks(10), 1)
+
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.stripe_price_amount, 1500)
+        product = self.stripe_object(self.item.stripe_product_id)
+        price = self.stripe_object(self.item.stripe_price_id)
+        self.assertEqual(product["default_price"], self.item.stripe_price_id)
+        self.assertEqual(price["product"], self.item.stripe_product_id)
+        self.assertEqual(price["unit_amount"], "1500")
+        self.assertFalse(StripeSyncTask.objects.exists())
+        self.assertEqual(process_sync_tasks(10), 0)
+
+    def test_failures_back_off(self):
+        for attempts, delay in ((1, 30), (2, 50)):
+            with self.subTest(attempts=attempts):
+                self.stripe.failures = 1
+                started = timezone.now()
+                self.assertEqual(process_sync_tasks(10), 1)
+                task = self.task()
+                self.assertEqual(task.attempts, attempts)
+                self.assertIn("Fake error", task.last_error)
+                self.assertGreaterEqual(
+                    task.next_attempt_at, started + timedelta(seconds=delay)
+                )
+                self.assertLessEqual(
+                    task.next_attempt_at,
+                    timezone.now() + timedelta(seconds=delay),
+                )
+                # До следующей попытки задача воркеру не достается
+                self.assertEqual(process_sync_tasks(10), 0)
+                self.make_due()
+
+        self.assertEqual(process_sync_tasks(10), 1)
+        self.assertFalse(StripeSyncTask.objects.exists())
+        self.item.refresh_from_db()
+        self.assertIsNotNone(self.item.synced_stripe_price_id)
+
+    def test_price_change_replaces_price(self):
+        process_sync_tasks(10)
+        self.item.refresh_from_db()
+        old_price_id = self.item.stripe_price_id
+
+        self.item.price = 2000
+        self.item.save()
+        self.assertEqual(process_sync_tasks(10), 1)
+
+        self.item.refresh_from_db()
+        self.assertNotEqual(self.item.stripe_price_id, old_price_id)
+        self.assertEqual(self.item.stripe_price_amount, 2000)
+        self.assertEqual(self.stripe_object(old_price_id)["active"], "false")
+        product = self.stripe_object(self.item.stripe_product_id)
+        self.assertEqual(product["default_price"], self.item.stripe_price_id)
+
+    def test_deleted_item_archives_product(self):
+        process_sync_tasks(10)
+        self.item.refresh_from_db()
+        product_id = self.item.stripe_product_id
+
+        self.item.delete()
+        self.assertEqual(process_sync_tasks(10), 1)
+        self.assertEqual(self.stripe_object(product_id)["active"], "false")
+        self.assertFalse(StripeSyncTask.objects.exists())
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    STORAGES=TEST_STORAGES,
+    SECURE_SSL_REDIRECT=False,
+)
+class OrderExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", password="admin")
+        mug = Item.objects.create(name="Кружка", description="", price=1250)
+        shirt = Item.objects.create(name="Футболка", description="", price=99)
+        discount = Discount.objects.create(
+            name="Скидка",
+            discount_type=AdjustmentType.FIXED,
+            value=100,
+        )
+        cls.paid = Order.objects.create(
+            stripe_session_id="cs_paid",
+            is_paid=True,
+            discount=discount,
+        )
+        OrderItem.objects.create(order=cls.paid, item=mug, quantity=2)
+        OrderItem.objects.create(order=cls.paid, item=shirt, quantity=3)
+        cls.empty = Order.objects.create()
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def export(self, file_format, **filters):
+        url = reverse("admin:items_order_export", args=[file_format])
+        response = self.client.get(url, filters)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["Content-Disposition"],
+            f'attachment; filename="orders.{file_format}"',
+        )
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv(self):
+        header, *rows = csv.reader(self.export("csv").splitlines())
+
+        self.assertEqual(header, list(EXPORT_FIELDS))
+        paid = dict(zip(header, rows[0]))
+        self.assertEqual(paid["id"], str(self.paid.pk))
+        self.assertEqual(paid["is_paid"], "True")
+        self.assertEqual(paid["discount__name"], "Скидка")
+        self.assertEqual(paid["tax__name"], "")
+        self.assertEqual((paid["lines"], paid["quantity"]), ("2", "5"))
+        self.assertEqual(paid["subtotal_amount"], "27.97")
+        self.assertEqual(paid["discount_amount"], "1.00")
+        self.assertEqual(paid["tax_amount"], "0.00")
+        self.assertEqual(paid["total_amount"], "26.97")
+        # Заказ без позиций: подзапросы дают NULL
+        empty = dict(zip(header, rows[1]))
+        self.assertEqual((empty["lines"], empty["quantity"]), ("", ""))
+
+    def test_jsonl_with_changelist_filter(self):
+        rows = [
+            json.loads(line)
+            for line in self.export("jsonl", is_paid__exact=1).splitlines()
+        ]
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(list(rows[0]), list(EXPORT_FIELDS))
+        self.assertEqual(rows[0]["id"], self.paid.pk)
+        self.assertEqual(rows[0]["lines"], 2)
+        self.assertEqual(rows[0]["quantity"], 5)
+        self.assertEqual(rows[0]["total_amount"], "26.97")
+        self.assertEqual(
+            rows[0]["created_at"],
+            self.paid.created_at.isoformat(),
+        )
+
+    async def test_asgi_stream_matches_wsgi(self):
+        await self.async_client.aforce_login(self.admin)
+        for file_format in ("csv", "jsonl"):
+            with self.subTest(format=file_format):
+                url = reverse("admin:items_order_export", args=[file_format])
+                with override_settings(SERVER_MODE="wsgi"):
+                    wsgi = await sync_to_async(self.export)(file_format)
+                with override_settings(SERVER_MODE="asgi"):
+                    response = await self.async_client.get(url)
+                    self.assertTrue(response.is_async)
+                    asgi = b"".join(
+                        [chunk async for chunk in response.streaming_content],
+                    )
+                self.assertEqual(asgi.decode(), wsgi)
+                self.assertIn(b"26.97", asgi)
@@ -1,7 +1,15 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
+if settings.SERVER_MODE == "asgi":
+    checkout_view = views.AsyncCreateCheckoutStripeSessionView
+    cart_checkout_view = views.AsyncCartCheckoutView
+else:
+    checkout_view = views.CreateCheckoutStripeSessionView
+    cart_checkout_view = views.CartCheckoutView
+
 urlpatterns = [
     path(
         "success/",
@@ -13,9 +21,24 @@ urlpatterns = [
         views.CancelView.as_view(),
         name="cancel",
     ),
+    path(
+        "webhook/",
+        views.StripeWebhookView.as_view(),
+        name="stripe_webhook",
+    ),
+    path(
+        "csrf/",
+        views.CsrfTokenView.as_view(),
+        name="csrf_token",
+    ),
+    path(
+        "cart/",
+        cart_checkout_view.as_view(),
+        name="create_cart_checkout_session",
+    ),
     path(
         "<int:pk>/",
-        views.CreateCheckoutStripeSessionView.as_view(),
+        checkout_view.as_view(),
         name="create_checkout_session",
     ),
 ]
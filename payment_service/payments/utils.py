@@ -0,0 +1,110 @@
+import hashlib
+import ipaddress
+import json
+import secrets
+from functools import lru_cache
+
+from django.conf import settings
+
+MAX_CART_LINES = 100  # Stripe принимает не больше 100 line_items
+CLIENT_ID_SESSION_KEY = "client_id"
+CART_SESSION_KEY = "cart"
+
+
+@lru_cache
+def _trusted_networks(proxies):
+    return [
+        ipaddress.ip_network(proxy.strip(), strict=False)
+        for proxy in proxies
+        if proxy.strip()
+    ]
+
+
+def _is_trusted_proxy(address):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    networks = _trusted_networks(tuple(settings.TRUSTED_PROXIES))
+    return any(address in network for network in networks)
+
+
+def get_client_ip(request):
+    # За nginx REMOTE_ADDR - адрес прокси. Реальный адрес клиента nginx
+    # дописывает в конец X-Forwarded-For, начало заголовка задает сам клиент.
+    # Напрямую заголовок может прислать кто угодно, поэтому ему верим
+    # только от прокси из TRUSTED_PROXIES
+    remote_addr = request.META.get("REMOTE_ADDR", "")
+    forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
+    if forwarded_for and _is_trusted_proxy(remote_addr):
+        return forwarded_for.split(",")[-1].strip()
+    return remote_addr
+
+
+def _initial_client_id(request):
+    # Первые запросы еще без cookie сессии (двойной клик) должны получить
+    # один и тот же ID, иначе каждый создаст свою сессию Stripe. CSRF cookie
+    # у них уже общий и, в отличие от IP за NAT, у каждого браузера свой
+    csrf_secret = request.META.get("CSRF_COOKIE")
+    if not csrf_secret:
+        return secrets.token_urlsafe(24)
+    raw = f"client:{csrf_secret}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def get_client_id(request):
+    """ID покупателя: живет в сессии и не меняется при смене IP"""
+    client_id = request.session.get(CLIENT_ID_SESSION_KEY)
+    if client_id is None:
+        client_id = _initial_client_id(request)
+        request.session[CLIENT_ID_SESSION_KEY] = client_id
+    return client_id
+
+
+async def aget_client_id(request):
+    client_id = await request.session.aget(CLIENT_ID_SESSION_KEY)
+    if client_id is None:
+        client_id = _initial_client_id(request)
+        await request.session.aset(CLIENT_ID_SESSION_KEY, client_id)
+    return client_id
+
+
+def parse_quantity(request):
+    try:
+        quantity = int(request.POST.get("quantity", 1))
+    except ValueError:
+        return None
+    return quantity if quantity >= 1 else None
+
+
+def parse_cart(body):
+    """
+    Разбирает {"items": [{"id": 1, "quantity": 2}, ...]} в
+    {id: количество}
+    """
+    try:
+        entries = json.loads(body)["items"]
+        cart = {}
+        for entry in entries:
+            item_id = int(entry["id"])
+            quantity = int(entry.get("quantity", 1))
+            if quantity < 1:
+                return None
+            cart[item_id] = cart.get(item_id, 0) + quantity
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+    if not cart or len(cart) > MAX_CART_LINES:
+        return None
+    return cart
+
+
+def dump_cart(cart):
+    # JSON сессии хранит ключи строками
+    return {str(pk): quantity for pk, quantity in cart.items()}
+
+
+def restore_cart(value):
+    """Корзина, сохраненная в сессии dump_cart, или None"""
+    if not value:
+        return None
+    return {int(pk): quantity for pk, quantity in value.items()}
@@ -1,50 +1,203 @@
 from django.conf import settings
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.middleware.csrf import get_token
 from django.views.generic import DetailView, TemplateView
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import aget_object_or_404
 from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import never_cache
 import stripe
 
 from items.models import Item
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from .checkout import (
+    aget_or_create_checkout_session,
+    get_or_create_checkout_session,
+)
+from .stripe_client import StripeUnavailableError
+from .utils import (
+    CART_SESSION_KEY,
+    aget_client_id,
+    dump_cart,
+    get_client_id,
+    parse_cart,
+    parse_quantity,
+    restore_cart,
+)
+from .webhooks import enqueue_event
+
+INVALID_QUANTITY_ERROR = "quantity должно быть целым числом >= 1"
+INVALID_CART_ERROR = (
+    'Ожидается {"items": [{"id": <id товара>, "quantity": <количество>}]}'
+)
+ITEM_NOT_FOUND_ERROR = "Товар не найден"
+
+
+def checkout_context(request, client_id):
+    return {
+        "client_id": client_id,
+        "success_url": request.build_absolute_uri(reverse("success")),
+        "cancel_url": request.build_absolute_uri(reverse("cancel")),
+    }
+
+
+def stripe_error_response(error):
+    # Запрос до Stripe не дошел (предохранитель, лимит воркера) - 503,
+    # клиент может повторить через Retry-After
+    if isinstance(error, StripeUnavailableError):
+        response = JsonResponse({"error": str(error)}, status=503)
+        response.headers["Retry-After"] = str(error.retry_after)
+        return response
+    return JsonResponse({"error": str(error)}, status=400)
+
+
+def cart_lines(cart, items):
+    return [(items[pk], quantity) for pk, quantity in cart.items()]
 
 
 class SuccessView(TemplateView):
-    template_name = 'success.html'
+    template_name = "success.html"
 
 
 class CancelView(TemplateView):
-    template_name = 'cancel.html'
+    template_name = "cancel.html"
+
+
+# Покупка создает сессию Stripe и пишет в сессию пользователя, поэтому
+# только POST с CSRF токеном и без кэширования ответа
+def checkout_view(view_class):
+    # never_cache на post: для асинхронных вьюх dispatch синхронный
+    return method_decorator(never_cache, name="post")(view_class)
+
 
+@method_decorator(never_cache, name="dispatch")
+class CsrfTokenView(View):
+    """
+    CSRF токен для покупки. Страницы каталога кэшируются и отдаются без
+    cookie, поэтому скрипт карточек берет токен здесь перед первым POST
+    """
 
+    def get(self, request):
+        return JsonResponse({"token": get_token(request)})
+
+
+@checkout_view
 class CreateCheckoutStripeSessionView(DetailView):
     model = Item
+    http_method_names = ["post", "options"]
 
-    def get(self, request, *args, **kwargs):
+    def post(self, request, *args, **kwargs):
         self.object = self.get_object()
         return self.render_to_response()
 
     def render_to_response(self):
-        item = self.object
+        quantity = parse_quantity(self.request)
+        if quantity is None:
+            return JsonResponse({"error": INVALID_QUANTITY_ERROR}, status=400)
+
+        try:
+            session_id = get_or_create_checkout_session(
+                [(self.object, quantity)],
+                **checkout_context(self.request, get_client_id(self.request)),
+            )
+            return JsonResponse({"id": session_id})
+        except stripe.error.StripeError as e:
+            return stripe_error_response(e)
+
+
+@checkout_view
+class AsyncCreateCheckoutStripeSessionView(View):
+    """Неблокирующий вариант /buy/<pk>/ для запуска через ASGI"""
+
+    async def post(self, request, pk):
+        item = await aget_object_or_404(Item, pk=pk)
+        quantity = parse_quantity(request)
+        if quantity is None:
+            return JsonResponse({"error": INVALID_QUANTITY_ERROR}, status=400)
+
+        try:
+            session_id = await aget_or_create_checkout_session(
+                [(item, quantity)],
+                **checkout_context(request, await aget_client_id(request)),
+            )
+            return JsonResponse({"id": session_id})
+        except stripe.error.StripeError as e:
+            return stripe_error_response(e)
+
+
+@checkout_view
+class CartCheckoutView(View):
+    """
+    Одна сессия Stripe на всю корзину: POST {"items": [...]}. Корзина
+    запоминается в сессии, POST без тела повторяет последнюю
+    """
+
+    def post(self, request):
+        if request.body:
+            cart = parse_cart(request.body)
+        else:
+            cart = restore_cart(request.session.get(CART_SESSION_KEY))
+        if cart is None:
+            return JsonResponse({"error": INVALID_CART_ERROR}, status=400)
+
+        items = Item.objects.in_bulk(cart.keys())
+        if len(items) != len(cart):
+            return JsonResponse({"error": ITEM_NOT_FOUND_ERROR}, status=404)
+        request.session[CART_SESSION_KEY] = dump_cart(cart)
+
+        try:
+            session_id = get_or_create_checkout_session(
+                cart_lines(cart, items),
+                **checkout_context(request, get_client_id(request)),
+            )
+            return JsonResponse({"id": session_id})
+        except stripe.error.StripeError as e:
+            return stripe_error_response(e)
+
+
+@checkout_view
+class AsyncCartCheckoutView(View):
+    async def post(self, request):
+        if request.body:
+            cart = parse_cart(request.body)
+        else:
+            cart = restore_cart(await request.session.aget(CART_SESSION_KEY))
+        if cart is None:
+            return JsonResponse({"error": INVALID_CART_ERROR}, status=400)
+
+        items = await Item.objects.ain_bulk(cart.keys())
+        if len(items) != len(cart):
+            return JsonResponse({"error": ITEM_NOT_FOUND_ERROR}, status=404)
+        await request.session.aset(CART_SESSION_KEY, dump_cart(cart))
 
         try:
-            session = stripe.checkout.Session.create(
-                line_items=[{
-                'price_data': {
-                    'currency': 'usd',
-                    'product_data': {
-                    'name': item.name,
-                    'description': item.description or None,
-                    },
-                    'unit_amount': item.price
-                },
-                'quantity': 1,
-                }],
-                mode='payment',
-                success_url=self.request.build_absolute_uri(reverse('success')),
-                cancel_url=self.request.build_absolute_uri(reverse('cancel')),
+            session_id = await aget_or_create_checkout_session(
+                cart_lines(cart, items),
+                **checkout_context(request, await aget_client_id(request)),
             )
-            return JsonResponse({'id': session.id})
+            return JsonResponse({"id": session_id})
         except stripe.error.StripeError as e:
-            return JsonResponse({'error': str(e)}, status=400)
\ No newline at end of file
+            return stripe_error_response(e)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class StripeWebhookView(View):
+    """
+    Проверяет подпись, кладет событие в очередь и сразу отвечает Stripe.
+    Заказы обновляет воркер process_webhook_events
+    """
+
+    def post(self, request):
+        try:
+            event = stripe.Webhook.construct_event(
+                request.body,
+                request.headers.get("Stripe-Signature", ""),
+                settings.STRIPE_WEBHOOK_SECRET,
+            )
+        except (ValueError, stripe.error.SignatureVerificationError):
+            return HttpResponse(status=400)
+
+        enqueue_event(event)
+        return HttpResponse(status=200)
@@ -0,0 +1,86 @@
+from django.db import transaction
+from django.utils import timezone
+
+from items.models import Order
+from items.rollups import record_paid_orders
+
+from .checkout import forget_checkout_sessions
+from .models import WebhookEvent
+
+
+def enqueue_event(event):
+    """Сохраняет событие в очередь, повторы с тем же ID игнорируются"""
+    if event["type"] not in WebhookEvent.HANDLED_TYPES:
+        return
+    session = event["data"]["object"]
+    WebhookEvent.objects.bulk_create(
+        [
+            WebhookEvent(
+                event_id=event["id"],
+                event_type=event["type"],
+                stripe_session_id=session["id"],
+                payment_status=session.get("payment_status") or "",
+            )
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def process_pending_events(batch_size):
+    """
+    Применяет пачку необработанных событий к заказам: один UPDATE для
+    оплаченных сессий и один для закрытых без оплаты (истекших или
+    завершенных с отложенной оплатой). Возвращает количество событий
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.filter(processed_at__isnull=True)
+            .select_for_update(skip_locked=True)
+            .only("event_type", "stripe_session_id", "payment_status")
+            .order_by("id")[:batch_size]
+        )
+        if not events:
+            return 0
+
+        paid, closed = [], []
+        for event in events:
+            if event.confirms_payment:
+                paid.append(event.stripe_session_id)
+            else:
+                closed.append(event.stripe_session_id)
+
+        orders = Order.objects.for_stripe_sessions(
+            [event.stripe_session_id for event in events]
+        )
+        # Оплаченная или истекшая сессия больше не должна отдаваться из кэша
+        checkout_keys = list(
+            orders.exclude(checkout_key=None).values_list(
+                "checkout_key",
+                flat=True,
+            ),
+        )
+
+        if paid:
+            # Повторное событие об оплате не должно второй раз попасть в сводки
+            newly_paid = list(
+                Order.objects.for_stripe_sessions(paid)
+                .unpaid()
+                .select_for_update()
+                .values_list("pk", flat=True)
+            )
+            Order.objects.filter(pk__in=newly_paid).update(is_paid=True)
+            record_paid_orders(newly_paid)
+        if closed:
+            # Сессию больше нельзя отдавать покупателю, но заказ ждет
+            # async_payment_succeeded, если оплата отложенная
+            Order.objects.for_stripe_sessions(closed).unpaid().update(
+                stripe_session_expires_at=now
+            )
+
+        WebhookEvent.objects.filter(
+            pk__in=[event.pk for event in events],
+        ).update(processed_at=now)
+
+    forget_checkout_sessions(checkout_keys)
+    return len(events)